@@ -4,6 +4,9 @@ from django.contrib import admin
 from django.contrib import admin
 from django.utils.html import format_html
 from .models import Post, Reseña  # Importación local, más limpia
+from products.cache import invalidar_version
+from products.services import CalificacionService
+from products.snapshots import programar_publicacion
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
@@ -30,4 +33,8 @@ class ReseñaAdmin(admin.ModelAdmin):
 
     @admin.action(description='Aprobar reseñas seleccionadas')
     def aprobar_reseñas(self, request, queryset):
-        queryset.update(moderado=True)
\ No newline at end of file
+        # Suma las estrellas de las pendientes a los totales de cada producto
+        CalificacionService.aprobar_lote(queryset)
+        # update() no dispara señales: avisamos a mano que cambió el catálogo
+        invalidar_version('catalogo')
+        programar_publicacion()
\ No newline at end of file
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:24
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0002_alter_post_options_alter_post_autor_and_more'),
+        ('products', '0019_producto_precio_efectivo_indices'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reseña',
+            index=models.Index(fields=['producto', 'moderado', '-fecha', '-id'], name='resena_producto_fecha_idx'),
+        ),
+    ]
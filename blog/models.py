@@ -28,3 +28,9 @@ class Reseña(models.Model):
     comentario = models.TextField(max_length=500)
     fecha = models.DateTimeField(auto_now_add=True)
     moderado = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Reseñas aprobadas de un producto, de la más nueva a la más vieja
+            models.Index(fields=['producto', 'moderado', '-fecha', '-id'], name='resena_producto_fecha_idx'),
+        ]
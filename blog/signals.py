@@ -0,0 +1,9 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from products.cache import invalidar_version
+from .models import Post
+
+
+@receiver([post_save, post_delete], sender=Post)
+def invalidar_blog(sender, **kwargs):
+    invalidar_version('blog')
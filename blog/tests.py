@@ -1,3 +1,23 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+from .models import Post
 
-# Create your tests here.
+
+class PostsCondicionalTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.autor = User.objects.create_user(username='autor', password='clave123')
+        Post.objects.create(titulo="Rituales", slug="rituales", contenido="...", autor=self.autor)
+
+    def test_posts_responde_304_hasta_que_hay_un_post_nuevo(self):
+        url = reverse('blog:blog-lista')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Post.objects.create(titulo="Meditación", slug="meditacion", contenido="...", autor=self.autor)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
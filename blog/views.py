@@ -4,6 +4,7 @@ from rest_framework.response import Response
 from rest_framework import status
 from .models import Post, Reseña
 from products.models import ItemPedido, Producto
+from products.cache import respuesta_condicional
 from products.serializers import PostSerializer, ReseñaSerializer
 from rest_framework.authentication import SessionAuthentication
 
@@ -13,6 +14,7 @@ from rest_framework.authentication import SessionAuthentication
 
 
 # 1. GESTIÓN DE POSTS (Listar y Crear)
+@respuesta_condicional('blog', cache_control={'public': True, 'max_age': 300})
 @api_view(['GET', 'POST'])
 @authentication_classes([SessionAuthentication])
 @permission_classes([AllowAny]) # GET es libre, POST se valida adentro
@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 import mimetypes
 import pymysql
 import ssl
+import tempfile
 
 # 0. CONFIGURACIÓN INICIAL
 pymysql.install_as_MySQLdb()
@@ -56,8 +57,9 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
 
-    # WhiteNoise debe ir justo después de security
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # WhiteNoise debe ir justo después de security (sirve también los
+    # snapshots del catálogo, ver sección 14)
+    'products.middleware.CatalogoWhiteNoiseMiddleware',
 
     # CORS debe ir ANTES de CommonMiddleware
     'corsheaders.middleware.CorsMiddleware',
@@ -197,6 +199,10 @@ EMAIL_USE_SSL = True
 EMAIL_HOST_USER = os.getenv('EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_PASS')
 DEFAULT_FROM_EMAIL = f"Aroma Zen <{os.getenv('EMAIL_USER')}>"
+# Tope de envíos del comando enviar_emails (Gmail limita los mails por minuto)
+# y segundos que espera el servidor SMTP antes de dar la conexión por caída
+EMAIL_POR_MINUTO = int(os.getenv('EMAIL_POR_MINUTO', '60'))
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '20'))
 
 # 10. OTROS
 ROOT_URLCONF = 'core.urls'
@@ -206,6 +212,13 @@ USE_I18N = True
 USE_TZ = True
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MP_ACCESS_TOKEN = os.getenv('MP_ACCESS_TOKEN')
+# Mercado Pago: URL base de la API (los tests la apuntan a un servidor falso)
+# y timeouts en segundos: de lectura de cada llamada y para abrir la conexión
+MP_API_BASE_URL = os.getenv('MP_API_BASE_URL', 'https://api.mercadopago.com')
+MP_TIMEOUT = float(os.getenv('MP_TIMEOUT', '10'))
+MP_TIMEOUT_CONEXION = float(os.getenv('MP_TIMEOUT_CONEXION', '3'))
+# Minutos que un pedido sin pagar retiene el stock (comando liberar_reservas)
+RESERVA_MINUTOS = int(os.getenv('RESERVA_MINUTOS', '15'))
 
 # 11. JAZZMIN (Admin UI)
 JAZZMIN_SETTINGS = {
@@ -227,4 +240,41 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": (
         "rest_framework.permissions.AllowAny",
     ),
-}
\ No newline at end of file
+}
+
+# 13. CACHÉ
+# Compartida entre los workers de Gunicorn: la versión del catálogo que sube
+# un worker tiene que verla el resto. REDIS_URL es obligatoria en cuanto
+# corren los procesos worker/emails/snapshots/clock del Procfile: cada
+# contenedor tiene su propio disco, así que con la caché en archivos lo que
+# invalida un proceso (pagos, reservas, publicación pendiente) no lo ve la web.
+# La caché en archivos queda para desarrollo con un solo proceso.
+REDIS_URL = os.getenv('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', os.path.join(tempfile.gettempdir(), 'aromazen_cache')),
+            # Por defecto Django recorta a 300 archivos, y con las versiones
+            # por producto y las respuestas cacheadas se borrarían a cada rato
+            'OPTIONS': {
+                'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+            },
+        }
+    }
+
+# 14. SNAPSHOTS DEL CATÁLOGO
+# JSON pre-renderados de lista/ofertas/categorias/destacados que WhiteNoise
+# sirve como archivos inmutables. Los cambios del catálogo solo los marcan
+# pendientes (AUTOPUBLICAR); los publica `publicar_catalogo --vigilar`.
+CATALOGO_SNAPSHOTS_ROOT = os.getenv('CATALOGO_SNAPSHOTS_ROOT', os.path.join(BASE_DIR, 'snapshots'))
+CATALOGO_SNAPSHOTS_URL = '/snapshots/'
+CATALOGO_SNAPSHOTS_AUTOPUBLICAR = os.getenv('CATALOGO_SNAPSHOTS_AUTOPUBLICAR', 'True').lower() == 'true'
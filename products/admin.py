@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from .models import CompraLog, Producto, Categoria, ItemPedido, Pedido, Consulta
+from django.utils import timezone
+from .models import CompraLog, EmailOutbox, NotificacionMP, Producto, Categoria, ItemPedido, Pedido, Consulta
 from blog.models import Post
 # --- CONFIGURACIÓN DE ENCABEZADOS ---
 admin.site.site_header = "Panel de Control - Sahumerios AromaZen"
@@ -69,6 +70,7 @@ class PedidoAdmin(admin.ModelAdmin):
         colores = {
             'PENDIENTE': '#d9534f',
             'EN_PROCESO': '#f0ad4e',
+            'A_REVISAR': '#8e44ad',
             'ENTREGADO': '#5cb85c',
             'CANCELADO': '#777',
         }
@@ -103,6 +105,38 @@ class CompraLogAdmin(admin.ModelAdmin):
             '<span style="background-color: #5bc0de; color: white; padding: 3px 8px; border-radius: 5px; font-size: 10px; font-weight: bold;">LOG SISTEMA</span>'
         )
     tipo_log_badge.short_description = "Categoría Log"
+# --- COLA DE NOTIFICACIONES DE MERCADO PAGO ---
+@admin.register(NotificacionMP)
+class NotificacionMPAdmin(admin.ModelAdmin):
+    list_display = ('id', 'tipo', 'recurso_id', 'estado', 'intentos', 'disponible_desde', 'creada')
+    list_filter = ('estado', 'tipo')
+    search_fields = ('recurso_id',)
+    readonly_fields = ('tipo', 'recurso_id', 'payload', 'intentos', 'lease_hasta', 'error', 'creada')
+    actions = ['reencolar']
+
+    @admin.action(description="Volver a encolar (las FALLIDAS se procesan de nuevo)")
+    def reencolar(self, request, queryset):
+        total = queryset.exclude(estado='PROCESANDO').update(
+            estado='PENDIENTE', intentos=0, disponible_desde=timezone.now(), lease_hasta=None,
+        )
+        self.message_user(request, f"{total} notificaciones vueltas a encolar.")
+
+# --- OUTBOX DE EMAILS ---
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'asunto', 'estado', 'intentos', 'disponible_desde', 'creado', 'enviado')
+    list_filter = ('estado',)
+    search_fields = ('asunto', 'destinatarios')
+    readonly_fields = ('asunto', 'mensaje', 'remitente', 'destinatarios', 'intentos', 'error', 'creado', 'enviado')
+    actions = ['reencolar']
+
+    @admin.action(description="Volver a encolar (los FALLIDOS se reintentan)")
+    def reencolar(self, request, queryset):
+        total = queryset.exclude(estado='ENVIADO').update(
+            estado='PENDIENTE', intentos=0, disponible_desde=timezone.now(),
+        )
+        self.message_user(request, f"{total} emails vueltos a encolar.")
+
 # --- CONSULTAS ---
 @admin.register(Consulta)
 class ConsultaAdmin(admin.ModelAdmin):
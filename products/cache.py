@@ -0,0 +1,234 @@
+import hashlib
+import time
+from functools import wraps
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+# Las respuestas se guardan bajo la versión vigente, así que nunca hace falta
+# borrarlas: al subir la versión quedan huérfanas y expiran solas.
+TIEMPO_RESPUESTA = 60 * 60 * 24
+
+
+def obtener_version(nombre='catalogo'):
+    """Versión actual de un conjunto de datos (timestamp en nanosegundos)."""
+    clave = f"version:{nombre}"
+    version = cache.get(clave)
+    if version is None:
+        version = time.time_ns()
+        # add() no pisa la versión que otro worker haya escrito recién
+        if not cache.add(clave, version, None):
+            version = cache.get(clave, version)
+    return version
+
+
+def subir_version(nombre='catalogo'):
+    """Sube la versión en el acto y devuelve la nueva."""
+    version = time.time_ns()
+    cache.set(f"version:{nombre}", version, None)
+    return version
+
+
+def incrementar_version(nombre):
+    """
+    Suma uno a la versión con el INCR atómico de la caché y devuelve la
+    nueva: dos procesos que suben a la vez nunca reciben el mismo número.
+    """
+    clave = f"version:{nombre}"
+    try:
+        return cache.incr(clave)
+    except ValueError:
+        # Todavía no existía: se crea y se vuelve a sumar
+        obtener_version(nombre)
+        return cache.incr(clave)
+
+
+def invalidar_version(nombre='catalogo'):
+    """
+    Sube la versión ahora y de nuevo al confirmar la transacción, para que
+    ninguna lectura concurrente deje cacheados datos previos al commit.
+    """
+    subir_version(nombre)
+    transaction.on_commit(lambda: subir_version(nombre))
+
+
+def versiones_productos(ids, base=None):
+    """
+    Versión de disponibilidad (stock y reservado) de cada producto:
+    {id: versión}. La que todavía no existe arranca en `base`, la versión
+    vigente del catálogo.
+    """
+    claves = {producto_id: f"version:producto:{producto_id}" for producto_id in ids}
+    guardadas = cache.get_many(list(claves.values()))
+    for clave in claves.values():
+        if clave not in guardadas:
+            if base is None:
+                base = obtener_version('catalogo')
+            guardadas[clave] = base if cache.add(clave, base, None) else cache.get(clave, base)
+    return {producto_id: guardadas[clave] for producto_id, clave in claves.items()}
+
+
+def invalidar_productos(ids):
+    """
+    Como invalidar_version(), pero solo para la disponibilidad de `ids`: las
+    respuestas que muestran otros productos siguen valiendo.
+    """
+    claves = [f"version:producto:{producto_id}" for producto_id in ids]
+    if not claves:
+        return
+
+    def subir():
+        cache.set_many(dict.fromkeys(claves, time.time_ns()), None)
+    subir()
+    transaction.on_commit(subir)
+
+
+def ids_productos(response):
+    """IDs de los productos que muestra una respuesta del catálogo (lista o página con 'results')."""
+    ids = getattr(response, 'productos', None)
+    if ids is None:
+        datos = getattr(response, 'data', None)
+        if isinstance(datos, dict):
+            datos = datos.get('results')
+        ids = [dato['id'] for dato in datos or () if isinstance(dato, dict) and 'id' in dato]
+    return ids
+
+
+def _dependencias(ids, base, desde):
+    """
+    Versiones de los productos de una respuesta renderizada a partir de
+    `desde` (time_ns). Una versión posterior puede ser de un cambio que el
+    render no llegó a ver: queda en None y la respuesta no se reutiliza.
+    """
+    return {
+        producto_id: version if version < desde else None
+        for producto_id, version in versiones_productos(ids, base).items()
+    }
+
+
+def cachear_respuesta(nombre='catalogo', timeout=TIEMPO_RESPUESTA, productos=False):
+    """
+    Decorador para vistas GET públicas: guarda los bytes ya renderizados
+    bajo la versión de `nombre` y la URL completa. Un acierto devuelve el
+    contenido sin tocar el ORM ni los serializers de DRF.
+    Con `productos` la respuesta guarda además la versión de disponibilidad
+    de cada producto que muestra: una reserva o un pago invalida solo las
+    respuestas donde aparecen esos productos, no todo el catálogo.
+    Va por encima de @api_view.
+    """
+    def decorador(vista):
+        @wraps(vista)
+        def _vista(request, *args, **kwargs):
+            # El navegador de la API (text/html) no se cachea
+            if request.method != 'GET' or 'text/html' in request.META.get('HTTP_ACCEPT', ''):
+                return vista(request, *args, **kwargs)
+
+            version = obtener_version(nombre)
+            ruta = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+            clave = f"respuesta:{nombre}:{version}:{ruta}"
+            guardada = cache.get(clave)
+            if guardada is not None:
+                contenido, content_type = guardada[:2]
+                dependencias = guardada[2] if len(guardada) > 2 else {}
+                if not dependencias or versiones_productos(dependencias, version) == dependencias:
+                    response = HttpResponse(contenido, content_type=content_type)
+                    if productos:
+                        response.productos = list(dependencias)
+                    return response
+
+            desde = time.time_ns()
+            response = vista(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                if hasattr(response, 'render'):
+                    response.render()
+                dependencias = {}
+                if productos:
+                    response.productos = ids_productos(response)
+                    dependencias = _dependencias(response.productos, version, desde)
+                cache.set(clave, (response.content, response['Content-Type'], dependencias), timeout)
+            return response
+        return _vista
+    return decorador
+
+
+def _validadores(version, ruta, dependencias=None):
+    """ETag y última modificación (en nanosegundos) de `ruta` bajo `version` y sus productos."""
+    if not dependencias:
+        firma, ultima = f"{version}:{ruta}", version
+    else:
+        firma = f"{version}:{ruta}:{sorted(dependencias.items())}"
+        ultima = max([version] + [v if v is not None else time.time_ns() for v in dependencias.values()])
+    return quote_etag(hashlib.md5(firma.encode()).hexdigest()), ultima
+
+
+def _last_modified(version):
+    """
+    Last-Modified (en segundos) de una versión en nanosegundos, o None si
+    todavía no sirve como validador. Se redondea para arriba y solo vale una
+    vez pasado ese segundo: antes podría llegar otro cambio con el mismo
+    Last-Modified y un If-Modified-Since recibiría un 304 viejo.
+    """
+    segundos = -(-version // 1_000_000_000)
+    return segundos if time.time() >= segundos else None
+
+
+def respuesta_condicional(nombre_version, cache_control=None, vary=('Accept',), productos=False):
+    """
+    Agrega ETag/Last-Modified derivados de una versión y responde 304 a
+    If-None-Match/If-Modified-Since antes de que corra la vista.
+    `nombre_version` es el nombre de la versión o una función(request) que lo
+    devuelve (por ejemplo, una versión por usuario). Si la función necesita
+    request.user autenticado por DRF, el decorador va debajo de @api_view.
+    Con `productos` los validadores incluyen la disponibilidad de los
+    productos que mostró la última respuesta de esa URL.
+    """
+    cache_control = cache_control or {}
+
+    def decorador(vista):
+        @wraps(vista)
+        def _vista(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return vista(request, *args, **kwargs)
+
+            nombre = nombre_version(request) if callable(nombre_version) else nombre_version
+            version = obtener_version(nombre)
+            ruta = request.get_full_path()
+
+            response = etag = None
+            if productos:
+                clave_ids = f"productos:{nombre}:{version}:{hashlib.md5(ruta.encode()).hexdigest()}"
+                ids = cache.get(clave_ids)
+                # Sin saber qué productos muestra la URL no se valida antes de la vista
+                if ids is not None:
+                    etag, ultima_modificacion = _validadores(version, ruta, versiones_productos(ids, version))
+            else:
+                etag, ultima_modificacion = _validadores(version, ruta)
+            if etag is not None:
+                # Con If-None-Match valida solo el ETag (If-Modified-Since se ignora)
+                response = get_conditional_response(
+                    request, etag=etag,
+                    last_modified=None if 'HTTP_IF_NONE_MATCH' in request.META else _last_modified(ultima_modificacion),
+                )
+
+            if response is None:
+                desde = time.time_ns()
+                response = vista(request, *args, **kwargs)
+                if productos and response.status_code == 200:
+                    ids = ids_productos(response)
+                    cache.set(clave_ids, ids, TIEMPO_RESPUESTA)
+                    etag, ultima_modificacion = _validadores(version, ruta, _dependencias(ids, version, desde))
+
+            if response.status_code in (200, 304):
+                if etag is not None and not response.has_header('ETag'):
+                    response['ETag'] = etag
+                if etag is not None and not response.has_header('Last-Modified'):
+                    segundos = _last_modified(ultima_modificacion)
+                    if segundos is not None:
+                        response['Last-Modified'] = http_date(segundos)
+                patch_cache_control(response, **cache_control)
+                patch_vary_headers(response, vary)
+            return response
+        return _vista
+    return decorador
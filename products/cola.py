@@ -0,0 +1,141 @@
+"""
+Cola de notificaciones de Mercado Pago sobre la base de datos.
+
+El webhook solo hace `encolar()` (un INSERT) y responde 200; el comando
+procesar_notificaciones corre `procesar_cola()`. Cada worker toma trabajos
+con SELECT ... FOR UPDATE SKIP LOCKED y los marca PROCESANDO con un lease:
+si el proceso muere a mitad, el trabajo vuelve a la cola cuando vence el
+lease. Los errores se reintentan con backoff exponencial con jitter hasta
+MAX_INTENTOS; después el trabajo queda FALLIDA para revisarlo a mano.
+"""
+import random
+import threading
+import traceback
+from collections import Counter
+from datetime import timedelta
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import NotificacionMP
+from .services import PagoService
+
+# Tiempo que un worker tiene para terminar lo que tomó antes de que otro lo retome
+LEASE = timedelta(minutes=2)
+MAX_INTENTOS = 8
+# Segundos de espera del primer reintento; se duplica en cada intento
+BACKOFF_BASE = 5
+BACKOFF_MAX = 30 * 60
+
+# tipo de notificación -> función que recibe el ID del recurso en MP
+TRABAJOS = {
+    'payment': PagoService.procesar_notificacion,
+}
+
+
+def encolar(tipo, recurso_id, payload=None):
+    return NotificacionMP.objects.create(tipo=tipo, recurso_id=str(recurso_id), payload=payload or {})
+
+
+def tomar(cantidad=1, lease=LEASE):
+    """Reserva para este worker hasta `cantidad` trabajos listos para correr."""
+    ahora = timezone.now()
+    with transaction.atomic():
+        trabajos = list(
+            NotificacionMP.objects.filter(
+                Q(estado='PENDIENTE', disponible_desde__lte=ahora)
+                # Lease vencido: el worker que lo tenía se cayó
+                | Q(estado='PROCESANDO', lease_hasta__lt=ahora)
+            )
+            .order_by('disponible_desde')
+            .select_for_update(skip_locked=True)[:cantidad]
+        )
+        if trabajos:
+            NotificacionMP.objects.filter(id__in=[t.id for t in trabajos]).update(
+                estado='PROCESANDO', lease_hasta=ahora + lease, intentos=F('intentos') + 1,
+            )
+    for trabajo in trabajos:
+        trabajo.estado = 'PROCESANDO'
+        trabajo.lease_hasta = ahora + lease
+        trabajo.intentos += 1
+    return trabajos
+
+
+def espera_reintento(intentos):
+    segundos = min(BACKOFF_BASE * 2 ** (intentos - 1), BACKOFF_MAX)
+    # Jitter: los que fallaron juntos (MP caído) no vuelven todos a la vez
+    return timedelta(seconds=segundos * random.uniform(0.5, 1.5))
+
+
+def ejecutar(trabajo):
+    """Corre un trabajo ya tomado. Devuelve el estado en que quedó."""
+    # intentos hace de token: si el lease venció y otro worker lo retomó,
+    # este ya no puede cambiarle el estado
+    propio = NotificacionMP.objects.filter(id=trabajo.id, estado='PROCESANDO', intentos=trabajo.intentos)
+    try:
+        if trabajo.intentos > MAX_INTENTOS:
+            raise RuntimeError("Se agotaron los intentos (el worker se cayó procesándolo)")
+        TRABAJOS[trabajo.tipo](trabajo.recurso_id)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if trabajo.intentos >= MAX_INTENTOS:
+            print(f"❌ Notificación #{trabajo.id} FALLIDA tras {trabajo.intentos} intentos: {error}")
+            propio.update(estado='FALLIDA', lease_hasta=None, error=error)
+            return 'FALLIDA'
+        propio.update(
+            estado='PENDIENTE', lease_hasta=None, error=error,
+            disponible_desde=timezone.now() + espera_reintento(trabajo.intentos),
+        )
+        return 'PENDIENTE'
+    propio.update(estado='HECHA', lease_hasta=None, error='')
+    return 'HECHA'
+
+
+def _trabajar(resultados, candado, lote, espera, detener, hasta_vaciar):
+    while not detener.is_set():
+        try:
+            trabajos = tomar(lote)
+            if not trabajos:
+                if hasta_vaciar:
+                    return
+                detener.wait(espera)
+                continue
+            # Lo ya tomado se termina aunque pidan detener: si no, esperaría al lease
+            for trabajo in trabajos:
+                estado = ejecutar(trabajo)
+                with candado:
+                    resultados[estado] += 1
+        except Exception:
+            # Base caída o similar: lo que quedó tomado vuelve a la cola al vencer el lease
+            print("❌ Error en el worker de la cola de notificaciones:")
+            traceback.print_exc()
+            connection.close()  # se reconecta en la próxima consulta
+            detener.wait(espera)
+
+
+def procesar_cola(hilos=4, lote=5, espera=1.0, detener=None, hasta_vaciar=False):
+    """
+    Procesa la cola con `hilos` workers concurrentes. Corre hasta que se
+    activa `detener` (threading.Event) o, con `hasta_vaciar`, hasta que no
+    quedan trabajos listos. Devuelve un Counter con cuántos trabajos
+    terminaron en cada estado.
+    """
+    detener = detener or threading.Event()
+    resultados, candado = Counter(), threading.Lock()
+    argumentos = (resultados, candado, lote, espera, detener, hasta_vaciar)
+    if hilos <= 1:
+        _trabajar(*argumentos)
+        return resultados
+
+    def hilo():
+        try:
+            _trabajar(*argumentos)
+        finally:
+            connection.close()  # cada hilo abre su propia conexión
+
+    trabajadores = [threading.Thread(target=hilo, name=f"cola-mp-{i}") for i in range(hilos)]
+    for trabajador in trabajadores:
+        trabajador.start()
+    for trabajador in trabajadores:
+        trabajador.join()
+    return resultados
@@ -0,0 +1,120 @@
+"""
+Conciliación con Mercado Pago de los pedidos que quedaron PENDIENTE porque
+el webhook nunca llegó (comando conciliar_pedidos).
+
+Los pedidos se recorren por keyset (id > último, de a `lote`, sobre el
+índice estado+id): nunca se cargan todos en memoria. Los pagos de cada lote
+se consultan en paralelo con un pool de hilos acotado y el resultado se
+aplica con un UPDATE condicional por lote:
+
+- Pago aprobado: se encola la notificación que faltó (products.cola) y el
+  pedido pasa a PAGADO por el mismo camino que el webhook (stock, ranking,
+  email).
+- Sin pagos, o solo rechazados/cancelados: CANCELADO y se libera la reserva.
+  El link de pago ya venció con la reserva (ver datos_preferencia); si aun
+  así llega un pago aprobado, PagoService lo reactiva o lo deja A_REVISAR.
+- Pago todavía en curso en MP (efectivo, en revisión): queda como está.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import requests
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidar_version
+from .mercadopago_cliente import MPNoDisponible, sdk_mercadopago
+from .models import NotificacionMP, Pedido
+from .reservas import ReservaService
+
+ESTADOS_MP_EN_CURSO = ('pending', 'in_process', 'authorized')
+
+
+def consultar_pagos(pedido_id):
+    """Pagos de MP cuyo external_reference es el pedido."""
+    respuesta = sdk_mercadopago().payment().search({'external_reference': str(pedido_id)})
+    if respuesta["status"] != 200:
+        raise MPNoDisponible(f"MP respondió {respuesta['status']} al buscar los pagos del pedido #{pedido_id}")
+    return (respuesta["response"] or {}).get("results", [])
+
+
+def decidir(pagos):
+    """Devuelve (transición, payment_id): PAGADO, CANCELADO o EN_CURSO."""
+    for pago in pagos:
+        if pago.get("status") == "approved":
+            return 'PAGADO', str(pago["id"])
+    if any(pago.get("status") in ESTADOS_MP_EN_CURSO for pago in pagos):
+        return 'EN_CURSO', None
+    return 'CANCELADO', None
+
+
+def _consultar(pedido_id):
+    # Corre en los hilos del pool: solo HTTP, sin tocar la base
+    try:
+        return decidir(consultar_pagos(pedido_id))
+    except requests.RequestException:
+        return 'ERROR', None
+
+
+def conciliar_pendientes(antiguedad=timedelta(hours=24), lote=500, hilos=8):
+    """
+    Concilia los pedidos PENDIENTE con más de `antiguedad`. Devuelve un
+    Counter con cuántos pedidos terminaron en cada caso.
+    """
+    limite = timezone.now() - antiguedad
+    resultados = Counter()
+    ultimo = 0
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='conciliacion') as pool:
+        while True:
+            filas = list(
+                Pedido.objects.filter(estado='PENDIENTE', fecha_venta__lte=limite, id__gt=ultimo)
+                .order_by('id').values_list('id', flat=True)[:lote]
+            )
+            if not filas:
+                return resultados
+            ultimo = filas[-1]
+
+            pagar, cancelar = {}, []
+            for pedido_id, (transicion, payment_id) in zip(filas, pool.map(_consultar, filas)):
+                if transicion == 'PAGADO':
+                    pagar[pedido_id] = payment_id
+                elif transicion == 'CANCELADO':
+                    cancelar.append(pedido_id)
+                else:
+                    resultados[transicion] += 1
+            resultados['PAGADO'] += _encolar_pagos(pagar)
+            resultados['CANCELADO'] += _cancelar(cancelar)
+
+
+def _encolar_pagos(pagar):
+    if not pagar:
+        return 0
+    # Si la notificación ya está en la cola no se duplica
+    en_cola = set(
+        NotificacionMP.objects.filter(
+            estado__in=('PENDIENTE', 'PROCESANDO'), tipo='payment', recurso_id__in=pagar.values(),
+        ).values_list('recurso_id', flat=True)
+    )
+    NotificacionMP.objects.bulk_create([
+        NotificacionMP(tipo='payment', recurso_id=payment_id, payload={'origen': 'conciliacion', 'pedido_id': pedido_id})
+        for pedido_id, payment_id in pagar.items() if payment_id not in en_cola
+    ])
+    return len(pagar)
+
+
+def _cancelar(pedido_ids):
+    if not pedido_ids:
+        return 0
+    with transaction.atomic():
+        # Solo los que siguen PENDIENTE: si el webhook llegó mientras tanto, ganó él
+        filas = list(
+            Pedido.objects.filter(id__in=pedido_ids, estado='PENDIENTE')
+            .select_for_update().values_list('id', 'usuario_id')
+        )
+        ids = [pedido_id for pedido_id, _ in filas]
+        Pedido.objects.filter(id__in=ids).update(estado='CANCELADO')
+        ReservaService.liberar_pedidos(ids)
+        # update() no dispara señales: mis-compras tiene que ver el cambio
+        for usuario_id in {usuario_id for _, usuario_id in filas}:
+            invalidar_version(f"pedidos:{usuario_id}")
+    return len(ids)
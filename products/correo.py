@@ -0,0 +1,138 @@
+"""
+Outbox de emails. Las vistas y la cola de pagos solo hacen `encolar_email()`
+(un INSERT dentro de su transacción: si el cambio se deshace, el mail
+también) y el comando enviar_emails los manda con `enviar_pendientes()`:
+toma lotes con SKIP LOCKED y manda cada lote por una sola conexión SMTP
+(un handshake TLS por lote, no por mail), respetando EMAIL_POR_MINUTO. Los
+errores se reintentan con backoff hasta MAX_INTENTOS.
+"""
+import random
+import smtplib
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+MAX_INTENTOS = 5
+# Segundos de espera del primer reintento; se duplica en cada intento
+BACKOFF_BASE = 60
+# Un lote tomado no lo toma otro proceso por este tiempo (si el envío se
+# corta a mitad, lo que quedó se reintenta después)
+LEASE = timedelta(minutes=10)
+
+
+def encolar_email(asunto, mensaje, destinatarios, remitente=None):
+    return EmailOutbox.objects.create(
+        asunto=asunto,
+        mensaje=mensaje,
+        destinatarios=list(destinatarios),
+        remitente=remitente or settings.DEFAULT_FROM_EMAIL,
+    )
+
+
+def tomar_lote(cantidad):
+    ahora = timezone.now()
+    with transaction.atomic():
+        correos = list(
+            EmailOutbox.objects.filter(estado='PENDIENTE', disponible_desde__lte=ahora)
+            .order_by('disponible_desde')
+            .select_for_update(skip_locked=True)[:cantidad]
+        )
+        EmailOutbox.objects.filter(id__in=[c.id for c in correos]).update(disponible_desde=ahora + LEASE)
+    return correos
+
+
+def _fallo(correo, error):
+    intentos = correo.intentos + 1
+    if intentos >= MAX_INTENTOS:
+        EmailOutbox.objects.filter(id=correo.id).update(estado='FALLIDO', intentos=intentos, error=error)
+        return 'FALLIDO'
+    espera = BACKOFF_BASE * 2 ** (intentos - 1) * random.uniform(0.5, 1.5)
+    EmailOutbox.objects.filter(id=correo.id).update(
+        intentos=intentos, error=error, disponible_desde=timezone.now() + timedelta(seconds=espera),
+    )
+    return 'REINTENTO'
+
+
+def enviar_lote(correos, intervalo=0.0, detener=None):
+    """
+    Manda `correos` por una sola conexión SMTP, que se reabre si el servidor
+    la corta a mitad del lote. Devuelve {estado: cantidad} con ENVIADO,
+    REINTENTO o FALLIDO. Si se activa `detener`, lo que falta
+    del lote vuelve al outbox sin contar como intento.
+    """
+    resultados = {'ENVIADO': 0, 'REINTENTO': 0, 'FALLIDO': 0}
+    enviados, atendidos = [], set()
+    try:
+        conexion = get_connection(fail_silently=False)
+        conexion.open()
+    except Exception as e:
+        # Servidor caído: todo el lote vuelve a la cola con backoff
+        for correo in correos:
+            resultados[_fallo(correo, f"{type(e).__name__}: {e}")] += 1
+        return resultados
+
+    try:
+        for posicion, correo in enumerate(correos):
+            if detener and detener.is_set():
+                break
+            atendidos.add(correo.id)
+            inicio = time.monotonic()
+            mensaje = EmailMessage(
+                correo.asunto, correo.mensaje, correo.remitente, correo.destinatarios, connection=conexion,
+            )
+            try:
+                conexion.send_messages([mensaje])
+                enviados.append(correo.id)
+            except smtplib.SMTPServerDisconnected:
+                # El servidor cortó la sesión (inactividad, tope de mensajes por
+                # conexión): se reconecta y se sigue con el lote sin gastar intentos
+                conexion.close()
+                try:
+                    conexion.open()
+                except Exception as e:
+                    # No vuelve: lo que falta del lote va a la cola con backoff
+                    for pendiente in correos[posicion:]:
+                        atendidos.add(pendiente.id)
+                        resultados[_fallo(pendiente, f"{type(e).__name__}: {e}")] += 1
+                    break
+                try:
+                    conexion.send_messages([mensaje])
+                    enviados.append(correo.id)
+                except Exception as e:
+                    resultados[_fallo(correo, f"{type(e).__name__}: {e}")] += 1
+            except Exception as e:
+                resultados[_fallo(correo, f"{type(e).__name__}: {e}")] += 1
+            # Límite de envíos por minuto del proveedor
+            time.sleep(max(intervalo - (time.monotonic() - inicio), 0))
+    finally:
+        conexion.close()
+        EmailOutbox.objects.filter(id__in=enviados).update(estado='ENVIADO', enviado=timezone.now(), error='')
+        EmailOutbox.objects.filter(id__in=[c.id for c in correos if c.id not in atendidos]).update(
+            disponible_desde=timezone.now(),
+        )
+        resultados['ENVIADO'] = len(enviados)
+    return resultados
+
+
+def enviar_pendientes(lote=50, por_minuto=None, detener=None):
+    """
+    Manda todo lo pendiente, de a `lote` por conexión y a no más de
+    `por_minuto` emails por minuto (0: sin límite). Devuelve los totales por
+    estado. `detener` (threading.Event) corta entre un email y el siguiente.
+    """
+    if por_minuto is None:
+        por_minuto = settings.EMAIL_POR_MINUTO
+    intervalo = 60 / por_minuto if por_minuto else 0
+    totales = {'ENVIADO': 0, 'REINTENTO': 0, 'FALLIDO': 0}
+    while not (detener and detener.is_set()):
+        correos = tomar_lote(lote)
+        if not correos:
+            break
+        for estado, cantidad in enviar_lote(correos, intervalo, detener).items():
+            totales[estado] += cantidad
+    return totales
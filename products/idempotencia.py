@@ -0,0 +1,144 @@
+"""
+Idempotency-Key para POST que crean cosas (POST /comprar/).
+
+El cliente manda una clave única por intento de compra y la repite en los
+reintentos. La primera request con la clave inserta una ClaveIdempotencia
+EN_CURSO (índice único usuario+clave) y corre la vista; su respuesta queda
+guardada. Un reintento la encuentra con una búsqueda por ese índice y recibe
+los mismos bytes sin crear otro pedido. Si el original todavía está
+corriendo, el duplicado recibe 409 en vez de comprar dos veces.
+
+La clave solo se libera (para que el reintento vuelva a intentar) si la
+request falló antes de guardar el pedido. Una vez creado, el resultado queda
+fijo aunque después falle Mercado Pago.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import ClaveIdempotencia
+
+# Después de esto una clave EN_CURSO se da por abandonada (el proceso se cayó)
+ABANDONO = timedelta(minutes=5)
+# Tiempo que se recuerda una respuesta; pasado este plazo la clave se puede reusar
+VIGENCIA = timedelta(hours=24)
+LARGO_MAXIMO = 255
+
+
+def huella_request(request):
+    cuerpo = json.dumps(request.data, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f"{request.method} {request.path}\n{cuerpo}".encode()).hexdigest()
+
+
+def tomar_clave(usuario, clave, huella):
+    """
+    Devuelve (registro, propio). `propio` es True si esta request tiene que
+    ejecutar la vista; si no, el registro es de otra request con la misma clave.
+    """
+    ahora = timezone.now()
+    registro = ClaveIdempotencia.objects.filter(usuario=usuario, clave=clave).first()
+    if registro is None:
+        try:
+            with transaction.atomic():
+                return ClaveIdempotencia.objects.create(usuario=usuario, clave=clave, huella=huella, tomada=ahora), True
+        except IntegrityError:
+            # Otra request con la misma clave insertó primero
+            return ClaveIdempotencia.objects.get(usuario=usuario, clave=clave), False
+
+    vencida = registro.creada < ahora - VIGENCIA
+    # Si ya dejó un pedido guardado no se retoma: el reintento crearía otro
+    abandonada = (
+        registro.estado == 'EN_CURSO' and registro.tomada < ahora - ABANDONO
+        and registro.huella == huella and registro.pedido_id is None
+    )
+    if vencida or abandonada:
+        # UPDATE condicional: si dos reintentos llegan juntos, uno solo la retoma
+        retomada = ClaveIdempotencia.objects.filter(pk=registro.pk, tomada=registro.tomada).update(
+            huella=huella, estado='EN_CURSO', status_code=None, respuesta='', pedido=None, creada=ahora, tomada=ahora,
+        )
+        if retomada:
+            registro.huella, registro.estado, registro.tomada, registro.pedido_id = huella, 'EN_CURSO', ahora, None
+            return registro, True
+        registro.refresh_from_db()
+    return registro, False
+
+
+def con_idempotencia(vista):
+    """
+    Decorador para vistas POST autenticadas; va debajo de @api_view (necesita
+    request.user de DRF). Sin cabecera Idempotency-Key la vista corre igual
+    que siempre.
+    """
+    @wraps(vista)
+    def _vista(request, *args, **kwargs):
+        clave = request.headers.get('Idempotency-Key', '').strip()
+        if not clave:
+            return vista(request, *args, **kwargs)
+        if len(clave) > LARGO_MAXIMO:
+            return Response(
+                {"error": f"La Idempotency-Key puede tener como máximo {LARGO_MAXIMO} caracteres."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        huella = huella_request(request)
+        registro, propio = tomar_clave(request.user, clave, huella)
+        if not propio:
+            if registro.huella != huella:
+                return Response(
+                    {"error": "La Idempotency-Key ya se usó con otro pedido."},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                )
+            if registro.estado == 'COMPLETA':
+                response = HttpResponse(registro.respuesta, status=registro.status_code, content_type='application/json')
+                response['Idempotent-Replayed'] = 'true'
+                return response
+            if registro.pedido_id is not None and registro.tomada < timezone.now() - ABANDONO:
+                # Se cortó después de guardar el pedido: no se sabe qué recibió el cliente
+                return Response(
+                    {"error": "La compra con esta Idempotency-Key quedó interrumpida; revisá el pedido en mis compras.",
+                     "pedido_id": registro.pedido_id},
+                    status=status.HTTP_409_CONFLICT,
+                )
+            response = Response(
+                {"error": "Hay una compra en curso con esta Idempotency-Key; reintentá en unos segundos."},
+                status=status.HTTP_409_CONFLICT,
+            )
+            response['Retry-After'] = '1'
+            return response
+
+        # La vista ata la clave al pedido en la transacción que lo crea
+        request.clave_idempotencia = registro
+        try:
+            response = vista(request, *args, **kwargs)
+        except Exception:
+            if not _guardado(registro):
+                registro.delete()
+            else:
+                _completar(registro, status.HTTP_500_INTERNAL_SERVER_ERROR, {"error": "Error interno al procesar la compra."})
+            raise
+        if response.status_code >= 500 and not _guardado(registro):
+            # Falló antes de guardar nada: el reintento tiene que volver a intentar
+            registro.delete()
+        else:
+            # Con el pedido ya creado (aunque MP haya fallado después) el
+            # reintento recibe este mismo resultado y no crea otro pedido
+            _completar(registro, response.status_code, response.data)
+        return response
+    return _vista
+
+
+def _guardado(registro):
+    return ClaveIdempotencia.objects.filter(pk=registro.pk, pedido__isnull=False).exists()
+
+
+def _completar(registro, status_code, datos):
+    ClaveIdempotencia.objects.filter(pk=registro.pk).update(
+        estado='COMPLETA', status_code=status_code, respuesta=JSONRenderer().render(datos).decode(),
+    )
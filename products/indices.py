@@ -0,0 +1,410 @@
+import abc
+import heapq
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from django.db.models import Sum
+from .cache import incrementar_version, obtener_version
+from .models import Categoria, ItemPedido, Producto
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes: 'Lavánda' -> 'lavanda'."""
+    descompuesto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in descompuesto if not unicodedata.combining(c)).lower()
+
+
+def tokenizar(texto):
+    return re.findall(r'\w+', normalizar(texto))
+
+
+class IndiceCatalogo(abc.ABC):
+    """
+    Índice en memoria de cada worker. Se construye en la primera consulta y
+    se reconstruye cuando la versión `nombre_version` (compartida en la caché)
+    ya no coincide con la que tiene aplicada, por ejemplo porque otro worker
+    editó un producto. Cada índice con cambios incrementales usa su propia
+    versión: si la compartieran, el primero en aplicar un cambio haría creer
+    al resto que estaban desactualizados.
+    """
+    nombre_version = None
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+
+    def sincronizar(self):
+        version = obtener_version(self.nombre_version)
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self.reconstruir()
+                    self._version = version
+
+    def aplicar_cambio(self, cambio):
+        """
+        Aplica un cambio incremental ya confirmado en la base. La versión se
+        sube con un INCR atómico: si el resultado es justo la versión que
+        tenía este worker más uno, nadie más cambió nada en el medio y alcanza
+        con aplicar el cambio. Si no (estaba desactualizado u otro worker
+        subió a la vez), queda marcado y la próxima consulta reconstruye todo.
+        """
+        with self._lock:
+            anterior = self._version
+            nueva = incrementar_version(self.nombre_version)
+            if anterior is not None and nueva == anterior + 1:
+                cambio()
+                self._version = nueva
+            else:
+                self._version = None
+
+    @abc.abstractmethod
+    def reconstruir(self):
+        """Arma el índice completo desde la base."""
+
+
+class IndiceBusqueda(IndiceCatalogo):
+    """Índice invertido sobre nombre, aroma y descripción de Producto."""
+    nombre_version = 'indice:busqueda'
+
+    PESOS = {'nombre': 3.0, 'aroma': 2.0, 'descripcion': 1.0}
+    # Resultados recientes; se vacía con cualquier cambio del índice
+    MAX_RESULTADOS = 1024
+
+    def __init__(self):
+        super().__init__()
+        self._postings = {}   # token -> {producto_id: puntaje}
+        self._tokens = {}     # producto_id -> tokens indexados
+        self._resultados = {}
+
+    def reconstruir(self):
+        self._postings, self._tokens, self._resultados = {}, {}, {}
+        for fila in Producto.objects.values('id', *self.PESOS).iterator(chunk_size=2000):
+            self._indexar(fila)
+
+    def _indexar(self, fila):
+        self._resultados.clear()
+        puntajes = Counter()
+        for campo, peso in self.PESOS.items():
+            for token in tokenizar(fila[campo]):
+                puntajes[token] += peso
+        for token, puntaje in puntajes.items():
+            self._postings.setdefault(token, {})[fila['id']] = puntaje
+        self._tokens[fila['id']] = set(puntajes)
+
+    def _quitar(self, producto_id):
+        self._resultados.clear()
+        for token in self._tokens.pop(producto_id, ()):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(producto_id, None)
+                if not postings:
+                    del self._postings[token]
+
+    def actualizar_producto(self, producto):
+        fila = {'id': producto.pk, **{campo: getattr(producto, campo) for campo in self.PESOS}}
+
+        def cambio():
+            self._quitar(producto.pk)
+            self._indexar(fila)
+        self.aplicar_cambio(cambio)
+
+    def eliminar_producto(self, producto_id):
+        self.aplicar_cambio(lambda: self._quitar(producto_id))
+
+    def buscar(self, consulta, limite=20):
+        """IDs de productos que contienen todos los términos, por relevancia."""
+        self.sincronizar()
+        tokens = frozenset(tokenizar(consulta))
+        if not tokens:
+            return []
+
+        with self._lock:
+            clave = (tokens, limite)
+            if clave in self._resultados:
+                return self._resultados[clave]
+
+            postings = [self._postings.get(token) for token in tokens]
+            if not all(postings):
+                return []
+            total = len(self._tokens)
+            pesos = [(p, math.log(1 + total / len(p))) for p in postings]
+
+            # La intersección de claves corre en C; solo puntuamos lo que queda
+            candidatos = postings[0].keys()
+            for p in postings[1:]:
+                candidatos = candidatos & p.keys()
+            mejores = heapq.nlargest(
+                limite,
+                candidatos,
+                key=lambda producto_id: (sum(p[producto_id] * idf for p, idf in pesos), -producto_id),
+            )
+
+            if len(self._resultados) >= self.MAX_RESULTADOS:
+                self._resultados.clear()
+            self._resultados[clave] = mejores
+            return mejores
+
+
+class _NodoTrie:
+    __slots__ = ('hijos', 'top')
+
+    def __init__(self):
+        self.hijos = {}
+        self.top = []
+
+
+class IndiceSugerencias(IndiceCatalogo):
+    """
+    Trie de prefijos para autocompletar nombres de producto, aromas y
+    categorías. Cada nodo guarda solo las K mejores sugerencias de su
+    subárbol (ponderadas por unidades vendidas), así una consulta es recorrer
+    el prefijo y devolver una lista ya armada. La memoria queda acotada por
+    MAX_SUGERENCIAS, PROFUNDIDAD y K.
+    Se reconstruye al cambiar productos o categorías y una vez por día con
+    vencer_ventas, que refresca el peso por ventas; un pago no la toca.
+    """
+    nombre_version = 'indice:sugerencias'
+    K = 8
+    PROFUNDIDAD = 20
+    MAX_SUGERENCIAS = 50000
+    ESTADOS_VENDIDOS = ('PAGADO', 'ENTREGADO')
+
+    def __init__(self):
+        super().__init__()
+        self._raiz = _NodoTrie()
+        self._sugerencias = []
+
+    def reconstruir(self):
+        vendidos = dict(
+            ItemPedido.objects.filter(pedido__estado__in=self.ESTADOS_VENDIDOS)
+            .values_list('producto_id')
+            .annotate(unidades=Sum('cantidad'))
+        )
+        productos = Producto.objects.values_list('id', 'nombre', 'aroma', 'categoria__nombre')
+
+        entradas = []
+        pesos_aroma, pesos_categoria = defaultdict(int), defaultdict(int)
+        for producto_id, nombre, aroma, categoria in productos.iterator(chunk_size=2000):
+            unidades = vendidos.get(producto_id, 0)
+            entradas.append((nombre, 'producto', producto_id, unidades))
+            if aroma:
+                pesos_aroma[aroma] += unidades
+            if categoria:
+                pesos_categoria[categoria] += unidades
+
+        entradas += [(aroma, 'aroma', None, peso) for aroma, peso in pesos_aroma.items()]
+        entradas += [(categoria, 'categoria', None, peso) for categoria, peso in pesos_categoria.items()]
+        self.construir(entradas)
+
+    def construir(self, entradas):
+        """`entradas`: tuplas (texto, tipo, producto_id, peso)."""
+        # Insertando de mayor a menor peso, cada nodo se queda con sus K
+        # mejores sin tener que ordenar nada después.
+        entradas = sorted(entradas, key=lambda e: (-e[3], normalizar(e[0])))[:self.MAX_SUGERENCIAS]
+        raiz = _NodoTrie()
+        for posicion, (texto, _, _, _) in enumerate(entradas):
+            texto_normalizado = normalizar(texto)
+            # Se indexa desde el comienzo de cada palabra: "lav" encuentra
+            # "Sahumerio Lavanda".
+            inicios = [m.start() for m in re.finditer(r'\w+', texto_normalizado)]
+            for inicio in inicios:
+                nodo = raiz
+                for caracter in texto_normalizado[inicio:inicio + self.PROFUNDIDAD]:
+                    nodo = nodo.hijos.setdefault(caracter, _NodoTrie())
+                    if len(nodo.top) < self.K and posicion not in nodo.top:
+                        nodo.top.append(posicion)
+
+        self._raiz = raiz
+        self._sugerencias = [
+            {'texto': texto, 'tipo': tipo, 'producto_id': producto_id}
+            for texto, tipo, producto_id, _ in entradas
+        ]
+
+    def sugerir(self, prefijo, limite=K):
+        self.sincronizar()
+        with self._lock:
+            nodo = self._raiz
+            for caracter in normalizar(prefijo).strip()[:self.PROFUNDIDAD]:
+                nodo = nodo.hijos.get(caracter)
+                if nodo is None:
+                    return []
+            if nodo is self._raiz:
+                return []
+            return [self._sugerencias[i] for i in nodo.top[:limite]]
+
+
+# Clave del bitmap con todos los productos indexados
+TODOS = ('todos', None)
+
+
+class IndiceFacetas(IndiceCatalogo):
+    """
+    Índice de bitmaps para el catálogo facetado. Cada producto ocupa un bit
+    (su slot) y cada valor de faceta es un entero de Python con los bits de
+    sus productos. Filtrar es un AND de bitmaps y contar es un bit_count(),
+    sin un GROUP BY por faceta en cada request.
+    """
+    nombre_version = 'indice:facetas'
+    # Bandas sobre precio_efectivo: (clave, desde, hasta); hasta es exclusivo
+    BANDAS_PRECIO = (
+        ('0-1000', None, 1000),
+        ('1000-2500', 1000, 2500),
+        ('2500-5000', 2500, 5000),
+        ('5000+', 5000, None),
+    )
+
+    def __init__(self):
+        super().__init__()
+        self._limpiar()
+
+    def _limpiar(self):
+        self._ids = []            # slot -> producto_id (None si se borró)
+        self._slots = {}          # producto_id -> slot
+        self._valores = {}        # producto_id -> claves de bitmap que ocupa
+        self._bitmaps = defaultdict(int)
+        self._categorias = {}     # categoria_id -> nombre
+
+    def reconstruir(self):
+        self._limpiar()
+        self._categorias = dict(Categoria.objects.values_list('id', 'nombre'))
+        campos = ('id', 'categoria_id', 'aroma', 'precio_efectivo', 'en_oferta', 'stock', 'reservado')
+        # Slots por ID ascendente: los bits altos son los productos más nuevos
+        for fila in Producto.objects.order_by('id').values(*campos).iterator(chunk_size=2000):
+            self._indexar(fila)
+
+    @classmethod
+    def banda_precio(cls, precio):
+        for clave, desde, hasta in cls.BANDAS_PRECIO:
+            if (desde is None or precio >= desde) and (hasta is None or precio < hasta):
+                return clave
+
+    def _claves(self, fila):
+        claves = {('banda', self.banda_precio(fila['precio_efectivo']))}
+        if fila['categoria_id'] is not None:
+            claves.add(('categoria', fila['categoria_id']))
+        if fila['aroma']:
+            claves.add(('aroma', fila['aroma']))
+        if fila['en_oferta']:
+            claves.add(('en_oferta', True))
+        # Disponible para la venta: stock menos lo reservado por pedidos sin pagar
+        if fila['stock'] > fila['reservado']:
+            claves.add(('en_stock', True))
+        return claves
+
+    def _indexar(self, fila):
+        producto_id = fila['id']
+        slot = self._slots.get(producto_id)
+        if slot is None:
+            slot = len(self._ids)
+            self._ids.append(producto_id)
+            self._slots[producto_id] = slot
+            self._bitmaps[TODOS] |= 1 << slot
+        claves = self._claves(fila)
+        for clave in claves:
+            self._bitmaps[clave] |= 1 << slot
+        self._valores[producto_id] = claves
+
+    def _quitar_valores(self, producto_id):
+        slot = self._slots[producto_id]
+        for clave in self._valores.pop(producto_id, ()):
+            self._bitmaps[clave] &= ~(1 << slot)
+            if not self._bitmaps[clave]:
+                del self._bitmaps[clave]
+
+    def actualizar_producto(self, producto):
+        fila = {
+            'id': producto.pk,
+            'categoria_id': producto.categoria_id,
+            'aroma': producto.aroma,
+            'precio_efectivo': producto.precio_efectivo,
+            'en_oferta': producto.en_oferta,
+            'stock': producto.stock,
+            'reservado': producto.reservado,
+        }
+
+        def cambio():
+            if producto.pk in self._slots:
+                self._quitar_valores(producto.pk)
+            self._indexar(fila)
+        self.aplicar_cambio(cambio)
+
+    def eliminar_producto(self, producto_id):
+        def cambio():
+            if producto_id in self._slots:
+                self._quitar_valores(producto_id)
+                slot = self._slots.pop(producto_id)
+                self._ids[slot] = None
+                self._bitmaps[TODOS] &= ~(1 << slot)
+        self.aplicar_cambio(cambio)
+
+    def _union(self, tipo, valores):
+        bitmap = 0
+        for valor in valores:
+            bitmap |= self._bitmaps.get((tipo, valor), 0)
+        return bitmap
+
+    def filtrar(self, filtros, offset=0, limite=24):
+        """
+        `filtros`: dict con listas para 'categoria', 'aroma' y 'banda' (OR
+        dentro de cada faceta) y booleanos 'en_oferta'/'en_stock'.
+        Devuelve (total, ids de la página, conteos). El conteo de cada faceta
+        se calcula con los filtros de las demás, para mostrar cuántos
+        productos quedarían al elegir otro valor.
+        """
+        self.sincronizar()
+        with self._lock:
+            todos = self._bitmaps.get(TODOS, 0)
+            mascaras = {}
+            for tipo in ('categoria', 'aroma', 'banda'):
+                if filtros.get(tipo):
+                    mascaras[tipo] = self._union(tipo, filtros[tipo])
+            for tipo in ('en_oferta', 'en_stock'):
+                if filtros.get(tipo):
+                    mascaras[tipo] = self._bitmaps.get((tipo, True), 0)
+
+            def sin(excluida=None):
+                resultado = todos
+                for tipo, mascara in mascaras.items():
+                    if tipo != excluida:
+                        resultado &= mascara
+                return resultado
+
+            seleccion = sin()
+            conteos = {'categorias': [], 'aromas': [], 'precios': []}
+            base = {tipo: sin(tipo) for tipo in ('categoria', 'aroma', 'banda', 'en_oferta', 'en_stock')}
+            for (tipo, valor), bitmap in self._bitmaps.items():
+                if tipo == 'categoria':
+                    cantidad = (base['categoria'] & bitmap).bit_count()
+                    if cantidad:
+                        conteos['categorias'].append({'id': valor, 'nombre': self._categorias.get(valor, ''), 'cantidad': cantidad})
+                elif tipo == 'aroma':
+                    cantidad = (base['aroma'] & bitmap).bit_count()
+                    if cantidad:
+                        conteos['aromas'].append({'valor': valor, 'cantidad': cantidad})
+            for clave, desde, hasta in self.BANDAS_PRECIO:
+                cantidad = (base['banda'] & self._bitmaps.get(('banda', clave), 0)).bit_count()
+                conteos['precios'].append({'banda': clave, 'desde': desde, 'hasta': hasta, 'cantidad': cantidad})
+            conteos['en_oferta'] = (base['en_oferta'] & self._bitmaps.get(('en_oferta', True), 0)).bit_count()
+            conteos['en_stock'] = (base['en_stock'] & self._bitmaps.get(('en_stock', True), 0)).bit_count()
+            conteos['categorias'].sort(key=lambda c: (-c['cantidad'], c['nombre']))
+            conteos['aromas'].sort(key=lambda a: (-a['cantidad'], a['valor']))
+
+            # Página: del bit más alto (producto más nuevo) hacia abajo
+            ids, restante, salto = [], seleccion, offset
+            while restante and len(ids) < limite:
+                slot = restante.bit_length() - 1
+                restante ^= 1 << slot
+                if salto:
+                    salto -= 1
+                else:
+                    ids.append(self._ids[slot])
+
+            return seleccion.bit_count(), ids, conteos
+
+
+indice_busqueda = IndiceBusqueda()
+indice_facetas = IndiceFacetas()
+indice_sugerencias = IndiceSugerencias()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory, override_settings
+from products.cola import encolar, procesar_cola
+from products.models import ItemPedido, NotificacionMP, PagoProcesado, Pedido, Producto
+from products.mp_falso import ServidorMPFalso
+from products.views import webhook_mercadopago
+
+
+class Command(BaseCommand):
+    help = (
+        "Mide el webhook de Mercado Pago (p50/p99 de la respuesta) y el throughput del worker "
+        "de la cola contra un MP falso local. Usa una base de test descartable, nunca la real."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notificaciones', type=int, default=500)
+        parser.add_argument('--hilos', default='1,4,8', help="Lista de cantidades de workers a medir (default: 1,4,8)")
+        parser.add_argument('--lote', type=int, default=5)
+        parser.add_argument('--latencia-mp', type=float, default=50, help="Demora del MP falso en ms (default: 50)")
+
+    def handle(self, *args, **options):
+        nombre_real = connection.settings_dict['NAME']
+        directorio = None
+        if connection.vendor == 'sqlite':
+            # La base en memoria compartida no admite escrituras desde varios
+            # hilos: archivo temporal en WAL, con BEGIN IMMEDIATE como MySQL bloquea
+            directorio = tempfile.mkdtemp(prefix='benchmark-cola-')
+            connection.settings_dict['TEST']['NAME'] = os.path.join(directorio, 'cola.sqlite3')
+            connection.settings_dict['OPTIONS'].update(
+                transaction_mode='IMMEDIATE', timeout=30, init_command='PRAGMA journal_mode=WAL;',
+            )
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        mp = ServidorMPFalso()
+        mp.demora = options['latencia_mp'] / 1000
+        mp.respuestas[('GET', '/v1/payments/')] = lambda ruta, cuerpo: (200, {
+            "id": int(ruta.rsplit('/', 1)[1]), "status": "approved", "external_reference": ruta.rsplit('/', 1)[1],
+        })
+        ajustes = override_settings(
+            MP_ACCESS_TOKEN='TEST-TOKEN', MP_API_BASE_URL=mp.url, MP_TIMEOUT=5,
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            CATALOGO_SNAPSHOTS_AUTOPUBLICAR=False,
+        )
+        try:
+            with ajustes:
+                self.medir(options)
+        finally:
+            mp.cerrar()
+            connection.creation.destroy_test_db(nombre_real, verbosity=0)
+            if directorio:
+                shutil.rmtree(directorio, ignore_errors=True)
+
+    def medir(self, options):
+        total = options['notificaciones']
+        usuario = User.objects.create_user(username='benchmark', email='benchmark@test.com')
+        producto = Producto.objects.create(nombre="Sahumerio Benchmark", precio=100, stock=10 ** 9, descripcion="-")
+        pedidos = Pedido.objects.bulk_create([Pedido(usuario=usuario, total_pagado=100) for _ in range(total)])
+        if pedidos[0].pk is None:  # backends sin RETURNING
+            pedidos = list(Pedido.objects.order_by('id'))
+        ItemPedido.objects.bulk_create([
+            ItemPedido(pedido=pedido, producto=producto, cantidad=1, precio_unitario=100) for pedido in pedidos
+        ])
+        ids = [pedido.id for pedido in pedidos]
+
+        # 1. El webhook: cuánto tarda en responder a MP
+        fabrica = RequestFactory()
+        tiempos = []
+        for pedido_id in ids:
+            request = fabrica.post('/webhook/', {"type": "payment", "data": {"id": str(pedido_id)}}, content_type='application/json')
+            inicio = time.perf_counter()
+            webhook_mercadopago(request)
+            tiempos.append((time.perf_counter() - inicio) * 1000)
+        tiempos.sort()
+        self.stdout.write(f"Notificaciones: {total} | MP falso: {options['latencia_mp']:.0f} ms por consulta")
+        self.stdout.write(
+            f"Webhook: media {statistics.mean(tiempos):.2f} ms | p50 {tiempos[len(tiempos) // 2]:.2f} ms | "
+            f"p99 {tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.99))]:.2f} ms"
+        )
+
+        # 2. El worker, con distintas cantidades de hilos sobre la misma cola
+        for hilos in [int(valor) for valor in options['hilos'].split(',')]:
+            if NotificacionMP.objects.filter(estado='HECHA').exists():
+                PagoProcesado.objects.all().delete()
+                Pedido.objects.filter(id__in=ids).update(estado='PENDIENTE')
+                NotificacionMP.objects.all().delete()
+                for pedido_id in ids:
+                    encolar('payment', pedido_id)
+
+            inicio = time.perf_counter()
+            resultados = procesar_cola(hilos=hilos, lote=options['lote'], hasta_vaciar=True)
+            duracion = time.perf_counter() - inicio
+            pagados = Pedido.objects.filter(id__in=ids, estado='PAGADO').count()
+            self.stdout.write(
+                f"Worker {hilos:>2} hilos: {duracion:.2f} s | {resultados['HECHA'] / duracion:.1f} notificaciones/s | "
+                f"pagados {pagados}/{total} | reintentos {resultados['PENDIENTE']}"
+            )
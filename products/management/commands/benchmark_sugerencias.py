@@ -0,0 +1,67 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from products.indices import IndiceSugerencias, normalizar
+
+AROMAS = [
+    "Lavanda", "Rosa", "Mirra", "Sándalo", "Copal", "Palo Santo", "Jazmín", "Vainilla",
+    "Canela", "Incienso", "Benjuí", "Citronela", "Eucalipto", "Naranja", "Limón", "Pachulí",
+]
+TIPOS = ["Sahumerio", "Vela", "Jabón", "Aceite", "Esencia", "Difusor", "Cono", "Bomba de Baño"]
+
+
+class Command(BaseCommand):
+    help = "Mide la latencia del autocompletado (p50/p99) con un catálogo sintético en memoria."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--productos', type=int, default=10000)
+        parser.add_argument('--consultas', type=int, default=20000)
+        parser.add_argument('--semilla', type=int, default=42)
+
+    def handle(self, *args, **options):
+        azar = random.Random(options['semilla'])
+        entradas = []
+        for i in range(options['productos']):
+            aroma = azar.choice(AROMAS)
+            nombre = f"{azar.choice(TIPOS)} {aroma} {azar.choice(AROMAS)} N{i}"
+            entradas.append((nombre, 'producto', i, azar.randint(0, 500)))
+        entradas += [(aroma, 'aroma', None, azar.randint(0, 5000)) for aroma in AROMAS]
+        entradas += [(tipo, 'categoria', None, azar.randint(0, 5000)) for tipo in TIPOS]
+
+        indice = IndiceSugerencias()
+        indice.sincronizar = lambda: None  # sin base ni caché: solo el trie
+
+        inicio = time.perf_counter()
+        indice.construir(entradas)
+        construccion = time.perf_counter() - inicio
+
+        nodos, pendientes = 0, [indice._raiz]
+        while pendientes:
+            nodo = pendientes.pop()
+            nodos += 1
+            pendientes.extend(nodo.hijos.values())
+
+        # Prefijos de 1 a 6 letras tomados de textos reales del catálogo
+        textos = [normalizar(e[0]) for e in entradas]
+        prefijos = []
+        for _ in range(options['consultas']):
+            texto = azar.choice(textos)
+            prefijos.append(texto[:azar.randint(1, 6)])
+
+        tiempos = []
+        for prefijo in prefijos:
+            inicio = time.perf_counter_ns()
+            indice.sugerir(prefijo)
+            tiempos.append((time.perf_counter_ns() - inicio) / 1000)
+        tiempos.sort()
+
+        def percentil(p):
+            return tiempos[min(len(tiempos) - 1, int(len(tiempos) * p))]
+
+        self.stdout.write(f"Productos: {options['productos']} | Sugerencias: {len(entradas)} | Nodos: {nodos}")
+        self.stdout.write(f"Construcción: {construccion * 1000:.1f} ms")
+        self.stdout.write(
+            f"Consultas: {len(tiempos)} | media {statistics.mean(tiempos):.1f} µs | "
+            f"p50 {percentil(0.50):.1f} µs | p99 {percentil(0.99):.1f} µs | máx {tiempos[-1]:.1f} µs"
+        )
@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from products.cache import invalidar_version
+from products.recomendaciones import K, reconstruir_relacionados
+
+
+class Command(BaseCommand):
+    help = "Recalcula los productos \"comprados juntos\" a partir de los pedidos pagados."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=K, help=f"Vecinos por producto (default: {K})")
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        guardados = reconstruir_relacionados(k=options['k'])
+        invalidar_version('catalogo')
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {guardados} relaciones guardadas en {time.perf_counter() - inicio:.2f} s."
+        ))
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from products.conciliacion import conciliar_pendientes
+
+
+class Command(BaseCommand):
+    help = (
+        "Consulta en Mercado Pago los pedidos PENDIENTE viejos cuyo webhook nunca llegó: "
+        "encola los pagados y cancela los que no tienen pago."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horas', type=float, default=24, help="Antigüedad mínima del pedido (default: 24)")
+        parser.add_argument('--lote', type=int, default=500, help="Pedidos por lote (default: 500)")
+        parser.add_argument('--hilos', type=int, default=8, help="Consultas a MP en paralelo (default: 8)")
+
+    def handle(self, *args, **options):
+        resultados = conciliar_pendientes(
+            antiguedad=timedelta(hours=options['horas']), lote=options['lote'], hilos=options['hilos'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {resultados['PAGADO']} pagados (encolados), {resultados['CANCELADO']} cancelados, "
+            f"{resultados['EN_CURSO']} con pago en curso, {resultados['ERROR']} sin respuesta de MP."
+        ))
@@ -0,0 +1,49 @@
+import signal
+import threading
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from products.correo import enviar_pendientes
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker del outbox de emails: manda los pendientes de a lotes por una sola conexión SMTP. "
+        "Corre hasta recibir SIGTERM/SIGINT (o con --una-vez, hasta vaciar el outbox)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=50, help="Emails por conexión SMTP (default: 50)")
+        parser.add_argument(
+            '--por-minuto', type=int, default=settings.EMAIL_POR_MINUTO,
+            help=f"Máximo de emails por minuto, 0 sin límite (default: EMAIL_POR_MINUTO = {settings.EMAIL_POR_MINUTO})",
+        )
+        parser.add_argument('--espera', type=float, default=5.0, help="Segundos entre consultas con el outbox vacío (default: 5)")
+        parser.add_argument('--una-vez', action='store_true', help="Manda lo pendiente y termina (para cron)")
+
+    def handle(self, *args, **options):
+        detener = threading.Event()
+
+        def al_recibir_senal(signum, frame):
+            # Se termina el email en curso; lo que falta del lote vuelve al outbox
+            self.stdout.write("Deteniendo worker...")
+            detener.set()
+
+        totales = {'ENVIADO': 0, 'REINTENTO': 0, 'FALLIDO': 0}
+        anteriores = {senal: signal.signal(senal, al_recibir_senal) for senal in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            while not detener.is_set():
+                resultados = enviar_pendientes(
+                    lote=options['lote'], por_minuto=options['por_minuto'], detener=detener,
+                )
+                for estado, cantidad in resultados.items():
+                    totales[estado] += cantidad
+                if options['una_vez']:
+                    break
+                detener.wait(options['espera'])
+        finally:
+            for senal, anterior in anteriores.items():
+                signal.signal(senal, anterior)
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {totales['ENVIADO']} enviados, {totales['REINTENTO']} para reintentar, "
+            f"{totales['FALLIDO']} fallidos."
+        ))
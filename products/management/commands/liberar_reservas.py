@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from products.reservas import ReservaService
+
+
+class Command(BaseCommand):
+    help = "Libera el stock retenido por reservas vencidas de pedidos sin pagar (correr cada minuto)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help="Reservas por transacción (default: 500)")
+
+    def handle(self, *args, **options):
+        liberadas = ReservaService.liberar_vencidas(lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"Listo: {liberadas} reservas liberadas."))
@@ -0,0 +1,39 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from products.cola import procesar_cola
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola de notificaciones de Mercado Pago: aplica los pagos que "
+        "guardó el webhook. Corre hasta recibir SIGTERM/SIGINT (o con --una-vez, hasta vaciar la cola)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hilos', type=int, default=4, help="Workers concurrentes (default: 4)")
+        parser.add_argument('--lote', type=int, default=5, help="Notificaciones que toma cada worker por vez (default: 5)")
+        parser.add_argument('--espera', type=float, default=1.0, help="Segundos entre consultas con la cola vacía (default: 1)")
+        parser.add_argument('--una-vez', action='store_true', help="Procesa lo pendiente y termina (para cron)")
+
+    def handle(self, *args, **options):
+        detener = threading.Event()
+
+        def al_recibir_senal(signum, frame):
+            # Se termina lo ya tomado; lo demás queda en la cola
+            self.stdout.write("Deteniendo worker...")
+            detener.set()
+
+        anteriores = {senal: signal.signal(senal, al_recibir_senal) for senal in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            resultados = procesar_cola(
+                hilos=options['hilos'], lote=options['lote'], espera=options['espera'],
+                detener=detener, hasta_vaciar=options['una_vez'],
+            )
+        finally:
+            for senal, anterior in anteriores.items():
+                signal.signal(senal, anterior)
+        self.stdout.write(self.style.SUCCESS(
+            f"Listo: {resultados['HECHA']} procesadas, {resultados['PENDIENTE']} para reintentar, "
+            f"{resultados['FALLIDA']} fallidas."
+        ))
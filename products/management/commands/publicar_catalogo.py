@@ -0,0 +1,49 @@
+import signal
+import threading
+from django.core.management.base import BaseCommand
+from products.snapshots import publicar_si_pendiente, publicar_snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Publica los snapshots JSON estáticos del catálogo (lista, ofertas, categorías y destacados). "
+        "Con --vigilar queda corriendo y republica cuando el catálogo cambia, hasta recibir SIGTERM/SIGINT."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--vigilar', action='store_true', help="Republica cada vez que el catálogo queda pendiente")
+        parser.add_argument('--calma', type=float, default=5.0, help="Segundos sin cambios antes de publicar (default: 5)")
+        parser.add_argument('--maximo', type=float, default=60.0, help="Demora máxima de una publicación pendiente (default: 60)")
+        parser.add_argument('--espera', type=float, default=1.0, help="Segundos entre consultas (default: 1)")
+
+    def handle(self, *args, **options):
+        if not options['vigilar']:
+            self.mostrar(publicar_snapshots())
+            return
+
+        detener = threading.Event()
+
+        def al_recibir_senal(signum, frame):
+            self.stdout.write("Deteniendo publicador...")
+            detener.set()
+
+        anteriores = {senal: signal.signal(senal, al_recibir_senal) for senal in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            while not detener.is_set():
+                try:
+                    puntero = publicar_si_pendiente(calma=options['calma'], maximo=options['maximo'])
+                except Exception as e:
+                    # Los clientes siguen con el snapshot anterior; se reintenta en la próxima vuelta
+                    self.stderr.write(f"❌ Error publicando snapshots del catálogo: {type(e).__name__}: {e}")
+                    puntero = None
+                if puntero:
+                    self.mostrar(puntero)
+                detener.wait(options['espera'])
+        finally:
+            for senal, anterior in anteriores.items():
+                signal.signal(senal, anterior)
+
+    def mostrar(self, puntero):
+        for nombre, url in puntero['archivos'].items():
+            self.stdout.write(f"  {nombre}: {url}")
+        self.stdout.write(self.style.SUCCESS(f"Listo: versión {puntero['version']} publicada."))
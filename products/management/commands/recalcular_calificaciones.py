@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from products.models import Producto
+from products.services import CalificacionService
+
+
+class Command(BaseCommand):
+    help = "Recalcula desde las reseñas aprobadas los totales de estrellas guardados en cada producto."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=500, help="Productos por lote (default: 500)")
+
+    def handle(self, *args, **options):
+        ultimo_id, total = 0, 0
+        # Lotes por ID (keyset): cada vuelta es una consulta indexada
+        while True:
+            ids = list(
+                Producto.objects.filter(id__gt=ultimo_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:options['lote']]
+            )
+            if not ids:
+                break
+            total += CalificacionService.recalcular(ids)
+            ultimo_id = ids[-1]
+            self.stdout.write(f"  {total} productos recalculados (hasta ID {ultimo_id})")
+
+        self.stdout.write(self.style.SUCCESS(f"Listo: {total} productos recalculados."))
@@ -0,0 +1,52 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from products.models import SolicitudPreferencia
+from products.services import CompraService
+
+
+def tomar_pendientes(limite, cantidad=50):
+    """
+    Reclama un lote de solicitudes PENDIENTE de pedidos todavía PENDIENTE.
+    skip_locked: dos corridas a la vez no se llevan la misma fila, y al
+    marcar `actualizada` la fila queda tomada (fuera de la transacción) hasta
+    `limite`: si el proceso se cae a mitad del lote, otra corrida la reintenta.
+    """
+    ahora = timezone.now()
+    with transaction.atomic():
+        solicitudes = list(
+            SolicitudPreferencia.objects.filter(
+                estado='PENDIENTE', pedido__estado='PENDIENTE', creada__lte=limite, actualizada__lte=limite,
+            )
+            .select_related('pedido')
+            .order_by('creada')
+            .select_for_update(skip_locked=True, of=('self',))[:cantidad]
+        )
+        SolicitudPreferencia.objects.filter(id__in=[s.id for s in solicitudes]).update(actualizada=ahora)
+    return solicitudes
+
+
+class Command(BaseCommand):
+    help = "Envía a Mercado Pago las solicitudes de preferencia que quedaron pendientes (por ejemplo, si el proceso se cayó después del commit)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutos', type=int, default=2, help="Antigüedad mínima de la solicitud (default: 2)")
+
+    def handle(self, *args, **options):
+        limite = timezone.now() - timedelta(minutes=options['minutos'])
+        enviadas = fallidas = 0
+        while True:
+            # Cada lote tomado deja de cumplir el filtro: el while termina
+            solicitudes = tomar_pendientes(limite)
+            if not solicitudes:
+                break
+            for solicitud in solicitudes:
+                try:
+                    CompraService.enviar_preferencia(solicitud)
+                    enviadas += 1
+                except ValueError as e:
+                    fallidas += 1
+                    self.stdout.write(self.style.WARNING(f"  Pedido #{solicitud.pedido_id}: {e}"))
+
+        self.stdout.write(self.style.SUCCESS(f"Listo: {enviadas} enviadas, {fallidas} fallidas."))
@@ -0,0 +1,60 @@
+import signal
+import threading
+import time
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+# (comando, cada cuántos segundos): lo que en un servidor propio iría en cron
+TAREAS = (
+    ('liberar_reservas', 60),
+    ('reintentar_preferencias', 120),
+    ('conciliar_pedidos', 60 * 60),
+    ('vencer_ventas', 24 * 60 * 60),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Programador de las tareas periódicas (reservas vencidas, preferencias pendientes, "
+        "conciliación con Mercado Pago y ranking de ventas) para plataformas sin cron. "
+        "Corre hasta recibir SIGTERM/SIGINT (o con --una-vez, corre cada tarea una vez)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true', help="Corre cada tarea una vez y termina")
+
+    def handle(self, *args, **options):
+        detener = threading.Event()
+
+        def al_recibir_senal(signum, frame):
+            # La tarea en curso termina; la próxima vuelta no arranca
+            self.stdout.write("Deteniendo programador...")
+            detener.set()
+
+        # Al arrancar corren todas: cada comando se puede repetir sin efectos dobles
+        proximas = {comando: time.monotonic() for comando, _ in TAREAS}
+        anteriores = {senal: signal.signal(senal, al_recibir_senal) for senal in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            while not detener.is_set():
+                for comando, intervalo in TAREAS:
+                    if detener.is_set() or time.monotonic() < proximas[comando]:
+                        continue
+                    self.correr(comando)
+                    proximas[comando] = time.monotonic() + intervalo
+                if options['una_vez']:
+                    break
+                detener.wait(max(min(proximas.values()) - time.monotonic(), 0))
+        finally:
+            for senal, anterior in anteriores.items():
+                signal.signal(senal, anterior)
+
+    def correr(self, comando):
+        try:
+            call_command(comando, stdout=self.stdout, stderr=self.stderr)
+        except Exception as e:
+            # Una tarea que falla no frena a las demás; se reintenta en su próxima vuelta
+            self.stderr.write(f"❌ Error en {comando}: {type(e).__name__}: {e}")
+        finally:
+            # Proceso de larga vida: no quedarse con conexiones caídas o viejas
+            close_old_connections()
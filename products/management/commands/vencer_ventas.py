@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from products.cache import invalidar_version, subir_version
+from products.indices import indice_sugerencias
+from products.services import RankingService
+from products.snapshots import programar_publicacion
+
+
+class Command(BaseCommand):
+    help = "Descuenta del ranking de más vendidos los días que salieron de las ventanas de 7/30/90 días (correr una vez por día)."
+
+    def handle(self, *args, **options):
+        vencidas = RankingService.vencer()
+        if vencidas:
+            # destacados y mas-vendidos dependen del ranking
+            invalidar_version('catalogo')
+            programar_publicacion()
+        # El autocompletado pondera por unidades vendidas: se refresca una vez
+        # por día acá y no con cada pago
+        subir_version(indice_sugerencias.nombre_version)
+        self.stdout.write(self.style.SUCCESS(f"Listo: {vencidas} ventas diarias vencidas."))
@@ -0,0 +1,208 @@
+"""
+Acceso a la API de Mercado Pago. Todas las llamadas pasan por
+`sdk_mercadopago()`, que usa un único cliente HTTP por proceso (`cliente_mp`):
+
+- Pool de conexiones keep-alive: no se repite el handshake TLS en cada pago.
+- Timeouts de conexión (MP_TIMEOUT_CONEXION) y de lectura (MP_TIMEOUT).
+- Reintentos con backoff y jitter solo para los GET, que son idempotentes.
+- Circuit breaker: si MP falla varias veces seguidas se deja de llamarlo un
+  rato y se falla al instante con MPNoDisponible, en vez de tener workers
+  colgados esperando timeouts.
+- Métricas de latencia y errores del proceso (`cliente_mp.metricas.resumen()`).
+
+MP_API_BASE_URL permite apuntar el SDK a otra URL base, por ejemplo al
+servidor falso de los tests.
+"""
+import random
+import threading
+import time
+from collections import Counter, deque
+
+import mercadopago
+import requests
+from django.conf import settings
+from mercadopago.config import Config, RequestOptions
+from mercadopago.http import HttpClient
+from requests.adapters import HTTPAdapter
+
+# URL fija dentro del SDK; la reemplazamos por MP_API_BASE_URL
+URL_API_MP = Config().api_base_url
+
+# Conexiones abiertas que se conservan por host (una por hilo concurrente)
+POOL = 10
+# Reintentos de un GET ante timeout, error de conexión, 429 o 5xx
+REINTENTOS_GET = 2
+# Segundos base del backoff: el reintento n espera al azar entre 0 y base * 2^n
+ESPERA_REINTENTO = 0.2
+# Fallas seguidas que abren el circuito y segundos que queda abierto
+FALLOS_PARA_ABRIR = 5
+SEGUNDOS_ABIERTO = 30
+
+
+class MPNoDisponible(requests.RequestException):
+    """MP respondió 429/5xx o el circuito está abierto: puede funcionar más tarde."""
+
+
+class CircuitoMP:
+    """
+    CERRADO: pasan todas las llamadas. Tras FALLOS_PARA_ABRIR fallas seguidas
+    pasa a ABIERTO y rechaza todo durante SEGUNDOS_ABIERTO. Después queda
+    SEMIABIERTO: deja pasar una sola llamada de prueba, que lo cierra si sale
+    bien o lo vuelve a abrir si falla.
+    """
+
+    def __init__(self):
+        self.candado = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.estado = 'CERRADO'
+        self.fallos = 0
+        self.abierto_hasta = 0.0
+
+    def permitir(self):
+        with self.candado:
+            if self.estado == 'CERRADO':
+                return True
+            if self.estado == 'ABIERTO' and time.monotonic() >= self.abierto_hasta:
+                self.estado = 'SEMIABIERTO'
+                return True
+            return False
+
+    def registrar(self, exito):
+        with self.candado:
+            if exito:
+                self.estado, self.fallos = 'CERRADO', 0
+                return
+            self.fallos += 1
+            if self.estado == 'SEMIABIERTO' or self.fallos >= FALLOS_PARA_ABRIR:
+                self.estado = 'ABIERTO'
+                self.abierto_hasta = time.monotonic() + SEGUNDOS_ABIERTO
+
+
+class MetricasMP:
+    """Contadores por método y resultado, y las últimas latencias para percentiles."""
+
+    MUESTRAS = 1000
+
+    def __init__(self):
+        self.candado = threading.Lock()
+        self.reiniciar()
+
+    def reiniciar(self):
+        self.llamadas = Counter()
+        self.reintentos = 0
+        self.latencias = deque(maxlen=self.MUESTRAS)
+
+    def registrar(self, metodo, resultado, segundos=None):
+        with self.candado:
+            self.llamadas[f"{metodo} {resultado}"] += 1
+            if segundos is not None:
+                self.latencias.append(segundos * 1000)
+
+    def registrar_reintento(self):
+        with self.candado:
+            self.reintentos += 1
+
+    def resumen(self):
+        with self.candado:
+            llamadas, reintentos, latencias = dict(self.llamadas), self.reintentos, sorted(self.latencias)
+
+        def percentil(p):
+            if not latencias:
+                return None
+            return round(latencias[min(len(latencias) - 1, int(len(latencias) * p))], 1)
+
+        return {
+            'llamadas': llamadas,
+            'reintentos': reintentos,
+            'latencia_ms': {
+                'muestras': len(latencias),
+                'p50': percentil(0.50),
+                'p95': percentil(0.95),
+                'p99': percentil(0.99),
+                'max': percentil(1),
+            },
+        }
+
+
+class ClienteHttpMP(HttpClient):
+    def __init__(self):
+        self.circuito = CircuitoMP()
+        self.metricas = MetricasMP()
+        self._sesion = None
+        self._candado = threading.Lock()
+
+    @property
+    def sesion(self):
+        # Una sola Session por proceso: urllib3 reparte sus conexiones entre hilos
+        if self._sesion is None:
+            with self._candado:
+                if self._sesion is None:
+                    sesion = requests.Session()
+                    adaptador = HTTPAdapter(pool_maxsize=POOL, max_retries=0)
+                    sesion.mount('https://', adaptador)
+                    sesion.mount('http://', adaptador)
+                    self._sesion = sesion
+        return self._sesion
+
+    def reiniciar(self):
+        self.circuito.reiniciar()
+        self.metricas.reiniciar()
+
+    def request(self, method, url, maxretries=None, **kwargs):
+        base = settings.MP_API_BASE_URL.rstrip('/')
+        if url.startswith(URL_API_MP):
+            url = base + url[len(URL_API_MP):]
+        kwargs['timeout'] = (float(settings.MP_TIMEOUT_CONEXION), float(settings.MP_TIMEOUT))
+
+        # Un POST repetido podría crear dos preferencias: solo se reintentan los GET
+        intentos = 1 + (REINTENTOS_GET if method == 'GET' else 0)
+        for intento in range(intentos):
+            ultimo = intento == intentos - 1
+            if intento:
+                self.metricas.registrar_reintento()
+                time.sleep(random.uniform(0, ESPERA_REINTENTO * 2 ** intento))
+            if not self.circuito.permitir():
+                self.metricas.registrar(method, 'circuito abierto')
+                raise MPNoDisponible("Mercado Pago no responde: circuito abierto")
+
+            inicio = time.perf_counter()
+            try:
+                respuesta = self.sesion.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                self.circuito.registrar(False)
+                resultado = 'timeout' if isinstance(e, requests.Timeout) else 'error de conexión'
+                self.metricas.registrar(method, resultado, time.perf_counter() - inicio)
+                if ultimo:
+                    raise
+                continue
+
+            falla = respuesta.status_code == 429 or respuesta.status_code >= 500
+            self.circuito.registrar(not falla)
+            self.metricas.registrar(method, respuesta.status_code, time.perf_counter() - inicio)
+            if not falla or ultimo:
+                return self._convertir(respuesta)
+
+    @staticmethod
+    def _convertir(respuesta):
+        # Mismo formato que devuelve el HttpClient del SDK
+        resultado = {"status": respuesta.status_code, "response": None}
+        if respuesta.status_code != 204 and respuesta.content:
+            try:
+                resultado["response"] = respuesta.json()
+            except ValueError:
+                pass
+        return resultado
+
+
+cliente_mp = ClienteHttpMP()
+
+
+def sdk_mercadopago():
+    token = getattr(settings, 'MP_ACCESS_TOKEN', None)
+    if not token:
+        raise ValueError("Error de configuración: MP_ACCESS_TOKEN no encontrado en settings.")
+    # El SDK es liviano; las conexiones y el circuito viven en cliente_mp
+    opciones = RequestOptions(connection_timeout=float(settings.MP_TIMEOUT), max_retries=0)
+    return mercadopago.SDK(token, http_client=cliente_mp, request_options=opciones)
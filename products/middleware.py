@@ -0,0 +1,57 @@
+import os
+from urllib.parse import urlparse
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.string_utils import ensure_leading_trailing_slash
+
+from .snapshots import materializar
+
+
+class CatalogoWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    WhiteNoise que además sirve los snapshots del catálogo (products.snapshots).
+    Cada versión vive en su propia carpeta y nunca cambia, así que se marca
+    como inmutable. Las versiones que publica otro proceso después del
+    arranque se registran (y, si no están en este disco, se copian desde la
+    caché compartida) la primera vez que alguien las pide.
+    """
+
+    def __init__(self, get_response=None, settings=settings):
+        # Antes de super(): immutable_file_test ya se usa al registrar STATIC_ROOT
+        self.snapshots_root = settings.CATALOGO_SNAPSHOTS_ROOT
+        self.snapshots_prefix = ensure_leading_trailing_slash(urlparse(settings.CATALOGO_SNAPSHOTS_URL).path)
+        super().__init__(get_response, settings=settings)
+        if self.autorefresh:
+            self.add_files(self.snapshots_root, prefix=self.snapshots_prefix)
+        elif os.path.isdir(self.snapshots_root):
+            for version in os.listdir(self.snapshots_root):
+                self.registrar_version(version)
+
+    def registrar_version(self, version):
+        directorio = os.path.join(self.snapshots_root, version)
+        if version.startswith('.') or not os.path.isdir(directorio):
+            return False
+        self.update_files_dictionary(directorio + os.path.sep, f"{self.snapshots_prefix}{version}/")
+        return True
+
+    def __call__(self, request):
+        path = request.path_info
+        if path.startswith(self.snapshots_prefix):
+            version = path[len(self.snapshots_prefix):].split('/', 1)[0]
+            canonica = self.url_is_canonical(path)
+            if canonica and version and not version.startswith('.'):
+                # Publicada por otra réplica: se copia desde la caché compartida
+                materializar(version)
+            if not self.autorefresh:
+                if not canonica or not os.path.isdir(os.path.join(self.snapshots_root, version)):
+                    # Versión podada (o inexistente): que responda Django con 404
+                    self.files.pop(path, None)
+                elif path not in self.files:
+                    self.registrar_version(version)
+        return super().__call__(request)
+
+    def immutable_file_test(self, path, url):
+        # Solo los archivos dentro de una versión; el puntero puede cambiar
+        if url.startswith(self.snapshots_prefix):
+            return '/' in url[len(self.snapshots_prefix):]
+        return super().immutable_file_test(path, url)
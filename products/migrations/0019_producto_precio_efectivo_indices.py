@@ -0,0 +1,48 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:16
+
+from django.db import migrations, models
+from django.db.models import Case, F, When
+
+
+def calcular_precio_efectivo(apps, schema_editor):
+    Producto = apps.get_model('products', 'Producto')
+    Producto.objects.update(precio_efectivo=Case(
+        When(en_oferta=True, precio_oferta__isnull=False, then=F('precio_oferta')),
+        default=F('precio'),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0018_alter_reseña_unique_together_remove_reseña_producto_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='precio_efectivo',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='Precio Efectivo'),
+        ),
+        migrations.RunPython(calcular_precio_efectivo, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['-fecha_creacion', '-id'], name='producto_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['precio_efectivo', 'id'], name='producto_precio_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['categoria', '-fecha_creacion'], name='producto_cat_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['en_oferta', '-fecha_creacion'], name='producto_oferta_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['stock'], name='producto_stock_idx'),
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:25
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def calcular_calificaciones(apps, schema_editor):
+    Producto = apps.get_model('products', 'Producto')
+    Reseña = apps.get_model('blog', 'Reseña')
+
+    histogramas = defaultdict(dict)
+    conteos = Reseña.objects.filter(moderado=True).values('producto_id', 'puntuacion').annotate(cantidad=Count('id'))
+    for fila in conteos:
+        histogramas[fila['producto_id']][fila['puntuacion']] = fila['cantidad']
+
+    for producto_id, histograma in histogramas.items():
+        suma = sum(estrellas * cantidad for estrellas, cantidad in histograma.items())
+        cantidad = sum(histograma.values())
+        Producto.objects.filter(pk=producto_id).update(
+            puntuacion_suma=suma,
+            puntuacion_cantidad=cantidad,
+            puntuacion_promedio=(Decimal(suma) / cantidad).quantize(Decimal('0.01')),
+            **{f'estrellas_{e}': histograma.get(e, 0) for e in range(1, 6)},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0019_producto_precio_efectivo_indices'),
+        ('blog', '0003_resena_producto_fecha_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='estrellas_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='puntuacion_cantidad',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='puntuacion_promedio',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=3, verbose_name='Promedio de Estrellas'),
+        ),
+        migrations.AddField(
+            model_name='producto',
+            name='puntuacion_suma',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='producto',
+            index=models.Index(fields=['-puntuacion_promedio', '-id'], name='producto_puntuacion_idx'),
+        ),
+        migrations.RunPython(calcular_calificaciones, migrations.RunPython.noop),
+    ]
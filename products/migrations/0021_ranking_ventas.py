@@ -0,0 +1,81 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:34
+
+import datetime
+from collections import Counter
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def cargar_ventas(apps, schema_editor):
+    ItemPedido = apps.get_model('products', 'ItemPedido')
+    VentaDiaria = apps.get_model('products', 'VentaDiaria')
+    RankingVentas = apps.get_model('products', 'RankingVentas')
+
+    # Sin fecha de pago guardada, se usa la fecha de venta del pedido
+    hoy = timezone.localdate()
+    desde = timezone.now() - datetime.timedelta(days=90)
+    ventas = Counter()
+    items = ItemPedido.objects.filter(
+        pedido__estado__in=['PAGADO', 'ENTREGADO'], pedido__fecha_venta__gte=desde
+    ).values_list('producto_id', 'pedido__fecha_venta', 'cantidad')
+    for producto_id, fecha, cantidad in items.iterator():
+        ventas[(producto_id, timezone.localtime(fecha).date())] += cantidad
+
+    ranking = {}
+    filas = []
+    for (producto_id, dia), cantidad in ventas.items():
+        edad = (hoy - dia).days
+        fila = VentaDiaria(producto_id=producto_id, dia=dia, cantidad=cantidad)
+        totales = ranking.setdefault(producto_id, RankingVentas(producto_id=producto_id))
+        for dias in (7, 30, 90):
+            if edad >= dias:
+                setattr(fila, f'fuera_{dias}', True)
+            else:
+                setattr(totales, f'ventas_{dias}', getattr(totales, f'ventas_{dias}') + cantidad)
+        filas.append(fila)
+    VentaDiaria.objects.bulk_create(filas, batch_size=1000)
+    RankingVentas.objects.bulk_create(ranking.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0020_producto_calificaciones'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingVentas',
+            fields=[
+                ('producto', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking', serialize=False, to='products.producto')),
+                ('ventas_7', models.IntegerField(default=0)),
+                ('ventas_30', models.IntegerField(default=0)),
+                ('ventas_90', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Ranking de Ventas',
+                'verbose_name_plural': 'Ranking de Ventas',
+                'indexes': [models.Index(fields=['-ventas_7', 'producto'], name='ranking_7_idx'), models.Index(fields=['-ventas_30', 'producto'], name='ranking_30_idx'), models.Index(fields=['-ventas_90', 'producto'], name='ranking_90_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='VentaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('cantidad', models.PositiveIntegerField(default=0)),
+                ('fuera_7', models.BooleanField(default=False)),
+                ('fuera_30', models.BooleanField(default=False)),
+                ('fuera_90', models.BooleanField(default=False)),
+                ('producto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ventas_diarias', to='products.producto')),
+            ],
+            options={
+                'verbose_name': 'Venta Diaria',
+                'verbose_name_plural': 'Ventas Diarias',
+                'indexes': [models.Index(fields=['dia'], name='venta_diaria_dia_idx')],
+                'constraints': [models.UniqueConstraint(fields=('producto', 'dia'), name='venta_diaria_unica')],
+            },
+        ),
+        migrations.RunPython(cargar_ventas, migrations.RunPython.noop),
+    ]
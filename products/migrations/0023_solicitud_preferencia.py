@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0022_producto_relacionado'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pedido',
+            name='preferencia_id',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='Preferencia MP'),
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='url_pago',
+            field=models.URLField(blank=True, max_length=500, null=True, verbose_name='URL de Pago'),
+        ),
+        migrations.CreateModel(
+            name='SolicitudPreferencia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('ENVIADA', 'Enviada'), ('FALLIDA', 'Fallida')], default='PENDIENTE', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('creada', models.DateTimeField(auto_now_add=True)),
+                ('actualizada', models.DateTimeField(auto_now=True)),
+                ('pedido', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='solicitud_preferencia', to='products.pedido')),
+            ],
+            options={
+                'verbose_name': 'Solicitud de Preferencia MP',
+                'verbose_name_plural': 'Solicitudes de Preferencia MP',
+                'indexes': [models.Index(fields=['estado', 'creada'], name='solicitud_estado_idx')],
+            },
+        ),
+    ]
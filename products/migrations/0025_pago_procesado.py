@@ -0,0 +1,27 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:45
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0024_reservas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PagoProcesado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pago_id', models.CharField(max_length=50, unique=True, verbose_name='ID de Pago MP')),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('pedido', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='pagos', to='products.pedido')),
+            ],
+            options={
+                'verbose_name': 'Pago Procesado',
+                'verbose_name_plural': 'Pagos Procesados',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 12:48
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0025_pago_procesado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificacionMP',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(max_length=30)),
+                ('recurso_id', models.CharField(max_length=50, verbose_name='ID en MP')),
+                ('payload', models.JSONField(blank=True, default=dict)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('PROCESANDO', 'Procesando'), ('HECHA', 'Hecha'), ('FALLIDA', 'Fallida')], default='PENDIENTE', max_length=20)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('disponible_desde', models.DateTimeField(default=django.utils.timezone.now)),
+                ('lease_hasta', models.DateTimeField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('creada', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Notificación MP',
+                'verbose_name_plural': 'Notificaciones MP',
+                'indexes': [models.Index(fields=['estado', 'disponible_desde'], name='notificacion_cola_idx'), models.Index(fields=['estado', 'lease_hasta'], name='notificacion_lease_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 13:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0030_clave_idempotencia_pedido'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pedido',
+            name='estado',
+            field=models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En Proceso'), ('PAGADO', 'Pagado - Preparando Envío'), ('A_REVISAR', 'Pagado - Revisar (Reembolso o Reposición)'), ('ENTREGADO', 'Entregado'), ('CANCELADO', 'Cancelado')], default='PENDIENTE', max_length=20, verbose_name='Estado de Entrega'),
+        ),
+    ]
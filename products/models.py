@@ -35,12 +35,73 @@ class Producto(models.Model):
     en_oferta = models.BooleanField(default=False, verbose_name="¿En Oferta?")
     precio_oferta = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, verbose_name="Precio Promo")
     
+    # Precio que realmente se cobra (oferta o base). Se guarda para poder
+    # filtrar/ordenar el catálogo por precio usando un índice.
+    precio_efectivo = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False, verbose_name="Precio Efectivo")
+
+    # Calificaciones de reseñas aprobadas, mantenidas al moderar (CalificacionService)
+    puntuacion_suma = models.PositiveIntegerField(default=0, editable=False)
+    puntuacion_cantidad = models.PositiveIntegerField(default=0, editable=False)
+    puntuacion_promedio = models.DecimalField(max_digits=3, decimal_places=2, default=0, editable=False, verbose_name="Promedio de Estrellas")
+    estrellas_1 = models.PositiveIntegerField(default=0, editable=False)
+    estrellas_2 = models.PositiveIntegerField(default=0, editable=False)
+    estrellas_3 = models.PositiveIntegerField(default=0, editable=False)
+    estrellas_4 = models.PositiveIntegerField(default=0, editable=False)
+    estrellas_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    # Unidades retenidas por reservas activas de pedidos sin pagar (ReservaService)
+    reservado = models.PositiveIntegerField(default=0, editable=False, verbose_name="Reservado")
+
     imagen = models.ImageField(upload_to='productos/', null=True, blank=True)
     fecha_creacion = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Índices compuestos para la paginación por cursor del catálogo
+            models.Index(fields=['-fecha_creacion', '-id'], name='producto_fecha_idx'),
+            models.Index(fields=['precio_efectivo', 'id'], name='producto_precio_idx'),
+            models.Index(fields=['categoria', '-fecha_creacion'], name='producto_cat_fecha_idx'),
+            models.Index(fields=['en_oferta', '-fecha_creacion'], name='producto_oferta_fecha_idx'),
+            models.Index(fields=['stock'], name='producto_stock_idx'),
+            models.Index(fields=['-puntuacion_promedio', '-id'], name='producto_puntuacion_idx'),
+        ]
+
     def __str__(self):
         return f"{self.nombre} ({self.aroma})"
 
+    def calcular_precio_efectivo(self):
+        if self.en_oferta and self.precio_oferta is not None:
+            return self.precio_oferta
+        return self.precio
+
+    # Solo los toca CalificacionService con UPDATE ... F(); un save() común no
+    # debe pisarlos con los valores (quizás viejos) que tenga en memoria.
+    CAMPOS_CALIFICACION = (
+        'puntuacion_suma', 'puntuacion_cantidad', 'puntuacion_promedio',
+        'estrellas_1', 'estrellas_2', 'estrellas_3', 'estrellas_4', 'estrellas_5',
+    )
+
+    # Igual que las calificaciones: lo mantiene ReservaService con F()
+    CAMPOS_RESERVA = ('reservado',)
+
+    @property
+    def disponible(self):
+        """Stock que se puede vender: el físico menos lo reservado."""
+        return max(self.stock - self.reservado, 0)
+
+    def save(self, *args, **kwargs):
+        self.precio_efectivo = self.calcular_precio_efectivo()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'precio_efectivo' not in update_fields:
+            kwargs['update_fields'] = list(update_fields) + ['precio_efectivo']
+        elif update_fields is None and not self._state.adding and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key
+                and campo.name not in self.CAMPOS_CALIFICACION + self.CAMPOS_RESERVA
+            ]
+        super().save(*args, **kwargs)
+
 
 # ENDPOINT  DE COMPRAS (CARRITO)
 class Pedido(models.Model):
@@ -49,6 +110,8 @@ class Pedido(models.Model):
         ('PENDIENTE', 'Pendiente'),
         ('EN_PROCESO', 'En Proceso'),
         ('PAGADO', 'Pagado - Preparando Envío'),
+        # Pagado pero sin stock para entregarlo: reembolsar o reponer
+        ('A_REVISAR', 'Pagado - Revisar (Reembolso o Reposición)'),
         ('ENTREGADO', 'Entregado'),
         ('CANCELADO', 'Cancelado'),
     ]
@@ -77,14 +140,174 @@ class Pedido(models.Model):
         verbose_name="Estado de Entrega"
     )
 
+    # Preferencia de Mercado Pago (se completa después del commit, ver SolicitudPreferencia)
+    preferencia_id = models.CharField(max_length=100, null=True, blank=True, verbose_name="Preferencia MP")
+    url_pago = models.URLField(max_length=500, null=True, blank=True, verbose_name="URL de Pago")
+
     class Meta:
         verbose_name = "Venta Realizada"
         verbose_name_plural = "Ventas Realizadas"
+        indexes = [
+            # Barrido por keyset de los pedidos pendientes (comando conciliar_pedidos)
+            models.Index(fields=['estado', 'id'], name='pedido_estado_id_idx'),
+        ]
 
     def __str__(self):
         # Ahora el nombre del pedido también mostrará el estado para identificarlo rápido
         return f"Venta #{self.id} - {self.usuario.username} ({self.get_estado_display()})"
 
+# Outbox de la preferencia de Mercado Pago: se guarda en la misma transacción
+# que el pedido y la llamada a MP se hace recién después del commit, sin
+# tener bloqueados los productos mientras tanto.
+class SolicitudPreferencia(models.Model):
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('ENVIADA', 'Enviada'),
+        ('FALLIDA', 'Fallida'),
+    ]
+
+    pedido = models.OneToOneField(Pedido, related_name='solicitud_preferencia', on_delete=models.CASCADE)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='PENDIENTE')
+    error = models.TextField(blank=True)
+    creada = models.DateTimeField(auto_now_add=True)
+    actualizada = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Solicitud de Preferencia MP"
+        verbose_name_plural = "Solicitudes de Preferencia MP"
+        indexes = [
+            models.Index(fields=['estado', 'creada'], name='solicitud_estado_idx'),
+        ]
+
+    def __str__(self):
+        return f"Pedido #{self.pedido_id} | {self.estado}"
+
+# Stock retenido por un pedido hasta que se paga o vence (ReservaService)
+class Reserva(models.Model):
+    ESTADOS = [
+        ('ACTIVA', 'Activa'),
+        ('CONFIRMADA', 'Confirmada'),
+        ('LIBERADA', 'Liberada'),
+    ]
+
+    pedido = models.ForeignKey(Pedido, related_name='reservas', on_delete=models.CASCADE)
+    producto = models.ForeignKey(Producto, related_name='reservas', on_delete=models.CASCADE)
+    cantidad = models.PositiveIntegerField()
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='ACTIVA')
+    vence = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Reserva de Stock"
+        verbose_name_plural = "Reservas de Stock"
+        indexes = [
+            models.Index(fields=['estado', 'vence'], name='reserva_estado_vence_idx'),
+        ]
+
+    def __str__(self):
+        return f"Pedido #{self.pedido_id} | {self.producto_id} x {self.cantidad} ({self.estado})"
+
+# Pagos de Mercado Pago ya aplicados: MP reintenta las notificaciones y un
+# pago repetido se descarta con una búsqueda por índice único.
+class PagoProcesado(models.Model):
+    pago_id = models.CharField(max_length=50, unique=True, verbose_name="ID de Pago MP")
+    pedido = models.ForeignKey(Pedido, related_name='pagos', on_delete=models.SET_NULL, null=True, blank=True)
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Pago Procesado"
+        verbose_name_plural = "Pagos Procesados"
+
+    def __str__(self):
+        return f"Pago {self.pago_id} -> Pedido #{self.pedido_id}"
+
+# Cola de notificaciones de Mercado Pago: el webhook solo guarda la
+# notificación y el comando procesar_notificaciones la aplica (products.cola).
+class NotificacionMP(models.Model):
+    ESTADOS = (
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('HECHA', 'Hecha'),
+        ('FALLIDA', 'Fallida'),
+    )
+    tipo = models.CharField(max_length=30)
+    recurso_id = models.CharField(max_length=50, verbose_name="ID en MP")
+    payload = models.JSONField(default=dict, blank=True)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='PENDIENTE')
+    intentos = models.PositiveSmallIntegerField(default=0)
+    disponible_desde = models.DateTimeField(default=timezone.now)
+    lease_hasta = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    creada = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Notificación MP"
+        verbose_name_plural = "Notificaciones MP"
+        indexes = [
+            models.Index(fields=['estado', 'disponible_desde'], name='notificacion_cola_idx'),
+            models.Index(fields=['estado', 'lease_hasta'], name='notificacion_lease_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.tipo} {self.recurso_id} ({self.estado})"
+
+# Idempotency-Key de POST /comprar/: la respuesta guardada se devuelve tal
+# cual a los reintentos del cliente (products.idempotencia).
+class ClaveIdempotencia(models.Model):
+    ESTADOS = (
+        ('EN_CURSO', 'En curso'),
+        ('COMPLETA', 'Completa'),
+    )
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    clave = models.CharField(max_length=255)
+    huella = models.CharField(max_length=64, verbose_name="Hash del pedido")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='EN_CURSO')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    respuesta = models.TextField(blank=True)
+    # Pedido que la request ya dejó guardado: desde ahí la clave no se libera
+    pedido = models.ForeignKey(Pedido, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    creada = models.DateTimeField(auto_now_add=True)
+    tomada = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name = "Clave de Idempotencia"
+        verbose_name_plural = "Claves de Idempotencia"
+        constraints = [
+            models.UniqueConstraint(fields=['usuario', 'clave'], name='idempotencia_usuario_clave_unica'),
+        ]
+        indexes = [models.Index(fields=['creada'], name='idempotencia_creada_idx')]
+
+    def __str__(self):
+        return f"{self.clave} ({self.estado})"
+
+# Outbox de emails: se guardan en la misma transacción que el cambio que
+# los origina y el comando enviar_emails los manda en lotes (products.correo).
+class EmailOutbox(models.Model):
+    ESTADOS = (
+        ('PENDIENTE', 'Pendiente'),
+        ('ENVIADO', 'Enviado'),
+        ('FALLIDO', 'Fallido'),
+    )
+    asunto = models.CharField(max_length=255)
+    mensaje = models.TextField()
+    remitente = models.CharField(max_length=255)
+    destinatarios = models.JSONField(default=list)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='PENDIENTE')
+    intentos = models.PositiveSmallIntegerField(default=0)
+    disponible_desde = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    creado = models.DateTimeField(auto_now_add=True)
+    enviado = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Email Saliente"
+        verbose_name_plural = "Emails Salientes"
+        indexes = [
+            models.Index(fields=['estado', 'disponible_desde'], name='email_outbox_cola_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.asunto} -> {', '.join(self.destinatarios)} ({self.estado})"
+
 # ENDPOINT DE DETALLE DE LA VENTA
 class ItemPedido(models.Model):
     pedido = models.ForeignKey(Pedido, related_name='items', on_delete=models.CASCADE)
@@ -99,6 +322,69 @@ class ItemPedido(models.Model):
     def __str__(self):
         return f"{self.producto.nombre} x {self.cantidad}"
 
+# --- RANKING DE VENTAS ---
+# Unidades pagadas por producto y día. El webhook suma al confirmar el pago y
+# el comando vencer_ventas descuenta del ranking los días que salen de cada
+# ventana (los flags fuera_N evitan descontar dos veces).
+class VentaDiaria(models.Model):
+    producto = models.ForeignKey(Producto, related_name='ventas_diarias', on_delete=models.CASCADE)
+    dia = models.DateField()
+    cantidad = models.PositiveIntegerField(default=0)
+    fuera_7 = models.BooleanField(default=False)
+    fuera_30 = models.BooleanField(default=False)
+    fuera_90 = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = "Venta Diaria"
+        verbose_name_plural = "Ventas Diarias"
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'dia'], name='venta_diaria_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['dia'], name='venta_diaria_dia_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id} | {self.dia} | {self.cantidad}"
+
+
+# Unidades vendidas en los últimos 7/30/90 días: el top N es una lectura por índice
+class RankingVentas(models.Model):
+    producto = models.OneToOneField(Producto, related_name='ranking', on_delete=models.CASCADE, primary_key=True)
+    ventas_7 = models.IntegerField(default=0)
+    ventas_30 = models.IntegerField(default=0)
+    ventas_90 = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Ranking de Ventas"
+        verbose_name_plural = "Ranking de Ventas"
+        indexes = [
+            models.Index(fields=['-ventas_7', 'producto'], name='ranking_7_idx'),
+            models.Index(fields=['-ventas_30', 'producto'], name='ranking_30_idx'),
+            models.Index(fields=['-ventas_90', 'producto'], name='ranking_90_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id} | 7d: {self.ventas_7} | 30d: {self.ventas_30} | 90d: {self.ventas_90}"
+
+# "Comprados juntos": los K productos que más aparecen en los mismos pedidos
+# pagados. Lo llena el comando calcular_relacionados (products.recomendaciones).
+class ProductoRelacionado(models.Model):
+    producto = models.ForeignKey(Producto, related_name='relacionados', on_delete=models.CASCADE)
+    relacionado = models.ForeignKey(Producto, related_name='relacionado_en', on_delete=models.CASCADE)
+    veces = models.PositiveIntegerField(verbose_name="Pedidos en común")
+    posicion = models.PositiveSmallIntegerField()
+
+    class Meta:
+        verbose_name = "Producto Relacionado"
+        verbose_name_plural = "Productos Relacionados"
+        constraints = [
+            models.UniqueConstraint(fields=['producto', 'posicion'], name='relacionado_posicion_unica'),
+        ]
+
+    def __str__(self):
+        return f"{self.producto_id} -> {self.relacionado_id} ({self.veces})"
+
 # --- LOGS DE COMPRA (MySQL AlwaysData) ---
 class CompraLog(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -0,0 +1,68 @@
+"""
+API de Mercado Pago falsa para tests y benchmarks: un servidor HTTP local en
+un hilo, al que se apunta el SDK con MP_API_BASE_URL.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ServidorMPFalso:
+    """
+    API de Mercado Pago falsa en un hilo local. `respuestas` mapea
+    (método, prefijo de ruta) a (status, json) o a una función(ruta, cuerpo)
+    que devuelve eso; `demora` simula una API lenta. Habla HTTP/1.1 con
+    keep-alive como la API real; `conexiones` cuenta las conexiones TCP.
+    """
+
+    def __init__(self):
+        self.respuestas = {}
+        self.recibidas = []
+        self.demora = 0
+        self.conexiones = 0
+        servidor_falso = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Cabeceras y cuerpo van en dos escrituras: sin esto Nagle + ACK
+            # demorado suman ~40 ms a cada respuesta sobre una conexión reusada
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                servidor_falso.conexiones += 1
+
+            def responder(self):
+                largo = int(self.headers.get('Content-Length') or 0)
+                cuerpo = json.loads(self.rfile.read(largo) or b'null')
+                servidor_falso.recibidas.append((self.command, self.path, cuerpo))
+                time.sleep(servidor_falso.demora)
+                respuesta = (404, {"message": "not found"})
+                for (metodo, prefijo), valor in servidor_falso.respuestas.items():
+                    if metodo == self.command and self.path.startswith(prefijo):
+                        respuesta = valor(self.path, cuerpo) if callable(valor) else valor
+                        break
+                datos = json.dumps(respuesta[1]).encode()
+                try:
+                    self.send_response(respuesta[0])
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(datos)))
+                    self.end_headers()
+                    self.wfile.write(datos)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            do_GET = do_POST = do_PUT = responder
+
+            def log_message(self, *args):
+                pass
+
+        self.servidor = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.servidor.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.servidor.server_port}"
+        threading.Thread(target=self.servidor.serve_forever, daemon=True).start()
+
+    def cerrar(self):
+        self.servidor.shutdown()
+        self.servidor.server_close()
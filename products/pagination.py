@@ -0,0 +1,147 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination
+from rest_framework.utils.urls import replace_query_param
+
+
+def _invertir(campo):
+    return campo[1:] if campo.startswith('-') else f'-{campo}'
+
+
+def _despues(orden, valores):
+    """
+    Filas que van después de `valores` en `orden`, comparando la clave completa
+    en orden lexicográfico: (a, id) > (x, y) es a > x o (a = x e id > y).
+    El primer campo se acota además con >= para que la base use el índice
+    como rango.
+    """
+    condicion = None
+    for campo, valor in reversed(list(zip(orden, valores))):
+        nombre = campo.lstrip('-')
+        sentido = 'lt' if campo.startswith('-') else 'gt'
+        estricto = Q(**{f'{nombre}__{sentido}': valor})
+        condicion = estricto if condicion is None else estricto | (Q(**{nombre: valor}) & condicion)
+    primero = orden[0]
+    rango = 'lte' if primero.startswith('-') else 'gte'
+    return Q(**{f'{primero.lstrip("-")}__{rango}': valores[0]}) & condicion
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Paginación por cursor con clave compuesta: el cursor guarda los valores de
+    todos los campos del orden (por ejemplo precio e id) de la última fila
+    vista y la página siguiente filtra por esa tupla. A diferencia del cursor
+    de DRF, que solo guarda el primer campo y resuelve los empates con OFFSET,
+    ninguna página usa OFFSET aunque muchas filas compartan el mismo valor.
+    El último campo del orden tiene que ser único (el id).
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        valores, atras = self.decode_cursor(request, queryset)
+
+        # Hacia atrás se recorre con el orden invertido y se da vuelta la página
+        orden = tuple(_invertir(c) for c in self.ordering) if atras else self.ordering
+        queryset = queryset.order_by(*orden)
+        if valores is not None:
+            queryset = queryset.filter(_despues(orden, valores))
+
+        resultados = list(queryset[:self.page_size + 1])
+        hay_mas = len(resultados) > self.page_size
+        self.page = resultados[:self.page_size]
+        if atras:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, hay_mas
+        else:
+            self.has_next, self.has_previous = hay_mas, valores is not None
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], atras=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], atras=True)
+
+    def encode_cursor(self, fila, atras):
+        valores = []
+        for campo in self.ordering:
+            valor = getattr(fila, campo.lstrip('-'))
+            # Decimal y datetime viajan como texto sin perder precisión
+            valores.append(valor if isinstance(valor, (int, float)) or valor is None else str(valor))
+        datos = json.dumps({'v': valores, 'r': int(atras)}, separators=(',', ':'))
+        cursor = urlsafe_b64encode(datos.encode()).decode().rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, queryset):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None, False
+        try:
+            datos = json.loads(urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            valores, atras = datos['v'], bool(datos.get('r'))
+            if not isinstance(valores, list) or len(valores) != len(self.ordering):
+                raise ValueError
+            valores = [
+                self._a_python(queryset.model, campo.lstrip('-'), valor)
+                for campo, valor in zip(self.ordering, valores)
+            ]
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        if any(valor is None for valor in valores):
+            raise NotFound(self.invalid_cursor_message)
+        return valores, atras
+
+    @staticmethod
+    def _a_python(modelo, nombre, valor):
+        try:
+            return modelo._meta.get_field(nombre).to_python(valor)
+        except FieldDoesNotExist:
+            return valor
+
+
+class CatalogoCursorPagination(KeysetCursorPagination):
+    """
+    Paginación por cursor (keyset) del catálogo: cada página filtra por la
+    última clave (valor del orden, id) vista en lugar de usar OFFSET, así la
+    página 50 cuesta lo mismo que la primera en cualquiera de los órdenes,
+    también cuando hay muchos productos con el mismo precio o valoración.
+    """
+    page_size = 24
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-fecha_creacion', '-id')
+
+    # Cada orden coincide con uno de los índices compuestos de Producto
+    ORDENES = {
+        'recientes': ('-fecha_creacion', '-id'),
+        'antiguos': ('fecha_creacion', 'id'),
+        'precio': ('precio_efectivo', 'id'),
+        '-precio': ('-precio_efectivo', '-id'),
+        'valoracion': ('-puntuacion_promedio', '-id'),
+    }
+
+    def get_ordering(self, request, queryset, view):
+        orden = request.query_params.get('orden', 'recientes')
+        return self.ORDENES.get(orden, self.ordering)
+
+
+class ReseñasCursorPagination(KeysetCursorPagination):
+    """Reseñas de un producto, de la más nueva a la más vieja."""
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    ordering = ('-fecha', '-id')
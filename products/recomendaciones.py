@@ -0,0 +1,76 @@
+"""
+"Comprados juntos": matriz dispersa producto x producto con la cantidad de
+pedidos pagados en los que aparecen ambos, armada con operaciones
+vectorizadas de NumPy (sin loops de Python por línea de pedido). De cada
+fila se guardan los K vecinos con más pedidos en común en
+ProductoRelacionado, y /<id>/relacionados/ lee de esa tabla.
+"""
+import numpy as np
+from django.db import transaction
+
+from .models import ItemPedido, ProductoRelacionado
+
+# Vecinos guardados por producto
+K = 8
+ESTADOS_VENDIDOS = ('PAGADO', 'ENTREGADO')
+
+
+def calcular_coocurrencias(pedidos, productos, k=K):
+    """
+    `pedidos` y `productos` son arrays paralelos (una posición por línea de
+    pedido). Devuelve (origen, destino, veces, posicion): para cada producto,
+    sus hasta `k` vecinos ordenados por pedidos en común (desempate por ID).
+    """
+    pedidos = np.asarray(pedidos, dtype=np.int64)
+    productos = np.asarray(productos, dtype=np.int64)
+    vacio = np.empty(0, dtype=np.int64)
+    if not len(pedidos):
+        return vacio, vacio, vacio, vacio
+
+    # IDs de producto -> índices densos; una sola fila por (pedido, producto)
+    ids, columnas = np.unique(productos, return_inverse=True)
+    m = len(ids)
+    lineas = np.unique(pedidos * m + columnas)
+    pedidos, columnas = lineas // m, lineas % m
+
+    # Ya ordenado por pedido: cada grupo es un pedido
+    _, inicios, tamaños = np.unique(pedidos, return_index=True, return_counts=True)
+    grupo = np.repeat(np.arange(len(inicios)), tamaños)
+
+    # Cada línea se cruza con todas las de su pedido (producto cartesiano por grupo)
+    repeticiones = tamaños[grupo]
+    a = np.repeat(np.arange(len(columnas)), repeticiones)
+    desplazamiento = np.arange(len(a)) - np.repeat(np.cumsum(repeticiones) - repeticiones, repeticiones)
+    b = inicios[grupo[a]] + desplazamiento
+    distintos = a != b
+    a, b = columnas[a[distintos]], columnas[b[distintos]]
+
+    # Matriz dispersa en formato coordenado: (fila, columna) -> pedidos en común
+    celdas, veces = np.unique(a * m + b, return_counts=True)
+    filas, cols = celdas // m, celdas % m
+
+    # Top-K por fila: orden por fila, veces descendente e ID del vecino
+    orden = np.lexsort((ids[cols], -veces, filas))
+    filas, cols, veces = filas[orden], cols[orden], veces[orden]
+    _, inicio_fila, tamaño_fila = np.unique(filas, return_index=True, return_counts=True)
+    posicion = np.arange(len(filas)) - np.repeat(inicio_fila, tamaño_fila)
+    top = posicion < k
+    return ids[filas[top]], ids[cols[top]], veces[top], posicion[top]
+
+
+def reconstruir_relacionados(k=K, lote=5000):
+    """Recalcula la tabla ProductoRelacionado completa. Devuelve las filas guardadas."""
+    lineas = ItemPedido.objects.filter(pedido__estado__in=ESTADOS_VENDIDOS).values_list('pedido_id', 'producto_id')
+    datos = np.fromiter(
+        (valor for linea in lineas.iterator(chunk_size=lote) for valor in linea), dtype=np.int64
+    ).reshape(-1, 2)
+    origen, destino, veces, posicion = calcular_coocurrencias(datos[:, 0], datos[:, 1], k)
+
+    filas = [
+        ProductoRelacionado(producto_id=o, relacionado_id=d, veces=v, posicion=p)
+        for o, d, v, p in zip(origen.tolist(), destino.tolist(), veces.tolist(), posicion.tolist())
+    ]
+    with transaction.atomic():
+        ProductoRelacionado.objects.all().delete()
+        ProductoRelacionado.objects.bulk_create(filas, batch_size=lote)
+    return len(filas)
@@ -0,0 +1,172 @@
+"""
+Reservas de stock con vencimiento. Al crear el pedido se retiene lo comprado
+(Producto.reservado); el pago convierte la reserva en descuento real de
+stock (si todavía alcanza) y `liberar_vencidas()` (comando liberar_reservas) devuelve lo que no
+se pagó a tiempo. La disponibilidad es stock - reservado, guardada en la
+fila del producto: nunca se suma Reserva por request.
+"""
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from .cache import invalidar_productos, invalidar_version, subir_version
+from .indices import indice_facetas
+from .models import ItemPedido, Producto, Reserva
+from .snapshots import programar_publicacion
+
+
+def _por_producto(cantidades):
+    """CASE producto_id -> cantidad, para actualizar varios productos en un UPDATE."""
+    return Case(
+        *[When(id=producto_id, then=Value(cantidad)) for producto_id, cantidad in cantidades.items()],
+        default=Value(0),
+        output_field=IntegerField(),
+    )
+
+
+class _SinStock(Exception):
+    pass
+
+
+def avisar_cambio_disponibilidad(producto_ids, cambio_en_stock=True):
+    """
+    update() no dispara señales: invalida las respuestas cacheadas que
+    muestran la disponibilidad de `producto_ids` y marca los snapshots. Solo
+    si alguno se agotó o volvió a tener stock (`cambio_en_stock`) cambian los
+    filtros en_stock, los destacados y las facetas, y ahí sí sube la versión
+    de todo el catálogo.
+    """
+    invalidar_productos(producto_ids)
+    if cambio_en_stock:
+        invalidar_version('catalogo')
+        transaction.on_commit(lambda: subir_version(indice_facetas.nombre_version))
+    programar_publicacion()
+
+
+def _cambio_en_stock(cambios):
+    """
+    ¿Algún producto se agotó o volvió a tener stock? `cambios` es
+    {producto_id: cuánto cambió su disponible}, ya aplicado en la base.
+    """
+    cambios = {producto_id: cambio for producto_id, cambio in cambios.items() if cambio}
+    if not cambios:
+        return False
+    return Producto.objects.filter(id__in=cambios).alias(
+        ahora=F('stock') - F('reservado'),
+        antes=F('stock') - F('reservado') - _por_producto(cambios),
+    ).filter(Q(ahora__gt=0, antes__lte=0) | Q(ahora__lte=0, antes__gt=0)).exists()
+
+
+class ReservaService:
+    @staticmethod
+    def reservar(pedido, lineas):
+        """
+        Retiene el stock de `lineas` ([(producto, cantidad, precio)], con los
+        productos ya bloqueados por CompraService.armar_lineas). Va dentro de
+        la transacción que crea el pedido.
+        """
+        vence = timezone.now() + timedelta(minutes=settings.RESERVA_MINUTOS)
+        Reserva.objects.bulk_create([
+            Reserva(pedido=pedido, producto=producto, cantidad=cant, vence=vence)
+            for producto, cant, _ in lineas
+        ])
+        cantidades = {producto.id: cant for producto, cant, _ in lineas}
+        Producto.objects.filter(id__in=cantidades).update(reservado=F('reservado') + _por_producto(cantidades))
+
+        # Las respuestas cacheadas (listas, /lote/, /cotizar/) muestran
+        # `disponible`: se invalidan las de estos productos. El catálogo
+        # entero solo si alguno se agotó (`disponible` es previo al UPDATE).
+        avisar_cambio_disponibilidad(
+            list(cantidades), any(producto.disponible <= cant for producto, cant, _ in lineas),
+        )
+
+    @staticmethod
+    def confirmar(pedido):
+        """
+        Pago aprobado: descuenta del stock todo el pedido y del reservado lo
+        que seguía retenido. El UPDATE es condicional: si la reserva había
+        vencido y lo que quedó libre ya se lo llevó otro comprador, no se
+        descuenta nada (el stock nunca queda por debajo de lo reservado), se
+        libera lo que seguía retenido y devuelve False para que el pedido
+        quede para reembolso o reposición. Devuelve True si descontó.
+        """
+        with transaction.atomic():
+            activas = list(
+                pedido.reservas.filter(estado='ACTIVA').select_for_update()
+                .values_list('id', 'producto_id', 'cantidad')
+            )
+            vendidas = Counter()
+            for producto_id, cantidad in ItemPedido.objects.filter(pedido=pedido).values_list('producto_id', 'cantidad'):
+                vendidas[producto_id] += cantidad
+            retenidas = Counter()
+            for _, producto_id, cantidad in activas:
+                retenidas[producto_id] += cantidad
+
+            cambios = {'stock': F('stock') - _por_producto(vendidas)}
+            if retenidas:
+                cambios['reservado'] = F('reservado') - _por_producto(retenidas)
+            try:
+                with transaction.atomic():
+                    # Alcanza si stock >= lo reservado por otros pedidos + lo vendido
+                    descontados = Producto.objects.filter(
+                        id__in=vendidas,
+                        stock__gte=F('reservado') - _por_producto(retenidas) + _por_producto(vendidas),
+                    ).update(**cambios)
+                    if descontados != len(vendidas):
+                        raise _SinStock
+            except _SinStock:
+                ReservaService._liberar([fila[0] for fila in activas])
+                return False
+            Reserva.objects.filter(id__in=[fila[0] for fila in activas]).update(estado='CONFIRMADA')
+            # stock y reservado bajan juntos: el disponible solo cambia si la
+            # reserva había vencido
+            cambios = {p: retenidas[p] - vendidas[p] for p in vendidas.keys() | retenidas.keys()}
+            avisar_cambio_disponibilidad(list(cambios), _cambio_en_stock(cambios))
+        return True
+
+    @staticmethod
+    def liberar_pedido(pedido):
+        """Devuelve lo retenido por un pedido que no se va a pagar."""
+        return ReservaService.liberar_pedidos([pedido.id])
+
+    @staticmethod
+    def liberar_pedidos(pedido_ids):
+        """Lo mismo para varios pedidos a la vez, en un solo UPDATE por tabla."""
+        with transaction.atomic():
+            ids = list(
+                Reserva.objects.filter(pedido_id__in=pedido_ids, estado='ACTIVA')
+                .select_for_update().values_list('id', flat=True)
+            )
+            return ReservaService._liberar(ids)
+
+    @staticmethod
+    def liberar_vencidas(lote=500):
+        """Libera en lotes las reservas vencidas. Devuelve cuántas liberó."""
+        total = 0
+        while True:
+            with transaction.atomic():
+                # skip_locked: dos barredores a la vez no se pisan ni se esperan
+                ids = list(
+                    Reserva.objects.filter(estado='ACTIVA', vence__lte=timezone.now())
+                    .order_by('vence')
+                    .select_for_update(skip_locked=True)
+                    .values_list('id', flat=True)[:lote]
+                )
+                if not ids:
+                    return total
+                total += ReservaService._liberar(ids)
+
+    @staticmethod
+    def _liberar(ids):
+        if not ids:
+            return 0
+        retenidas = Counter()
+        for producto_id, cantidad in Reserva.objects.filter(id__in=ids).values_list('producto_id', 'cantidad'):
+            retenidas[producto_id] += cantidad
+        Producto.objects.filter(id__in=retenidas).update(reservado=F('reservado') - _por_producto(retenidas))
+        Reserva.objects.filter(id__in=ids).update(estado='LIBERADA')
+        avisar_cambio_disponibilidad(list(retenidas), _cambio_en_stock(retenidas))
+        return len(ids)
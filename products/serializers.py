@@ -1,5 +1,4 @@
 from rest_framework import serializers
-from django.db.models import Avg
 # 1. Importamos lo que quedó en products
 from .models import Consulta, Producto, Categoria, Pedido, ItemPedido
 # 2. Importamos lo que se movió a blog (CORRECCIÓN AQUÍ)
@@ -20,39 +19,73 @@ class ReseñaSerializer(serializers.ModelSerializer):
         fields = ['id', 'usuario_nombre', 'puntuacion', 'comentario', 'fecha']
 
 # 3. PRODUCTOS (Unificado: Categoría + Reseñas + Stats)
-class ProductoSerializer(serializers.ModelSerializer):
+class CamposDinamicosMixin:
+    """
+    Permite elegir qué campos se serializan con `campos=[...]`.
+    Sin `campos` se usan `campos_por_defecto` (o todos si es None).
+    """
+    campos_por_defecto = None
+
+    def __init__(self, *args, campos=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if campos is None:
+            campos = self.campos_por_defecto
+        if campos is not None:
+            for nombre in set(self.fields) - set(campos):
+                self.fields.pop(nombre)
+
+
+class ProductoSerializer(CamposDinamicosMixin, serializers.ModelSerializer):
+    # Cuántas reseñas viajan embebidas en el producto
+    RESEÑAS_RECIENTES = 3
+
     # Relación con categoría
     categoria_nombre = serializers.ReadOnlyField(source='categoria.nombre')
     
     # Campos calculados y métodos
     hay_stock = serializers.SerializerMethodField()
+    disponible = serializers.ReadOnlyField()
     promedio_estrellas = serializers.SerializerMethodField()
-    total_reseñas = serializers.SerializerMethodField()
+    total_reseñas = serializers.ReadOnlyField(source='puntuacion_cantidad')
+    distribucion_estrellas = serializers.SerializerMethodField()
     reseñas = serializers.SerializerMethodField()
 
     class Meta:
         model = Producto
         fields = [
             'id', 'nombre', 'categoria', 'categoria_nombre', 
-            'aroma', 'precio', 'precio_oferta', 'en_oferta', 
-            'stock', 'hay_stock', 'descripcion', 'imagen',
-            'promedio_estrellas', 'total_reseñas', 'reseñas'
+            'aroma', 'precio', 'precio_oferta', 'en_oferta', 'precio_efectivo',
+            'stock', 'disponible', 'hay_stock', 'descripcion', 'imagen',
+            'promedio_estrellas', 'total_reseñas', 'distribucion_estrellas', 'reseñas'
         ]
 
     def get_hay_stock(self, obj):
-        return obj.stock > 0
+        return obj.disponible > 0
 
+    # Si el objeto viene de CatalogoService.queryset_catalogo usamos lo ya
+    # precargado; si no, caemos a la consulta individual.
     def get_reseñas(self, obj):
-        # Solo reseñas aprobadas (moderado=True)
-        queryset = obj.reseñas.filter(moderado=True)
+        # Solo las últimas reseñas aprobadas; el resto en /<id>/reseñas/
+        queryset = getattr(obj, 'reseñas_moderadas', None)
+        if queryset is None:
+            queryset = obj.reseñas.filter(moderado=True).select_related('usuario').order_by('-fecha', '-id')[:self.RESEÑAS_RECIENTES]
         return ReseñaSerializer(queryset, many=True).data
 
+    # Promedio y totales vienen guardados en Producto (CalificacionService)
     def get_promedio_estrellas(self, obj):
-        promedio = obj.reseñas.filter(moderado=True).aggregate(Avg('puntuacion'))['puntuacion__avg']
-        return round(promedio, 1) if promedio else 0
+        promedio = obj.puntuacion_promedio
+        return round(float(promedio), 1) if promedio else 0
+
+    def get_distribucion_estrellas(self, obj):
+        return {estrellas: getattr(obj, f'estrellas_{estrellas}') for estrellas in range(1, 6)}
+
 
-    def get_total_reseñas(self, obj):
-        return obj.reseñas.filter(moderado=True).count()
+# Versión liviana para las grillas: sin descripción ni reseñas salvo ?expand=
+class ProductoListaSerializer(ProductoSerializer):
+    campos_por_defecto = [
+        campo for campo in ProductoSerializer.Meta.fields
+        if campo not in ('descripcion', 'distribucion_estrellas', 'reseñas')
+    ]
 
 # 4. CARRITO Y PEDIDOS
 class ItemPedidoSerializer(serializers.ModelSerializer):
@@ -68,7 +101,7 @@ class HistorialSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Pedido
-        fields = ['id', 'fecha_venta', 'total_pagado', 'estado', 'estado_texto', 'items']
+        fields = ['id', 'fecha_venta', 'total_pagado', 'estado', 'estado_texto', 'url_pago', 'items']
 
 # 5. BLOG
 class PostSerializer(serializers.ModelSerializer):
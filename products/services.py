@@ -1,90 +1,725 @@
-import mercadopago
+import hashlib
+import requests
 from django.conf import settings
-from django.db import transaction
-from .models import Producto, Pedido, ItemPedido
+from django.core.cache import cache
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from types import SimpleNamespace
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, FloatField, Min, Prefetch, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+from .cache import TIEMPO_RESPUESTA, invalidar_version, obtener_version, versiones_productos
+from .correo import encolar_email
+from .indices import IndiceFacetas
+from .mercadopago_cliente import MPNoDisponible, sdk_mercadopago
+from .models import ClaveIdempotencia, CompraLog, Producto, Pedido, ItemPedido, PagoProcesado, RankingVentas, SolicitudPreferencia, VentaDiaria
+from .pagination import CatalogoCursorPagination
+from .serializers import ProductoListaSerializer, ProductoSerializer
+from .utils import enviar_confirmacion_compra
+from blog.models import Reseña
+
+
+class CatalogoService:
+    # Columnas de Producto que necesita cada campo calculado del serializer
+    COLUMNAS_CAMPO = {
+        'categoria_nombre': ('categoria', 'categoria__nombre'),
+        'hay_stock': ('stock', 'reservado'),
+        'disponible': ('stock', 'reservado'),
+        'promedio_estrellas': ('puntuacion_promedio',),
+        'total_reseñas': ('puntuacion_cantidad',),
+        'distribucion_estrellas': tuple(f'estrellas_{e}' for e in range(1, 6)),
+        'reseñas': (),
+    }
+    # Siempre se cargan: las usan el orden y la paginación por cursor
+    COLUMNAS_FIJAS = ('id', 'fecha_creacion', 'precio_efectivo', 'puntuacion_promedio')
+    # Tope de IDs por pedido a /lote/
+    MAX_LOTE = 50
+
+    @staticmethod
+    def queryset_catalogo(productos=None, campos=None):
+        """
+        Arma el queryset de productos listo para ProductoSerializer.
+        Categoría y reseñas moderadas salen en una cantidad fija de consultas,
+        sin importar cuántos productos tenga el catálogo; las estadísticas de
+        estrellas ya vienen guardadas en Producto.
+        Con `campos` solo se cargan las columnas, joins y prefetch que esos
+        campos necesitan.
+        """
+        if productos is None:
+            productos = Producto.objects.all()
+        if campos is None:
+            campos = ProductoSerializer.Meta.fields
+
+        columnas = list(CatalogoService.COLUMNAS_FIJAS)
+        for campo in campos:
+            columnas += CatalogoService.COLUMNAS_CAMPO.get(campo, (campo,))
+        productos = productos.only(*columnas)
+
+        if 'categoria_nombre' in campos:
+            productos = productos.select_related('categoria')
+
+        if 'reseñas' in campos:
+            productos = productos.prefetch_related(
+                Prefetch(
+                    'reseñas',
+                    queryset=Reseña.objects.filter(moderado=True).select_related('usuario')
+                    .order_by('-fecha', '-id')[:ProductoSerializer.RESEÑAS_RECIENTES],
+                    to_attr='reseñas_moderadas',
+                )
+            )
+        return productos
+
+    # Querysets base de /ofertas/ y /destacados/ (también los usa snapshots.py)
+    @staticmethod
+    def productos_ofertas():
+        return Producto.objects.filter(en_oferta=True)
+
+    @staticmethod
+    def productos_destacados():
+        # Los más vendidos del último mes con stock; sin ventas, los más nuevos
+        return Producto.objects.filter(stock__gt=F('reservado')).order_by(
+            F(f'ranking__ventas_{RankingService.VENTANA_DESTACADOS}').desc(nulls_last=True), '-fecha_creacion'
+        )[:3]
+
+    @staticmethod
+    def ids_lote(valor):
+        """
+        Parsea ?ids=1,2,3 (sin repetidos, en el orden pedido). Lanza
+        ValueError si hay IDs inválidos o se supera MAX_LOTE.
+        """
+        ids = []
+        for parte in valor.split(','):
+            parte = parte.strip()
+            if not parte:
+                continue
+            if not parte.isdigit():
+                raise ValueError("El parámetro 'ids' debe ser una lista de IDs numéricos separados por coma.")
+            if int(parte) not in ids:
+                ids.append(int(parte))
+        if not ids:
+            raise ValueError("Falta el parámetro 'ids'.")
+        if len(ids) > CatalogoService.MAX_LOTE:
+            raise ValueError(f"Se pueden pedir como máximo {CatalogoService.MAX_LOTE} productos por lote.")
+        return ids
+
+    @staticmethod
+    def productos_lote(ids, campos):
+        """
+        Productos serializados en el orden de `ids` (los que no existen se
+        omiten). Cada producto se cachea por separado bajo la versión del
+        catálogo y la de su disponibilidad (una reserva invalida solo los
+        productos reservados); los que faltan salen de una sola consulta id__in.
+        """
+        seleccion = hashlib.md5(','.join(campos).encode()).hexdigest()[:8]
+        version = obtener_version('catalogo')
+        prefijo = f"producto:{version}:{seleccion}"
+        claves = {
+            producto_id: f"{prefijo}:{producto_id}:{disponibilidad}"
+            for producto_id, disponibilidad in versiones_productos(ids, version).items()
+        }
+
+        guardados = cache.get_many(claves.values())
+        faltantes = [producto_id for producto_id in ids if claves[producto_id] not in guardados]
+        if faltantes:
+            productos = CatalogoService.queryset_catalogo(Producto.objects.filter(id__in=faltantes), campos)
+            nuevos = {
+                claves[dato['id']]: dato
+                for dato in ProductoListaSerializer(productos, many=True, campos=campos).data
+            }
+            cache.set_many(nuevos, TIEMPO_RESPUESTA)
+            guardados.update(nuevos)
+        return [guardados[claves[producto_id]] for producto_id in ids if claves[producto_id] in guardados]
+
+    @staticmethod
+    def campos_producto(params):
+        """
+        Campos pedidos con ?fields= (reemplaza la selección) y ?expand=
+        (agrega a la selección liviana de las listas). Lanza ValueError si se
+        pide un campo que no existe.
+        """
+        def separar(valor):
+            return [campo.strip() for campo in valor.split(',') if campo.strip()]
+
+        campos = separar(params.get('fields', '')) or list(ProductoListaSerializer.campos_por_defecto)
+        campos += separar(params.get('expand', ''))
+
+        disponibles = ProductoSerializer.Meta.fields
+        invalidos = [campo for campo in campos if campo not in disponibles]
+        if invalidos:
+            raise ValueError(f"Campos inválidos: {', '.join(invalidos)}. Opciones: {', '.join(disponibles)}.")
+        return ['id'] + [campo for campo in disponibles if campo in campos and campo != 'id']
+
+    @staticmethod
+    def filtrar_catalogo(productos, params):
+        """
+        Aplica los filtros públicos del catálogo (categoria, en_oferta,
+        en_stock, precio_min, precio_max, puntuacion_min, orden). Lanza ValueError si algún
+        parámetro es inválido.
+        """
+        categoria = params.get('categoria')
+        if categoria:
+            if not categoria.isdigit():
+                raise ValueError("El parámetro 'categoria' debe ser un ID numérico.")
+            productos = productos.filter(categoria_id=int(categoria))
+
+        en_oferta = params.get('en_oferta')
+        if en_oferta is not None:
+            productos = productos.filter(en_oferta=CatalogoService._booleano('en_oferta', en_oferta))
+
+        en_stock = params.get('en_stock')
+        if en_stock is not None:
+            if CatalogoService._booleano('en_stock', en_stock):
+                productos = productos.filter(stock__gt=F('reservado'))
+            else:
+                productos = productos.filter(stock__lte=F('reservado'))
+
+        for param, lookup in (
+            ('precio_min', 'precio_efectivo__gte'),
+            ('precio_max', 'precio_efectivo__lte'),
+            ('puntuacion_min', 'puntuacion_promedio__gte'),
+        ):
+            valor = params.get(param)
+            if valor:
+                try:
+                    productos = productos.filter(**{lookup: Decimal(valor)})
+                except InvalidOperation:
+                    raise ValueError(f"El parámetro '{param}' debe ser un número.")
+
+        orden = params.get('orden')
+        if orden:
+            if orden not in CatalogoCursorPagination.ORDENES:
+                opciones = ", ".join(CatalogoCursorPagination.ORDENES)
+                raise ValueError(f"Orden inválido. Opciones: {opciones}.")
+            productos = productos.order_by(*CatalogoCursorPagination.ORDENES[orden])
+
+        return productos
+
+    @staticmethod
+    def filtros_facetas(params):
+        """
+        Traduce los parámetros del catálogo facetado (categoria, aroma y
+        precio se pueden repetir) al formato de IndiceFacetas.filtrar.
+        """
+        categorias = params.getlist('categoria')
+        if not all(c.isdigit() for c in categorias):
+            raise ValueError("El parámetro 'categoria' debe ser un ID numérico.")
+        bandas = params.getlist('precio')
+        validas = [clave for clave, _, _ in IndiceFacetas.BANDAS_PRECIO]
+        if any(b not in validas for b in bandas):
+            raise ValueError(f"Banda de precio inválida. Opciones: {', '.join(validas)}.")
+
+        filtros = {
+            'categoria': [int(c) for c in categorias],
+            'aroma': params.getlist('aroma'),
+            'banda': bandas,
+        }
+        for nombre in ('en_oferta', 'en_stock'):
+            valor = params.get(nombre)
+            filtros[nombre] = valor is not None and CatalogoService._booleano(nombre, valor)
+        return filtros
+
+    @staticmethod
+    def _booleano(nombre, valor):
+        valor = valor.lower()
+        if valor in ('true', '1'):
+            return True
+        if valor in ('false', '0'):
+            return False
+        raise ValueError(f"El parámetro '{nombre}' debe ser true o false.")
+
+
+class CalificacionService:
+    """
+    Mantiene los totales de estrellas guardados en Producto cuando una
+    reseña se aprueba, cambia o se borra. Todo con F() para que dos
+    moderaciones simultáneas no se pisen.
+    """
+    PROMEDIO = Case(
+        When(puntuacion_cantidad=0, then=0),
+        default=Cast('puntuacion_suma', FloatField()) / F('puntuacion_cantidad'),
+        output_field=DecimalField(max_digits=3, decimal_places=2),
+    )
+
+    @staticmethod
+    def aplicar(producto_id, histograma, signo=1):
+        """`histograma`: {estrellas: cantidad}; signo -1 para restar."""
+        histograma = {e: n for e, n in histograma.items() if n}
+        if not histograma:
+            return
+
+        cambios = {
+            'puntuacion_suma': F('puntuacion_suma') + signo * sum(e * n for e, n in histograma.items()),
+            'puntuacion_cantidad': F('puntuacion_cantidad') + signo * sum(histograma.values()),
+        }
+        for estrellas, cantidad in histograma.items():
+            cambios[f'estrellas_{estrellas}'] = F(f'estrellas_{estrellas}') + signo * cantidad
+
+        with transaction.atomic():
+            productos = Producto.objects.filter(pk=producto_id)
+            productos.update(**cambios)
+            # El promedio va en un segundo UPDATE: MySQL asigna el SET de
+            # izquierda a derecha y otros motores no, así que no lo mezclamos.
+            productos.update(puntuacion_promedio=CalificacionService.PROMEDIO)
+
+    @staticmethod
+    def aprobar_lote(reseñas):
+        """Aprueba un queryset de reseñas sumando solo las que estaban pendientes."""
+        with transaction.atomic():
+            ids = list(reseñas.filter(moderado=False).select_for_update().values_list('id', flat=True))
+            if not ids:
+                return 0
+
+            histogramas = defaultdict(Counter)
+            conteos = (
+                Reseña.objects.filter(id__in=ids)
+                .values('producto_id', 'puntuacion')
+                .annotate(cantidad=Count('id'))
+            )
+            for fila in conteos:
+                histogramas[fila['producto_id']][fila['puntuacion']] = fila['cantidad']
+
+            Reseña.objects.filter(id__in=ids).update(moderado=True)
+            for producto_id, histograma in histogramas.items():
+                CalificacionService.aplicar(producto_id, histograma)
+            return len(ids)
+
+    @staticmethod
+    def recalcular(producto_ids):
+        """Recalcula desde cero los totales de los productos indicados."""
+        producto_ids = list(producto_ids)
+        histogramas = defaultdict(Counter)
+        conteos = (
+            Reseña.objects.filter(producto_id__in=producto_ids, moderado=True)
+            .values('producto_id', 'puntuacion')
+            .annotate(cantidad=Count('id'))
+        )
+        for fila in conteos:
+            histogramas[fila['producto_id']][fila['puntuacion']] = fila['cantidad']
+
+        productos = []
+        for producto_id in producto_ids:
+            histograma = histogramas[producto_id]
+            suma = sum(e * n for e, n in histograma.items())
+            cantidad = sum(histograma.values())
+            producto = Producto(
+                pk=producto_id,
+                puntuacion_suma=suma,
+                puntuacion_cantidad=cantidad,
+                puntuacion_promedio=(Decimal(suma) / cantidad).quantize(Decimal('0.01')) if cantidad else 0,
+            )
+            for estrellas in range(1, 6):
+                setattr(producto, f'estrellas_{estrellas}', histograma[estrellas])
+            productos.append(producto)
+
+        campos = ['puntuacion_suma', 'puntuacion_cantidad', 'puntuacion_promedio'] + [f'estrellas_{e}' for e in range(1, 6)]
+        Producto.objects.bulk_update(productos, campos)
+        return len(productos)
+
+
+class RankingService:
+    """
+    Ranking de más vendidos en ventanas móviles de 7/30/90 días, sin
+    recálculos completos: el webhook suma las unidades de cada pago aprobado
+    y vencer() descuenta los días que van quedando fuera de cada ventana.
+    """
+    VENTANAS = (7, 30, 90)
+    VENTANA_DESTACADOS = 30
+
+    @staticmethod
+    def registrar_venta(pedido, dia=None):
+        """Suma al ranking las unidades de un pedido recién pagado."""
+        dia = dia or timezone.localdate()
+        cantidades = Counter()
+        for producto_id, cantidad in pedido.items.values_list('producto_id', 'cantidad'):
+            cantidades[producto_id] += cantidad
+
+        with transaction.atomic():
+            for producto_id, cantidad in cantidades.items():
+                RankingService._sumar(VentaDiaria, {'producto_id': producto_id, 'dia': dia}, {'cantidad': cantidad})
+                RankingService._sumar(
+                    RankingVentas, {'producto_id': producto_id},
+                    {f'ventas_{dias}': cantidad for dias in RankingService.VENTANAS},
+                )
+
+    @staticmethod
+    def _sumar(modelo, clave, incrementos):
+        # UPDATE con F(); si la fila no existe se crea, y si otro pago la creó
+        # en paralelo se vuelve al UPDATE.
+        cambios = {campo: F(campo) + valor for campo, valor in incrementos.items()}
+        if modelo.objects.filter(**clave).update(**cambios):
+            return
+        try:
+            with transaction.atomic():
+                modelo.objects.create(**clave, **incrementos)
+        except IntegrityError:
+            modelo.objects.filter(**clave).update(**cambios)
+
+    @staticmethod
+    def vencer(hoy=None):
+        """
+        Descuenta del ranking los días que salieron de cada ventana y borra
+        los que ya no cuentan para ninguna. Se puede correr más de una vez
+        por día (o atrasado): cada día se descuenta una sola vez por ventana.
+        """
+        hoy = hoy or timezone.localdate()
+        vencidas = 0
+        for dias in RankingService.VENTANAS:
+            marca, campo = f'fuera_{dias}', f'ventas_{dias}'
+            with transaction.atomic():
+                filas = list(
+                    VentaDiaria.objects.filter(**{marca: False}, dia__lte=hoy - timedelta(days=dias))
+                    .select_for_update()
+                    .values_list('id', 'producto_id', 'cantidad')
+                )
+                if not filas:
+                    continue
+                por_producto = Counter()
+                for _, producto_id, cantidad in filas:
+                    por_producto[producto_id] += cantidad
+
+                # Un solo UPDATE para todos los productos de la ventana
+                descuento = Case(
+                    *[When(producto_id=producto_id, then=Value(cantidad)) for producto_id, cantidad in por_producto.items()],
+                    default=Value(0),
+                )
+                RankingVentas.objects.filter(producto_id__in=por_producto).update(**{campo: F(campo) - descuento})
+                VentaDiaria.objects.filter(id__in=[fila[0] for fila in filas]).update(**{marca: True})
+                vencidas += len(filas)
+
+        VentaDiaria.objects.filter(fuera_90=True).delete()
+        return vencidas
+
+    @staticmethod
+    def mas_vendidos(ventana):
+        """Productos con ventas en la ventana, del más vendido al menos vendido."""
+        campo = f'ranking__ventas_{ventana}'
+        return Producto.objects.filter(**{f'{campo}__gt': 0}).order_by(f'-{campo}', 'id')
+
 
 class CompraService:
+    # Lo que /cotizar/ lee de la caché por producto del catálogo
+    CAMPOS_COTIZACION = ['id', 'nombre', 'precio', 'en_oferta', 'precio_efectivo', 'disponible']
+
     @staticmethod
-    def ejecutar_pago_mercadopago(usuario, items_carrito):
-        # 1. Validar que el Token exista en settings
-        token = getattr(settings, 'MP_ACCESS_TOKEN', None)
-        if not token:
+    def cantidades_carrito(items_carrito):
+        """
+        Valida los ítems del carrito y devuelve {producto_id: cantidad} en el
+        orden del carrito, con las líneas repetidas de un producto sumadas.
+        """
+        cantidades = {}
+        for item in items_carrito:
+            p_id = item.get('producto_id')
+            try:
+                p_id, cant = int(p_id), int(item.get('cantidad', 1))
+            except (TypeError, ValueError, AttributeError):
+                raise ValueError(f"Ítem inválido en el carrito: {item}")
+            if cant < 1:
+                raise ValueError(f"La cantidad del producto con ID {p_id} debe ser mayor a cero.")
+            cantidades[p_id] = cantidades.get(p_id, 0) + cant
+        return cantidades
+
+    @staticmethod
+    def precio_lineas(cantidades, por_id):
+        """
+        Precio del carrito: la única cuenta que hacen tanto la compra como
+        /cotizar/. `por_id` mapea cada ID a un objeto con nombre, disponible y
+        precio_efectivo (un Producto o su versión cacheada). Devuelve
+        ([(producto, cantidad, precio_unitario)], total).
+        """
+        lineas, total = [], Decimal('0')
+        for p_id, cant in cantidades.items():
+            producto = por_id.get(p_id)
+            if producto is None:
+                raise ValueError(f"El producto con ID {p_id} no existe.")
+            if producto.disponible < cant:
+                raise ValueError(f"Stock insuficiente para {producto.nombre}. Disponible: {producto.disponible}")
+            precio = producto.precio_efectivo
+            lineas.append((producto, cant, precio))
+            total += precio * cant
+        return lineas, total
+
+    @staticmethod
+    def armar_lineas(items_carrito, bloquear=False):
+        """
+        Valida el carrito contra el catálogo y devuelve ([(producto, cantidad,
+        precio_unitario)], total), en el orden del carrito. Con `bloquear` los
+        productos se traen con SELECT FOR UPDATE en una sola consulta ordenada
+        por ID (dos compras con productos en común bloquean siempre en el
+        mismo orden y no se trancan). Lanza ValueError si algo no cierra.
+        """
+        cantidades = CompraService.cantidades_carrito(items_carrito)
+        productos = Producto.objects.filter(id__in=cantidades).order_by('id')
+        if bloquear:
+            productos = productos.select_for_update()
+        return CompraService.precio_lineas(cantidades, {producto.id: producto for producto in productos})
+
+    @staticmethod
+    def cotizar(items_carrito):
+        """
+        Total del carrito sin crear nada ni bloquear filas: los productos salen
+        de la caché por producto del catálogo (CatalogoService.productos_lote)
+        y el precio de precio_lineas, igual que al comprar. El stock es
+        orientativo; al comprar se vuelve a validar con la fila bloqueada.
+        """
+        cantidades = CompraService.cantidades_carrito(items_carrito)
+        if len(cantidades) > CatalogoService.MAX_LOTE:
+            raise ValueError(f"Se pueden cotizar como máximo {CatalogoService.MAX_LOTE} productos distintos.")
+        por_id = {
+            dato['id']: SimpleNamespace(**dict(dato, precio_efectivo=Decimal(dato['precio_efectivo'])))
+            for dato in CatalogoService.productos_lote(list(cantidades), CompraService.CAMPOS_COTIZACION)
+        }
+        lineas, total = CompraService.precio_lineas(cantidades, por_id)
+        return {
+            'items': [
+                {
+                    'producto_id': producto.id,
+                    'nombre': producto.nombre,
+                    'cantidad': cant,
+                    'en_oferta': producto.en_oferta,
+                    'precio_unitario': str(precio),
+                    'subtotal': str(precio * cant),
+                }
+                for producto, cant, precio in lineas
+            ],
+            # Como texto, igual que los precios del catálogo
+            'total': str(total),
+        }
+
+    @staticmethod
+    def ejecutar_pago_mercadopago(usuario, items_carrito, clave=None):
+        # 1. Validar que el Token exista en settings (antes de crear nada)
+        if not getattr(settings, 'MP_ACCESS_TOKEN', None):
             raise ValueError("Error de configuración: MP_ACCESS_TOKEN no encontrado en settings.")
 
-        sdk = mercadopago.SDK(token)
-        
+        # 2. Pedido, items y solicitud de preferencia en una transacción corta
+        nuevo_pedido = CompraService.crear_pedido(usuario, items_carrito, clave=clave)
+
+        # 3. Preferencia de Mercado Pago, ya sin locks tomados
+        return nuevo_pedido, CompraService.enviar_preferencia(nuevo_pedido.solicitud_preferencia)
+
+    @staticmethod
+    def crear_pedido(usuario, items_carrito, clave=None):
+        """
+        Crea el pedido PENDIENTE con sus items, la reserva de stock y la
+        solicitud de preferencia. Si viene `clave` (ClaveIdempotencia de la
+        request), queda atada al pedido en la misma transacción.
+        """
+        from .reservas import ReservaService  # reservas -> snapshots -> services
         with transaction.atomic():
-            # 2. Crear Pedido (estado por defecto PENDIENTE según tu modelo)
+            # Una consulta bloquea todo el carrito; la validación es en memoria
+            lineas, total_acumulado = CompraService.armar_lineas(items_carrito, bloquear=True)
+
+            # Crear Pedido (estado por defecto PENDIENTE según tu modelo)
             nuevo_pedido = Pedido.objects.create(
                 usuario=usuario, 
-                total_pagado=0
+                total_pagado=total_acumulado
             )
-            
-            total_acumulado = 0
-            items_mp = []
 
-            for item in items_carrito:
-                p_id = item.get('producto_id')
-                try:
-                    producto = Producto.objects.select_for_update().get(pk=p_id)
-                except Producto.DoesNotExist:
-                    raise ValueError(f"El producto con ID {p_id} no existe.")
+            # Guardar detalle de la venta (un solo INSERT)
+            ItemPedido.objects.bulk_create([
+                ItemPedido(pedido=nuevo_pedido, producto=producto, precio_unitario=precio, cantidad=cant)
+                for producto, cant, precio in lineas
+            ])
 
-                cant = int(item.get('cantidad', 1))
+            # Retiene el stock hasta que se pague o venza la reserva
+            ReservaService.reservar(nuevo_pedido, lineas)
 
-                if producto.stock < cant:
-                    raise ValueError(f"Stock insuficiente para {producto.nombre}. Disponible: {producto.stock}")
+            # Outbox: la llamada a MP queda registrada junto con el pedido
+            SolicitudPreferencia.objects.create(pedido=nuevo_pedido)
 
-                precio = producto.precio_oferta if producto.en_oferta else producto.precio
-                subtotal = precio * cant
-                total_acumulado += subtotal
+            if clave is not None:
+                ClaveIdempotencia.objects.filter(pk=clave.pk).update(pedido=nuevo_pedido)
+        return nuevo_pedido
 
-                # Guardar detalle de la venta
-                ItemPedido.objects.create(
-                    pedido=nuevo_pedido, 
-                    producto=producto,
-                    precio_unitario=precio, 
-                    cantidad=cant
-                )
-
-                # Descontar stock
-                #producto.stock -= cant
-                #producto.save()
-
-                # Preparar item para Mercado Pago
-                items_mp.append({
-                    "title": producto.nombre,
-                    "quantity": cant,
-                    "unit_price": float(precio), # MP exige float o decimal
-                    "currency_id": "ARS"
-                })
-
-            # Actualizar el total final del pedido
-            nuevo_pedido.total_pagado = total_acumulado
-            nuevo_pedido.save()
-
-            # 3. Crear Preferencia de Mercado Pago
-            preference_data = {
-                "items": items_mp,
-                "external_reference": str(nuevo_pedido.id),
-                "back_urls": {
-                    # ASEGÚRATE DE QUE ESTAS URLS SEAN ACCESIBLES O ESTÉN BIEN FORMADAS
-                    "success": "https://front-aroma-zen.vercel.app/success", 
-                    "failure": "https://front-aroma-zen.vercel.app/cart",
-                    "pending": "https://front-aroma-zen.vercel.app/pending"
-                },
-                "auto_return": "approved", # Requiere que 'success' esté definido arriba
-                "notification_url": "https://aromazen.up.railway.app/api/productos/webhook/mercadopago/", # Opcional si usas IPN
+    @staticmethod
+    def datos_preferencia(pedido):
+        # El link de pago vence con la reserva: después el stock ya no está retenido
+        vence = pedido.reservas.aggregate(vence=Min('vence'))['vence']
+        if vence is None:
+            vence = timezone.now() + timedelta(minutes=settings.RESERVA_MINUTOS)
+        vence = timezone.localtime(vence).isoformat(timespec='milliseconds')
+        items_mp = [
+            {
+                "title": item.producto.nombre,
+                "quantity": item.cantidad,
+                "unit_price": float(item.precio_unitario), # MP exige float o decimal
+                "currency_id": "ARS"
             }
-            
-            # Llamada al SDK
-            preference_result = sdk.preference().create(preference_data)
-            response = preference_result["response"]
-
-            # --- VALIDACIÓN DE RESPUESTA DE MP ---
-            if "init_point" not in response:
-                # Si llegamos aquí, MP rechazó la petición (probablemente el Token)
-                error_detalle = response.get("message", "Error desconocido de Mercado Pago")
-                raise ValueError(f"Mercado Pago Error: {error_detalle}")
-            
-            return nuevo_pedido, preference_result["response"]
\ No newline at end of file
+            for item in pedido.items.select_related('producto').only('pedido', 'cantidad', 'precio_unitario', 'producto__nombre').order_by('id')
+        ]
+        return {
+            "items": items_mp,
+            "external_reference": str(pedido.id),
+            "back_urls": {
+                # ASEGÚRATE DE QUE ESTAS URLS SEAN ACCESIBLES O ESTÉN BIEN FORMADAS
+                "success": "https://front-aroma-zen.vercel.app/success", 
+                "failure": "https://front-aroma-zen.vercel.app/cart",
+                "pending": "https://front-aroma-zen.vercel.app/pending"
+            },
+            "auto_return": "approved", # Requiere que 'success' esté definido arriba
+            "notification_url": "https://aromazen.up.railway.app/api/productos/webhook/mercadopago/", # Opcional si usas IPN
+            "expires": True,
+            "expiration_date_to": vence,
+            # Medios en efectivo (ticket): tampoco se pueden pagar después
+            "date_of_expiration": vence,
+        }
+
+    @staticmethod
+    def enviar_preferencia(solicitud):
+        """
+        Crea en Mercado Pago la preferencia de una solicitud PENDIENTE y la
+        guarda en el Pedido. Si MP falla (o no responde dentro de MP_TIMEOUT)
+        la solicitud queda FALLIDA, el pedido CANCELADO (con su reserva
+        liberada) y se lanza ValueError.
+        """
+        from .reservas import ReservaService  # reservas -> snapshots -> services
+
+        pedido = solicitud.pedido
+        try:
+            preference_result = sdk_mercadopago().preference().create(CompraService.datos_preferencia(pedido))
+            response = preference_result["response"] or {}
+            error_detalle = None if "init_point" in response else response.get("message", "Error desconocido de Mercado Pago")
+        except requests.RequestException as e:
+            response, error_detalle = {}, f"Sin respuesta de Mercado Pago ({e.__class__.__name__})"
+
+        with transaction.atomic():
+            if error_detalle is None:
+                Pedido.objects.filter(pk=pedido.pk).update(preferencia_id=response.get("id"), url_pago=response["init_point"])
+                SolicitudPreferencia.objects.filter(pk=solicitud.pk).update(estado='ENVIADA', error='', actualizada=timezone.now())
+            else:
+                if Pedido.objects.filter(pk=pedido.pk, estado='PENDIENTE').update(estado='CANCELADO'):
+                    ReservaService.liberar_pedido(pedido)
+                SolicitudPreferencia.objects.filter(pk=solicitud.pk).update(estado='FALLIDA', error=error_detalle, actualizada=timezone.now())
+            # update() no dispara señales: mis-compras tiene que ver el cambio
+            invalidar_version(f"pedidos:{pedido.usuario_id}")
+
+        if error_detalle is not None:
+            raise ValueError(f"Mercado Pago Error: {error_detalle}")
+        return response
+
+
+class PagoService:
+    ESTADOS_PAGABLES = ('PENDIENTE', 'EN_PROCESO')
+
+    @staticmethod
+    def procesar_pago(payment_id):
+        """
+        Aplica un pago aprobado de Mercado Pago exactamente una vez: marca el
+        pedido PAGADO, convierte la reserva en descuento de stock, suma al
+        ranking y encola el email de confirmación. Un pago de un pedido
+        CANCELADO lo reactiva; si no hay stock, o si es un segundo pago de un
+        pedido ya pagado (cobro doble), el pedido queda A_REVISAR (ver
+        marcar_revision). Devuelve el Pedido si este llamado lo resolvió, o
+        None si el pago ya estaba procesado o no está aprobado. Lanza
+        MPNoDisponible si MP no pudo responder, para que la cola reintente.
+        """
+        payment_id = str(payment_id)
+        # Notificación repetida: una búsqueda por el índice único, sin ir a MP
+        if PagoProcesado.objects.filter(pago_id=payment_id).exists():
+            return None
+
+        payment_info = sdk_mercadopago().payment().get(payment_id)
+        if payment_info["status"] == 429 or payment_info["status"] >= 500:
+            raise MPNoDisponible(f"MP respondió {payment_info['status']} al consultar el pago {payment_id}")
+        pago = payment_info["response"] or {}
+        if payment_info["status"] != 200 or pago.get("status") != "approved":
+            return None
+        pedido_id = pago.get("external_reference")
+
+        try:
+            with transaction.atomic():
+                # El lock del pedido ordena las notificaciones que le llegan a la vez
+                pedido = Pedido.objects.select_for_update().filter(id=pedido_id).first()
+                # Mientras esperaba el lock otra notificación del mismo pago pudo terminar
+                if PagoProcesado.objects.filter(pago_id=payment_id).exists():
+                    return None
+                pagado = PagoService._aplicar(pedido, payment_id) if pedido else None
+                # Recién después de resolver el pedido, en la misma transacción: si
+                # algo falla no queda marcado como procesado y la cola reintenta
+                PagoProcesado.objects.create(pago_id=payment_id, pedido_id=pedido_id)
+        except IntegrityError:
+            # Otra notificación del mismo pago (sin pedido que bloquear) ganó
+            return None
+        return pagado
+
+    @staticmethod
+    def _aplicar(pedido, payment_id):
+        from .reservas import ReservaService  # reservas -> snapshots -> services
+
+        cancelado = pedido.estado == 'CANCELADO'
+        if pedido.estado not in PagoService.ESTADOS_PAGABLES and not cancelado:
+            # Otro pago aprobado de un pedido ya pagado: se le cobró dos veces
+            # al cliente. El stock se descuenta una sola vez; el pago queda
+            # para reembolsar.
+            PagoService.marcar_revision(
+                pedido, payment_id, f"pago duplicado {payment_id}, el pedido ya estaba {pedido.get_estado_display()}",
+            )
+            invalidar_version(f"pedidos:{pedido.usuario_id}")
+            return pedido
+        Pedido.objects.filter(pk=pedido.pk).update(estado='PAGADO')
+        pedido.estado = 'PAGADO'
+        if cancelado:
+            # El cliente pagó un pedido que la conciliación (o MP) ya había
+            # cancelado: se reactiva si el stock todavía alcanza
+            print(f"⚠️ [LOG PAGO] Pago {payment_id} aprobado sobre el pedido CANCELADO #{pedido.id}")
+        if ReservaService.confirmar(pedido):
+            RankingService.registrar_venta(pedido)
+            # El email se encola en esta misma transacción: sin pago no hay mail
+            PagoService.registrar_aprobacion(
+                pedido, payment_id, " [PAGO SOBRE PEDIDO CANCELADO: REACTIVADO]" if cancelado else "",
+            )
+        else:
+            motivo = "pago de un pedido cancelado, sin stock para reactivarlo" if cancelado else "sin stock al confirmar el pago"
+            PagoService.marcar_revision(pedido, payment_id, motivo)
+        # update() no dispara señales: mis-compras tiene que ver el cambio
+        invalidar_version(f"pedidos:{pedido.usuario_id}")
+        return pedido
+
+    @staticmethod
+    def registrar_aprobacion(pedido, payment_id, nota=""):
+        """
+        Al pagar: completa el CompraLog del pedido (con `nota` delante, en una
+        sola escritura) y encola el email de confirmación.
+        """
+        print(f"[LOG STOCK] Stock descontado para el pedido #{pedido.id}")
+        enviar_confirmacion_compra(pedido)
+        PagoService._completar_log(
+            pedido, payment_id, f"{nota} [PAGO APROBADO] [PAGO APROBADO Y STOCK ACTUALIZADO] [EMAIL ENCOLADO]",
+        )
+
+    @staticmethod
+    def marcar_revision(pedido, payment_id, motivo):
+        """
+        Pago aprobado de un pedido que no se puede entregar: queda A_REVISAR
+        (reembolso o reposición), con el motivo en el CompraLog y un aviso al
+        administrador por el outbox.
+        """
+        print(f"⚠️ [LOG PAGO] Pedido #{pedido.id} pagado ({payment_id}) queda A REVISAR: {motivo}")
+        Pedido.objects.filter(pk=pedido.pk).update(estado='A_REVISAR')
+        pedido.estado = 'A_REVISAR'
+        PagoService._completar_log(pedido, payment_id, f" [PAGO APROBADO] [A REVISAR: {motivo}]")
+        if settings.EMAIL_HOST_USER:
+            encolar_email(
+                f"⚠️ Pedido #{pedido.id} pagado a revisar",
+                f"El pago {payment_id} del pedido #{pedido.id} (${pedido.total_pagado}) quedó A REVISAR: {motivo}.\n"
+                f"Reembolsar el pago o reponer el stock y pasar el pedido a PAGADO desde el admin.",
+                [settings.EMAIL_HOST_USER],
+            )
+
+    @staticmethod
+    def _completar_log(pedido, payment_id, log_msg):
+        # El log que creamos al inicio; un pago posterior (duplicado) lo
+        # encuentra igual aunque la referencia ya sea la del primer pago
+        log = CompraLog.objects.filter(pedido=pedido).order_by('id').first()
+        if log:
+            if log.referencia_pago == str(pedido.id):
+                log.referencia_pago = str(payment_id)  # Actualizamos con el ID real de MP
+            log.detalle_log += log_msg
+            log.save(update_fields=['referencia_pago', 'detalle_log'])
+
+    @staticmethod
+    def procesar_notificacion(payment_id):
+        """Trabajo de la cola para una notificación 'payment'."""
+        return PagoService.procesar_pago(payment_id)
@@ -0,0 +1,87 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from .cache import invalidar_version, subir_version
+from .indices import indice_busqueda, indice_facetas, indice_sugerencias
+from .models import Categoria, Pedido, Producto
+from .services import CalificacionService
+from .snapshots import programar_publicacion
+from blog.models import Reseña
+
+
+# Cualquier cambio que se vea en el catálogo público sube su versión
+@receiver([post_save, post_delete], sender=Producto)
+@receiver([post_save, post_delete], sender=Categoria)
+@receiver([post_save, post_delete], sender=Reseña)
+def invalidar_catalogo(sender, **kwargs):
+    invalidar_version('catalogo')
+    programar_publicacion()
+
+
+# Historial de compras: una versión por usuario para los ETag de mis-compras
+@receiver([post_save, post_delete], sender=Pedido)
+def invalidar_pedidos_usuario(sender, instance, **kwargs):
+    invalidar_version(f"pedidos:{instance.usuario_id}")
+
+
+# Índices en memoria: se actualizan incrementalmente recién después del commit
+INDICES_PRODUCTO = (indice_busqueda, indice_facetas)
+
+
+@receiver(post_save, sender=Producto)
+def indexar_producto(sender, instance, **kwargs):
+    def aplicar():
+        for indice in INDICES_PRODUCTO:
+            indice.actualizar_producto(instance)
+    transaction.on_commit(aplicar)
+
+
+@receiver(post_delete, sender=Producto)
+def desindexar_producto(sender, instance, **kwargs):
+    producto_id = instance.pk
+
+    def aplicar():
+        for indice in INDICES_PRODUCTO:
+            indice.eliminar_producto(producto_id)
+    transaction.on_commit(aplicar)
+
+
+# Las facetas muestran el nombre de la categoría: cualquier cambio reconstruye
+@receiver([post_save, post_delete], sender=Categoria)
+def reconstruir_facetas(sender, **kwargs):
+    transaction.on_commit(lambda: subir_version(indice_facetas.nombre_version))
+
+
+# El autocompletado muestra nombres, aromas y categorías
+@receiver([post_save, post_delete], sender=Producto)
+@receiver([post_save, post_delete], sender=Categoria)
+def reconstruir_sugerencias(sender, **kwargs):
+    invalidar_version(indice_sugerencias.nombre_version)
+
+
+# Totales de estrellas en Producto: solo cuentan las reseñas aprobadas
+@receiver(pre_save, sender=Reseña)
+def recordar_calificacion_previa(sender, instance, **kwargs):
+    instance._calificacion_previa = None
+    if instance.pk:
+        instance._calificacion_previa = (
+            Reseña.objects.filter(pk=instance.pk).values_list('producto_id', 'puntuacion', 'moderado').first()
+        )
+
+
+@receiver(post_save, sender=Reseña)
+def actualizar_calificacion(sender, instance, **kwargs):
+    previa = getattr(instance, '_calificacion_previa', None)
+    actual = (instance.producto_id, instance.puntuacion, instance.moderado)
+    if previa == actual:
+        return
+    if previa and previa[2]:
+        CalificacionService.aplicar(previa[0], {previa[1]: 1}, signo=-1)
+    if instance.moderado:
+        CalificacionService.aplicar(instance.producto_id, {instance.puntuacion: 1})
+
+
+@receiver(post_delete, sender=Reseña)
+def descontar_calificacion(sender, instance, **kwargs):
+    if instance.moderado:
+        CalificacionService.aplicar(instance.producto_id, {instance.puntuacion: 1}, signo=-1)
@@ -0,0 +1,226 @@
+"""
+Snapshots estáticos del catálogo público.
+
+`publicar_snapshots()` renderiza una vez /lista/, /ofertas/, /categorias/ y
+/destacados/ a archivos JSON (con variantes .gz y, si está instalado brotli,
+.br) dentro de `CATALOGO_SNAPSHOTS_ROOT/<version>/`. La versión es un hash
+del contenido, así que cada archivo es inmutable y WhiteNoise lo sirve con
+caché para siempre (ver products.middleware). El frontend consulta
+/snapshot/ para saber qué versión está vigente.
+
+Publicar es caro (todo el catálogo, gzip -9 y brotli), así que no corre en
+las requests: los cambios solo marcan el catálogo como pendiente
+(`programar_publicacion()`) y el comando `publicar_catalogo --vigilar`
+publica cuando el catálogo deja de cambiar. El puntero y los archivos de
+cada versión quedan también en la caché compartida: una réplica que no
+tiene la versión en su disco la copia la primera vez que se la piden.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .models import Categoria, Producto
+from .serializers import CategoriaSerializer, ProductoListaSerializer
+from .services import CatalogoService
+
+try:
+    import brotli
+except ImportError:  # está en requirements.txt; sin brotli (entorno local) solo se publica .gz
+    brotli = None
+
+PUNTERO = 'actual.json'
+# Versiones viejas que se conservan para clientes que todavía no releyeron el puntero
+VERSIONES_CONSERVADAS = 5
+
+# Claves en la caché compartida: puntero vigente, último cambio sin publicar
+# (y el primero desde la última publicación) y hasta qué cambio se publicó
+CLAVE_PUNTERO = 'snapshots:puntero'
+CLAVE_PENDIENTE = 'snapshots:pendiente'
+CLAVE_PENDIENTE_DESDE = 'snapshots:pendiente_desde'
+CLAVE_PUBLICADO = 'snapshots:publicado'
+# Los archivos de una versión viven en la caché lo suficiente para que las
+# réplicas los copien; después de VERSIONES_CONSERVADAS ya nadie los pide
+TIEMPO_ARCHIVOS = 60 * 60 * 24 * 7
+
+
+def _productos(productos):
+    return ProductoListaSerializer(CatalogoService.queryset_catalogo(productos), many=True).data
+
+
+# Mismo contenido que devuelven las vistas sin parámetros
+CONTENIDOS = {
+    'lista': lambda: _productos(Producto.objects.all()),
+    'ofertas': lambda: _productos(CatalogoService.productos_ofertas()),
+    'categorias': lambda: CategoriaSerializer(Categoria.objects.all(), many=True).data,
+    'destacados': lambda: _productos(CatalogoService.productos_destacados()),
+}
+
+
+def url_snapshot(version, nombre):
+    return f"{settings.CATALOGO_SNAPSHOTS_URL.rstrip('/')}/{version}/{nombre}.json"
+
+
+def clave_archivos(version):
+    return f"snapshots:archivos:{version}"
+
+
+def leer_puntero():
+    """Devuelve el puntero de la última publicación o None si nunca se publicó."""
+    puntero = cache.get(CLAVE_PUNTERO)
+    if puntero is not None:
+        return puntero
+    try:
+        with open(os.path.join(settings.CATALOGO_SNAPSHOTS_ROOT, PUNTERO), encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _escribir(ruta, contenido):
+    # Escritura atómica: nunca se sirve un archivo a medio escribir
+    directorio = os.path.dirname(ruta)
+    descriptor, temporal = tempfile.mkstemp(dir=directorio, prefix='.tmp-')
+    with os.fdopen(descriptor, 'wb') as archivo:
+        archivo.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def _comprimir(cuerpos):
+    archivos = {}
+    for nombre, cuerpo in cuerpos.items():
+        archivos[f'{nombre}.json'] = cuerpo
+        archivos[f'{nombre}.json.gz'] = gzip.compress(cuerpo, compresslevel=9, mtime=0)
+        if brotli is not None:
+            archivos[f'{nombre}.json.br'] = brotli.compress(cuerpo)
+    return archivos
+
+
+def _guardar_version(version, archivos):
+    raiz = settings.CATALOGO_SNAPSHOTS_ROOT
+    directorio = os.path.join(raiz, version)
+    if os.path.isdir(directorio):
+        return
+    os.makedirs(raiz, exist_ok=True)
+    temporal = tempfile.mkdtemp(dir=raiz, prefix='.tmp-')
+    os.chmod(temporal, 0o755)
+    for nombre, contenido in archivos.items():
+        with open(os.path.join(temporal, nombre), 'wb') as archivo:
+            archivo.write(contenido)
+    try:
+        os.rename(temporal, directorio)
+    except OSError:
+        # Otro proceso guardó la misma versión en paralelo
+        shutil.rmtree(temporal, ignore_errors=True)
+
+
+def publicar_snapshots():
+    """
+    Renderiza el catálogo, lo escribe como una versión nueva (si cambió) y
+    actualiza el puntero. Devuelve el puntero publicado.
+    """
+    raiz = settings.CATALOGO_SNAPSHOTS_ROOT
+    renderer = JSONRenderer()
+    cuerpos = {nombre: renderer.render(contenido()) for nombre, contenido in CONTENIDOS.items()}
+
+    huella = hashlib.sha256()
+    for nombre in sorted(cuerpos):
+        huella.update(nombre.encode())
+        huella.update(cuerpos[nombre])
+    version = huella.hexdigest()[:16]
+
+    # Solo se comprime si la versión es nueva
+    archivos = cache.get(clave_archivos(version))
+    if archivos is None:
+        archivos = _comprimir(cuerpos)
+        cache.set(clave_archivos(version), archivos, TIEMPO_ARCHIVOS)
+    _guardar_version(version, archivos)
+
+    puntero = {
+        'version': version,
+        'publicado': timezone.now().isoformat(),
+        'archivos': {nombre: url_snapshot(version, nombre) for nombre in CONTENIDOS},
+    }
+    actual = leer_puntero()
+    if not actual or actual['version'] != version:
+        cache.set(CLAVE_PUNTERO, puntero, None)
+        _escribir(os.path.join(raiz, PUNTERO), json.dumps(puntero).encode())
+        _podar_versiones(raiz, version)
+    else:
+        puntero = actual
+    return puntero
+
+
+def materializar(version):
+    """
+    Copia al disco local una versión que publicó otra réplica, desde la
+    caché compartida. Devuelve False si la versión no existe (o ya expiró).
+    """
+    if os.path.isdir(os.path.join(settings.CATALOGO_SNAPSHOTS_ROOT, version)):
+        return True
+    archivos = cache.get(clave_archivos(version))
+    if archivos is None:
+        return False
+    _guardar_version(version, archivos)
+    _podar_versiones(settings.CATALOGO_SNAPSHOTS_ROOT, version)
+    return True
+
+
+def _podar_versiones(raiz, vigente):
+    versiones = [
+        os.path.join(raiz, nombre) for nombre in os.listdir(raiz)
+        if not nombre.startswith('.') and os.path.isdir(os.path.join(raiz, nombre))
+    ]
+    versiones.sort(key=os.path.getmtime, reverse=True)
+    for ruta in versiones[VERSIONES_CONSERVADAS:]:
+        if os.path.basename(ruta) != vigente:
+            shutil.rmtree(ruta, ignore_errors=True)
+
+
+def programar_publicacion():
+    """
+    Marca el catálogo como pendiente de publicar, después del commit y una
+    sola vez por transacción aunque se guarden muchos productos en ella. En
+    la request solo es una escritura en la caché.
+    """
+    if not settings.CATALOGO_SNAPSHOTS_AUTOPUBLICAR:
+        return
+    if any(getattr(funcion, 'pendiente', False) for _, funcion, _ in connection.run_on_commit):
+        return
+
+    def marcar():
+        marcar.pendiente = False
+        ahora = time.time_ns()
+        cache.set(CLAVE_PENDIENTE, ahora, None)
+        cache.add(CLAVE_PENDIENTE_DESDE, ahora, None)
+    marcar.pendiente = True
+    transaction.on_commit(marcar)
+
+
+def publicar_si_pendiente(calma=5, maximo=60):
+    """
+    Publica si el catálogo cambió desde la última publicación y lleva `calma`
+    segundos sin cambiar (o hace `maximo` segundos que espera, para que una
+    seguidilla de cambios no la postergue para siempre). Devuelve el puntero
+    publicado o None si no hizo falta.
+    """
+    pendiente = cache.get(CLAVE_PENDIENTE)
+    if pendiente is None or pendiente <= cache.get(CLAVE_PUBLICADO, 0):
+        return None
+    ahora = time.time_ns()
+    desde = cache.get(CLAVE_PENDIENTE_DESDE, pendiente)
+    if ahora - pendiente < calma * 1e9 and ahora - desde < maximo * 1e9:
+        return None
+    cache.delete(CLAVE_PENDIENTE_DESDE)
+    puntero = publicar_snapshots()
+    # Los cambios posteriores a `pendiente` quedan para la próxima vuelta
+    cache.set(CLAVE_PUBLICADO, pendiente, None)
+    return puntero
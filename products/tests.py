@@ -1,8 +1,41 @@
+import datetime
+import gzip
+import io
+import json
+import shutil
+import smtplib
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APITestCase, APIClient
 from django.contrib.auth.models import User
-from .models import Producto, Categoria, CompraLog
+from . import cola
+from . import correo
+from . import mercadopago_cliente
+from . import snapshots
+from .cache import obtener_version, subir_version
+from .mercadopago_cliente import ClienteHttpMP, MPNoDisponible, cliente_mp, sdk_mercadopago
+from .mp_falso import ServidorMPFalso
+from .models import (
+    Producto, Categoria, ClaveIdempotencia, CompraLog, Consulta, EmailOutbox, ItemPedido, NotificacionMP, PagoProcesado, Pedido, RankingVentas, SolicitudPreferencia, VentaDiaria,
+)
+from .recomendaciones import calcular_coocurrencias, reconstruir_relacionados
+from .reservas import ReservaService
+from .services import CompraService, PagoService, RankingService
+from .snapshots import publicar_si_pendiente, publicar_snapshots
+from blog.models import Reseña
 
 class ProductsTests(APITestCase):
     def setUp(self):
@@ -98,3 +131,1521 @@ class ProductsTests(APITestCase):
         
         # Puede ser 401 o 403 dependiendo de la configuración exacta de DRF
         self.assertTrue(response.status_code in [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+
+class CatalogoConsultasTests(APITestCase):
+    """La cantidad de consultas del catálogo no debe crecer con los productos."""
+
+    def setUp(self):
+        cache.clear()
+        self.categoria = Categoria.objects.create(nombre="Sahumerios")
+        self.cliente = User.objects.create_user(username='cliente', password='clave123')
+
+    def crear_productos(self, cantidad):
+        for i in range(cantidad):
+            producto = Producto.objects.create(
+                nombre=f"Sahumerio {i}",
+                categoria=self.categoria,
+                precio=100,
+                stock=10,
+                en_oferta=(i % 2 == 0),
+                precio_oferta=80,
+                descripcion="Natural",
+            )
+            Reseña.objects.create(producto=producto, usuario=self.cliente, puntuacion=5, comentario="Genial", moderado=True)
+            Reseña.objects.create(producto=producto, usuario=self.cliente, puntuacion=1, comentario="Pendiente")
+
+    def assertConsultasFijas(self, nombre_url, consultas, params=None):
+        url = reverse(nombre_url)
+        self.crear_productos(2)
+        with self.assertNumQueries(consultas):
+            self.client.get(url, params)
+        self.crear_productos(20)
+        with self.assertNumQueries(consultas):
+            response = self.client.get(url, params)
+        return response
+
+    def test_lista_productos_consultas_fijas(self):
+        response = self.assertConsultasFijas('products:lista-productos', 2, {'expand': 'reseñas'})
+        self.assertEqual(len(response.data), 22)
+        producto = response.data[0]
+        self.assertEqual(producto['categoria_nombre'], "Sahumerios")
+        self.assertEqual(producto['total_reseñas'], 1)
+        self.assertEqual(producto['promedio_estrellas'], 5)
+        self.assertEqual(producto['reseñas'][0]['usuario_nombre'], 'cliente')
+
+    def test_ofertas_y_destacados_consultas_fijas(self):
+        self.assertConsultasFijas('products:lista-ofertas', 1)
+        response = self.assertConsultasFijas('products:productos-destacados', 1)
+        self.assertEqual(len(response.data), 3)
+
+
+class CatalogoPaginacionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.jabones = Categoria.objects.create(nombre="Jabones")
+        self.sahumerios = Categoria.objects.create(nombre="Sahumerios")
+        for i in range(30):
+            Producto.objects.create(
+                nombre=f"Producto {i}",
+                categoria=self.jabones if i % 3 == 0 else self.sahumerios,
+                precio=100 + i,
+                en_oferta=(i % 5 == 0),
+                precio_oferta=50 if i % 5 == 0 else None,
+                stock=0 if i % 4 == 0 else 10,
+                descripcion="-",
+            )
+        self.url = reverse('products:lista-productos')
+
+    def recorrer(self, params):
+        ids = []
+        response = self.client.get(self.url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [p['id'] for p in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_recorre_todas_las_paginas_sin_repetir(self):
+        ids = self.recorrer({'page_size': 7})
+        self.assertEqual(len(ids), 30)
+        self.assertEqual(len(set(ids)), 30)
+
+    def test_pagina_profunda_misma_cantidad_de_consultas(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'page_size': 5})
+        for _ in range(4):
+            response = self.client.get(response.data['next'])
+        with self.assertNumQueries(1):
+            self.client.get(response.data['next'])
+
+    def test_orden_por_precio_efectivo(self):
+        ids = self.recorrer({'page_size': 8, 'orden': 'precio'})
+        precios = [Producto.objects.get(id=i).precio_efectivo for i in ids]
+        self.assertEqual(precios, sorted(precios))
+        self.assertEqual(precios[0], 50)
+
+    def test_empates_de_precio_sin_offset(self):
+        # 40 productos al mismo precio: el cursor tiene que desempatar por id
+        for i in range(40):
+            Producto.objects.create(
+                nombre=f"Vela {i}", categoria=self.jabones, precio=75, stock=5, descripcion="-",
+            )
+        esperados = list(Producto.objects.order_by('precio_efectivo', 'id').values_list('id', flat=True))
+        paginas = []
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.get(self.url, {'orden': 'precio', 'page_size': 10})
+            paginas.append(response.data)
+            while response.data['next']:
+                response = self.client.get(response.data['next'])
+                paginas.append(response.data)
+        ids = [p['id'] for pagina in paginas for p in pagina['results']]
+        self.assertEqual(ids, esperados)
+        self.assertEqual(len(consultas), len(paginas))
+        self.assertFalse(any('OFFSET' in c['sql'].upper() for c in consultas.captured_queries))
+
+        # Y de vuelta hacia atrás, página por página
+        previa = self.client.get(paginas[-1]['previous'])
+        self.assertEqual(
+            [p['id'] for p in previa.data['results']], [p['id'] for p in paginas[-2]['results']],
+        )
+
+    def test_cursor_invalido(self):
+        response = self.client.get(self.url, {'cursor': 'no-es-un-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_filtros(self):
+        response = self.client.get(self.url, {'categoria': self.jabones.id, 'en_stock': 'true', 'page_size': 50})
+        esperados = Producto.objects.filter(categoria=self.jabones, stock__gt=0).count()
+        self.assertEqual(len(response.data['results']), esperados)
+
+        response = self.client.get(self.url, {'precio_min': 110, 'precio_max': 120, 'en_oferta': 'false'})
+        self.assertTrue(all(110 <= float(p['precio_efectivo']) <= 120 for p in response.data))
+        self.assertFalse(any(p['en_oferta'] for p in response.data))
+
+    def test_parametro_invalido(self):
+        response = self.client.get(self.url, {'precio_min': 'barato'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'orden': 'azar'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CatalogoCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user(username='cliente', password='clave123')
+        self.producto = Producto.objects.create(nombre="Sahumerio Mirra", precio=100, stock=3, descripcion="-")
+
+    def test_acierto_no_consulta_la_base(self):
+        url = reverse('products:lista-productos')
+        primera = self.client.get(url)
+        with self.assertNumQueries(0):
+            segunda = self.client.get(url)
+        self.assertEqual(segunda.status_code, status.HTTP_200_OK)
+        self.assertEqual(primera.content, segunda.content)
+
+    def test_la_clave_incluye_los_parametros(self):
+        url = reverse('products:lista-productos')
+        self.client.get(url)
+        response = self.client.get(url, {'en_stock': 'false'})
+        self.assertEqual(response.json(), [])
+
+    def test_guardar_producto_invalida(self):
+        url = reverse('products:lista-ofertas')
+        self.assertEqual(self.client.get(url).json(), [])
+        self.producto.en_oferta = True
+        self.producto.precio_oferta = 80
+        self.producto.save()
+        self.assertEqual(len(self.client.get(url).json()), 1)
+
+    def test_aprobar_reseñas_en_lote_invalida(self):
+        from blog.admin import ReseñaAdmin
+        from django.contrib import admin
+
+        url = reverse('products:lista-productos')
+        Reseña.objects.create(producto=self.producto, usuario=self.usuario, puntuacion=4, comentario="Rico")
+        self.assertEqual(self.client.get(url).json()[0]['total_reseñas'], 0)
+        ReseñaAdmin(Reseña, admin.site).aprobar_reseñas(None, Reseña.objects.all())
+        self.assertEqual(self.client.get(url).json()[0]['total_reseñas'], 1)
+
+
+class RespuestaCondicionalTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user(username='cliente', password='clave123')
+        self.producto = Producto.objects.create(nombre="Sahumerio Palo Santo", precio=100, stock=3, descripcion="-")
+
+    def test_catalogo_responde_304_sin_consultas(self):
+        url = reverse('products:lista-productos')
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertIn('public', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_catalogo_cambia_etag_al_editar(self):
+        url = reverse('products:lista-productos')
+        etag = self.client.get(url)['ETag']
+        self.producto.stock = 0
+        self.producto.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        url = reverse('products:lista_categorias')
+        # Último cambio hace tiempo (versión en nanosegundos, no múltiplo de un segundo)
+        cache.set('version:catalogo', 1_700_000_000_250_000_000, None)
+        response = self.client.get(url)
+        self.assertEqual(response['Last-Modified'], http_date(1_700_000_001))
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_cambio_en_el_ultimo_segundo_valida_solo_con_etag(self):
+        url = reverse('products:lista_categorias')
+        subir_version('catalogo')
+        response = self.client.get(url)
+        # Otro cambio en este mismo segundo tendría el mismo Last-Modified
+        self.assertNotIn('Last-Modified', response)
+        futuro = http_date(time.time() + 60)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=futuro)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Con If-None-Match manda el ETag aunque If-Modified-Since diga otra cosa
+        cache.set('version:catalogo', 1_700_000_000_250_000_000, None)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH='"otro"', HTTP_IF_MODIFIED_SINCE=futuro)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_mis_compras_por_usuario(self):
+        from .models import Pedido
+
+        url = reverse('products:mis-compras')
+        self.client.force_authenticate(user=self.usuario)
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertIn('Authorization', response['Vary'])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Un pedido de otro usuario no invalida este historial
+        otro = User.objects.create_user(username='otro', password='clave123')
+        Pedido.objects.create(usuario=otro)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Pedido.objects.create(usuario=self.usuario)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+
+class BusquedaTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('products:buscar-productos')
+        self.lavanda = Producto.objects.create(nombre="Sahumerio Lavánda", aroma="Floral", precio=100, stock=3, descripcion="Relajante")
+        self.rosa = Producto.objects.create(nombre="Jabón de Rosa", aroma="Rosa", precio=80, stock=3, descripcion="Con un toque de lavanda")
+        self.mirra = Producto.objects.create(nombre="Sahumerio Mirra", aroma="Amaderado", precio=90, stock=3, descripcion="Intenso")
+
+    def buscar(self, q):
+        return [p['id'] for p in self.client.get(self.url, {'q': q}).data]
+
+    def test_ignora_tildes_y_ordena_por_relevancia(self):
+        self.assertEqual(self.buscar("lavanda"), [self.lavanda.id, self.rosa.id])
+        self.assertEqual(self.buscar("JABON"), [self.rosa.id])
+
+    def test_todos_los_terminos(self):
+        self.assertEqual(self.buscar("sahumerio mirra"), [self.mirra.id])
+        self.assertEqual(self.buscar("sahumerio rosa"), [])
+
+    def test_solo_consulta_por_id(self):
+        self.buscar("sahumerio")
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.buscar("sahumerio")), 2)
+
+    def test_actualizacion_incremental(self):
+        self.buscar("mirra")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mirra.nombre = "Sahumerio Copal"
+            self.mirra.save()
+            nuevo = Producto.objects.create(nombre="Vela de Mirra", precio=50, stock=1, descripcion="-")
+        self.assertEqual(self.buscar("mirra"), [nuevo.id])
+        self.assertEqual(self.buscar("copal"), [self.mirra.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            nuevo.delete()
+        self.assertEqual(self.buscar("mirra"), [])
+
+    def test_cambio_concurrente_de_otro_worker_reconstruye(self):
+        from .cache import incrementar_version
+        from .indices import indice_busqueda
+
+        self.buscar("mirra")
+        # Otro worker aplicó su cambio entre la última sincronización y este
+        Producto.objects.filter(id=self.rosa.id).update(nombre="Jabón de Mirra")
+        incrementar_version(indice_busqueda.nombre_version)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mirra.nombre = "Sahumerio Copal"
+            self.mirra.save()
+        self.assertIsNone(indice_busqueda._version)
+        self.assertEqual(self.buscar("mirra"), [self.rosa.id])
+        self.assertEqual(self.buscar("copal"), [self.mirra.id])
+
+    def test_consulta_vacia(self):
+        self.assertEqual(self.buscar(""), [])
+
+
+class SugerenciasTests(APITestCase):
+    def setUp(self):
+        from .models import ItemPedido, Pedido
+
+        cache.clear()
+        self.url = reverse('products:sugerencias-productos')
+        velas = Categoria.objects.create(nombre="Velas")
+        self.poco_vendido = Producto.objects.create(nombre="Sahumerio Lavanda", aroma="Lavanda", precio=100, stock=3, descripcion="-")
+        self.mas_vendido = Producto.objects.create(nombre="Vela Lavándula", aroma="Lavanda", categoria=velas, precio=100, stock=3, descripcion="-")
+        usuario = User.objects.create_user(username='cliente', password='clave123')
+        pagado = Pedido.objects.create(usuario=usuario, estado='PAGADO')
+        pendiente = Pedido.objects.create(usuario=usuario)
+        ItemPedido.objects.create(pedido=pagado, producto=self.mas_vendido, cantidad=5, precio_unitario=100)
+        ItemPedido.objects.create(pedido=pagado, producto=self.poco_vendido, cantidad=1, precio_unitario=100)
+        ItemPedido.objects.create(pedido=pendiente, producto=self.poco_vendido, cantidad=50, precio_unitario=100)
+
+    def sugerir(self, prefijo, **params):
+        return self.client.get(self.url, {'prefijo': prefijo, **params}).data
+
+    def test_ordena_por_unidades_vendidas(self):
+        textos = [s['texto'] for s in self.sugerir("lav")]
+        self.assertEqual(textos, ["Lavanda", "Vela Lavándula", "Sahumerio Lavanda"])
+        self.assertEqual(self.sugerir("LAVÁND")[1]['producto_id'], self.mas_vendido.id)
+
+    def test_categorias_y_limite(self):
+        self.assertEqual(self.sugerir("vel", limite=1), [{'texto': "Vela Lavándula", 'tipo': 'producto', 'producto_id': self.mas_vendido.id}])
+        self.assertIn({'texto': "Velas", 'tipo': 'categoria', 'producto_id': None}, self.sugerir("velas"))
+        self.assertEqual(self.sugerir(""), [])
+        self.assertEqual(self.sugerir("xyz"), [])
+
+    def test_sin_consultas_y_se_actualiza_con_el_catalogo(self):
+        self.sugerir("sa")
+        with self.assertNumQueries(0):
+            self.sugerir("sah")
+        Producto.objects.create(nombre="Sándalo Místico", precio=100, stock=3, descripcion="-")
+        self.assertEqual([s['texto'] for s in self.sugerir("sa")], ["Sahumerio Lavanda", "Sándalo Místico"])
+
+    def test_las_ventas_no_reconstruyen_hasta_el_refresco_diario(self):
+        from .models import ItemPedido, Pedido
+        from .reservas import avisar_cambio_disponibilidad
+
+        self.sugerir("lav")
+        pedido = Pedido.objects.create(usuario=User.objects.get(username='cliente'), estado='PAGADO')
+        ItemPedido.objects.create(pedido=pedido, producto=self.poco_vendido, cantidad=10, precio_unitario=100)
+        avisar_cambio_disponibilidad([self.poco_vendido.id], cambio_en_stock=True)
+        with self.assertNumQueries(0):
+            textos = [s['texto'] for s in self.sugerir("lav")]
+        self.assertEqual(textos, ["Lavanda", "Vela Lavándula", "Sahumerio Lavanda"])
+
+        call_command('vencer_ventas', stdout=io.StringIO())
+        textos = [s['texto'] for s in self.sugerir("lav")]
+        self.assertEqual(textos, ["Lavanda", "Sahumerio Lavanda", "Vela Lavándula"])
+
+
+class CatalogoFacetadoTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('products:catalogo-facetado')
+        self.velas = Categoria.objects.create(nombre="Velas")
+        self.jabones = Categoria.objects.create(nombre="Jabones")
+        datos = [
+            ("Vela Rosa", self.velas, "Rosa", 800, False, 5),
+            ("Vela Mirra", self.velas, "Mirra", 3000, True, 0),
+            ("Jabón Rosa", self.jabones, "Rosa", 1200, False, 2),
+            ("Jabón Lavanda", self.jabones, "Lavanda", 6000, True, 1),
+        ]
+        self.productos = [
+            Producto.objects.create(
+                nombre=nombre, categoria=categoria, aroma=aroma, precio=precio,
+                en_oferta=oferta, precio_oferta=precio - 100 if oferta else None,
+                stock=stock, descripcion="-",
+            )
+            for nombre, categoria, aroma, precio, oferta, stock in datos
+        ]
+
+    def test_conteos_sin_filtros(self):
+        data = self.client.get(self.url).data
+        self.assertEqual(data['count'], 4)
+        self.assertEqual([p['nombre'] for p in data['results']], ["Jabón Lavanda", "Jabón Rosa", "Vela Mirra", "Vela Rosa"])
+        self.assertEqual(data['facetas']['aromas'][0], {'valor': "Rosa", 'cantidad': 2})
+        self.assertEqual({b['banda']: b['cantidad'] for b in data['facetas']['precios']}, {'0-1000': 1, '1000-2500': 1, '2500-5000': 1, '5000+': 1})
+        self.assertEqual(data['facetas']['en_oferta'], 2)
+        self.assertEqual(data['facetas']['en_stock'], 3)
+
+    def test_filtros_y_conteos_de_las_otras_facetas(self):
+        data = self.client.get(self.url, {'categoria': self.velas.id, 'en_stock': 'true'}).data
+        self.assertEqual([p['nombre'] for p in data['results']], ["Vela Rosa"])
+        # La faceta categoría ignora su propio filtro: muestra cuántos hay en Jabones con stock
+        categorias = {c['nombre']: c['cantidad'] for c in data['facetas']['categorias']}
+        self.assertEqual(categorias, {"Velas": 1, "Jabones": 2})
+        self.assertEqual(data['facetas']['en_stock'], 1)
+        self.assertEqual(data['facetas']['en_oferta'], 0)
+
+        data = self.client.get(self.url, {'aroma': ["Rosa", "Lavanda"], 'precio': '5000+'}).data
+        self.assertEqual([p['nombre'] for p in data['results']], ["Jabón Lavanda"])
+
+    def test_paginacion_y_errores(self):
+        data = self.client.get(self.url, {'offset': 1, 'page_size': 2}).data
+        self.assertEqual([p['nombre'] for p in data['results']], ["Jabón Rosa", "Vela Mirra"])
+        self.assertEqual(self.client.get(self.url, {'precio': 'regalado'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_actualizacion_incremental(self):
+        self.client.get(self.url)
+        vela_rosa = self.productos[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            vela_rosa.stock = 0
+            vela_rosa.save()
+        self.assertEqual(self.client.get(self.url).data['facetas']['en_stock'], 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            vela_rosa.delete()
+        data = self.client.get(self.url).data
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(data['facetas']['aromas'][0], {'valor': "Lavanda", 'cantidad': 1})
+
+
+class CamposProductoTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('products:lista-productos')
+        usuario = User.objects.create_user(username='cliente', password='clave123')
+        categoria = Categoria.objects.create(nombre="Velas")
+        producto = Producto.objects.create(nombre="Vela Rosa", categoria=categoria, precio=100, stock=2, descripcion="Artesanal")
+        Reseña.objects.create(producto=producto, usuario=usuario, puntuacion=4, comentario="Linda", moderado=True)
+
+    def test_lista_liviana_por_defecto(self):
+        producto = self.client.get(self.url).data[0]
+        self.assertNotIn('descripcion', producto)
+        self.assertNotIn('reseñas', producto)
+        self.assertEqual(producto['promedio_estrellas'], 4)
+        self.assertEqual(producto['categoria_nombre'], "Velas")
+
+    def test_expand(self):
+        producto = self.client.get(self.url, {'expand': 'descripcion,reseñas'}).data[0]
+        self.assertEqual(producto['descripcion'], "Artesanal")
+        self.assertEqual(len(producto['reseñas']), 1)
+
+    def test_fields_recorta_respuesta_y_consulta(self):
+        with self.assertNumQueries(1) as contexto:
+            response = self.client.get(self.url, {'fields': 'nombre,precio_efectivo'})
+        self.assertEqual(response.data, [{'id': response.data[0]['id'], 'nombre': "Vela Rosa", 'precio_efectivo': '100.00'}])
+        sql = contexto.captured_queries[0]['sql']
+        self.assertNotIn('descripcion', sql)
+        self.assertNotIn('JOIN', sql)
+
+    def test_campo_invalido(self):
+        response = self.client.get(self.url, {'fields': 'nombre,password'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReseñasProductoTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.producto = Producto.objects.create(nombre="Sahumerio Copal", precio=100, stock=2, descripcion="-")
+        self.url = reverse('products:reseñas-producto', args=[self.producto.id])
+        for i in range(12):
+            usuario = User.objects.create_user(username=f'cliente{i}', password='clave123')
+            Reseña.objects.create(producto=self.producto, usuario=usuario, puntuacion=i % 5 + 1, comentario=f"Reseña {i}", moderado=(i != 11))
+
+    def test_paginas_por_fecha(self):
+        response = self.client.get(self.url, {'page_size': 5})
+        comentarios = [r['comentario'] for r in response.data['results']]
+        self.assertEqual(comentarios, [f"Reseña {i}" for i in range(10, 5, -1)])
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            comentarios += [r['comentario'] for r in response.data['results']]
+        self.assertEqual(comentarios, [f"Reseña {i}" for i in range(10, -1, -1)])
+
+    def test_producto_inexistente(self):
+        url = reverse('products:reseñas-producto', args=[self.producto.id + 100])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_producto_trae_solo_las_recientes_y_los_totales(self):
+        producto = self.client.get(reverse('products:lista-productos'), {'expand': 'reseñas'}).data[0]
+        self.assertEqual([r['comentario'] for r in producto['reseñas']], ["Reseña 10", "Reseña 9", "Reseña 8"])
+        self.assertEqual(producto['total_reseñas'], 11)
+
+
+class CalificacionesTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.producto = Producto.objects.create(nombre="Sahumerio Benjuí", precio=100, stock=2, descripcion="-")
+        self.usuarios = [User.objects.create_user(username=f'cliente{i}', password='clave123') for i in range(4)]
+
+    def reseña(self, usuario, puntuacion, moderado=False):
+        return Reseña.objects.create(producto=self.producto, usuario=usuario, puntuacion=puntuacion, comentario="-", moderado=moderado)
+
+    def assertTotales(self, suma, cantidad, promedio, histograma):
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.puntuacion_suma, suma)
+        self.assertEqual(self.producto.puntuacion_cantidad, cantidad)
+        self.assertEqual(float(self.producto.puntuacion_promedio), promedio)
+        self.assertEqual([getattr(self.producto, f'estrellas_{e}') for e in range(1, 6)], histograma)
+
+    def test_moderacion_individual(self):
+        pendiente = self.reseña(self.usuarios[0], 4)
+        self.assertTotales(0, 0, 0, [0, 0, 0, 0, 0])
+        pendiente.moderado = True
+        pendiente.save()
+        self.reseña(self.usuarios[1], 5, moderado=True)
+        self.assertTotales(9, 2, 4.5, [0, 0, 0, 1, 1])
+
+        pendiente.puntuacion = 2
+        pendiente.save()
+        self.assertTotales(7, 2, 3.5, [0, 1, 0, 0, 1])
+        pendiente.delete()
+        self.assertTotales(5, 1, 5, [0, 0, 0, 0, 1])
+
+    def test_aprobar_en_lote_suma_solo_pendientes(self):
+        from blog.admin import ReseñaAdmin
+        from django.contrib import admin
+
+        self.reseña(self.usuarios[0], 5, moderado=True)
+        self.reseña(self.usuarios[1], 3)
+        self.reseña(self.usuarios[2], 1)
+        ReseñaAdmin(Reseña, admin.site).aprobar_reseñas(None, Reseña.objects.all())
+        self.assertTotales(9, 3, 3, [1, 0, 1, 0, 1])
+        ReseñaAdmin(Reseña, admin.site).aprobar_reseñas(None, Reseña.objects.all())
+        self.assertTotales(9, 3, 3, [1, 0, 1, 0, 1])
+
+    def test_guardar_producto_no_pisa_los_totales(self):
+        viejo = Producto.objects.get(pk=self.producto.pk)
+        self.reseña(self.usuarios[0], 5, moderado=True)
+        viejo.stock = 1
+        viejo.save()
+        self.assertTotales(5, 1, 5, [0, 0, 0, 0, 1])
+
+    def test_recalcular_calificaciones(self):
+        from django.core.management import call_command
+        from io import StringIO
+
+        self.reseña(self.usuarios[0], 4, moderado=True)
+        self.reseña(self.usuarios[1], 1, moderado=True)
+        Producto.objects.update(puntuacion_suma=0, puntuacion_cantidad=0, puntuacion_promedio=0, estrellas_4=0, estrellas_1=0)
+        call_command('recalcular_calificaciones', lote=1, stdout=StringIO())
+        self.assertTotales(5, 2, 2.5, [1, 0, 0, 1, 0])
+
+    def test_orden_y_filtro_por_valoracion(self):
+        otro = Producto.objects.create(nombre="Sahumerio Copal", precio=100, stock=2, descripcion="-")
+        Reseña.objects.create(producto=otro, usuario=self.usuarios[0], puntuacion=5, comentario="-", moderado=True)
+        self.reseña(self.usuarios[1], 3, moderado=True)
+        url = reverse('products:lista-productos')
+        nombres = [p['nombre'] for p in self.client.get(url, {'orden': 'valoracion'}).data]
+        self.assertEqual(nombres, ["Sahumerio Copal", "Sahumerio Benjuí"])
+        nombres = [p['nombre'] for p in self.client.get(url, {'puntuacion_min': 4}).data]
+        self.assertEqual(nombres, ["Sahumerio Copal"])
+
+
+class SnapshotsCatalogoTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        raiz = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, raiz, ignore_errors=True)
+        ajustes = override_settings(CATALOGO_SNAPSHOTS_ROOT=raiz, CATALOGO_SNAPSHOTS_AUTOPUBLICAR=False)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+        categoria = Categoria.objects.create(nombre="Velas")
+        self.producto = Producto.objects.create(nombre="Vela Canela", categoria=categoria, precio=100, stock=3, descripcion="-")
+        Producto.objects.create(nombre="Vela Coco", categoria=categoria, precio=80, precio_oferta=60, en_oferta=True, stock=0, descripcion="-")
+
+    def test_snapshot_igual_a_la_api(self):
+        puntero = publicar_snapshots()
+        for nombre, ruta in (('lista', 'lista-productos'), ('ofertas', 'lista-ofertas'),
+                             ('categorias', 'lista_categorias'), ('destacados', 'productos-destacados')):
+            response = self.client.get(puntero['archivos'][nombre])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(json.loads(b''.join(response.streaming_content)), self.client.get(reverse(f'products:{ruta}')).json())
+
+    def test_variante_gzip(self):
+        url = publicar_snapshots()['archivos']['lista']
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        cuerpo = json.loads(gzip.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(len(cuerpo), 2)
+
+    @skipUnless(snapshots.brotli, "brotli no está instalado")
+    def test_variante_brotli(self):
+        url = publicar_snapshots()['archivos']['lista']
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        cuerpo = json.loads(snapshots.brotli.decompress(b''.join(response.streaming_content)))
+        self.assertEqual(len(cuerpo), 2)
+
+    def test_puntero_y_republicacion(self):
+        self.assertEqual(self.client.get(reverse('products:snapshot-catalogo')).status_code, status.HTTP_404_NOT_FOUND)
+        version = publicar_snapshots()['version']
+        self.assertEqual(self.client.get(reverse('products:snapshot-catalogo')).json()['version'], version)
+        # Mismo contenido, misma versión
+        self.assertEqual(publicar_snapshots()['version'], version)
+
+        with self.settings(CATALOGO_SNAPSHOTS_AUTOPUBLICAR=True), self.captureOnCommitCallbacks(execute=True):
+            self.producto.precio = 120
+            self.producto.save()
+        # La request solo lo marca pendiente; publica el comando cuando el catálogo se calma
+        self.assertEqual(self.client.get(reverse('products:snapshot-catalogo')).json()['version'], version)
+        self.assertIsNone(publicar_si_pendiente(calma=60, maximo=60))
+        self.assertIsNotNone(publicar_si_pendiente(calma=0))
+        self.assertIsNone(publicar_si_pendiente(calma=0))  # ya no queda nada pendiente
+        puntero = self.client.get(reverse('products:snapshot-catalogo')).json()
+        self.assertNotEqual(puntero['version'], version)
+        lista = json.loads(b''.join(self.client.get(puntero['archivos']['lista']).streaming_content))
+        self.assertIn('120.00', [p['precio'] for p in lista])
+
+
+    def test_compra_no_publica_en_la_request(self):
+        with self.settings(CATALOGO_SNAPSHOTS_AUTOPUBLICAR=True), \
+                mock.patch('products.snapshots.publicar_snapshots') as publicar, \
+                self.captureOnCommitCallbacks(execute=True):
+            ReservaService.reservar(Pedido.objects.create(usuario=User.objects.create_user('c')), [(self.producto, 3, 100)])
+        publicar.assert_not_called()
+        self.assertIsNotNone(cache.get('snapshots:pendiente'))
+
+    def test_otra_replica_copia_la_version_desde_la_cache(self):
+        url = publicar_snapshots()['archivos']['lista']
+        otra = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, otra, ignore_errors=True)
+        with self.settings(CATALOGO_SNAPSHOTS_ROOT=otra):
+            # Réplica con el disco vacío: lee el puntero de la caché compartida
+            self.assertEqual(APIClient().get(reverse('products:snapshot-catalogo')).json()['archivos']['lista'], url)
+            response = APIClient().get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(json.loads(b''.join(response.streaming_content))), 2)
+
+
+class LoteProductosTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nombre="Aceites")
+        self.productos = [
+            Producto.objects.create(nombre=f"Aceite {i}", categoria=categoria, precio=100 + i, stock=i, descripcion="-")
+            for i in range(4)
+        ]
+        self.productos[1].en_oferta, self.productos[1].precio_oferta = True, 50
+        self.productos[1].save()
+        self.url = reverse('products:lote-productos')
+
+    def test_orden_pedido_y_precio_efectivo(self):
+        ids = [self.productos[2].id, self.productos[1].id, 9999]
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {'ids': ','.join(map(str, ids))})
+        self.assertEqual([p['id'] for p in response.json()], ids[:2])
+        self.assertEqual(response.json()[1]['precio_efectivo'], '50.00')
+
+    def test_cache_por_producto(self):
+        primero, segundo = self.productos[0].id, self.productos[3].id
+        self.client.get(self.url, {'ids': str(primero)})
+        # Solo se consulta el que no estaba cacheado
+        with self.assertNumQueries(1):
+            self.client.get(self.url, {'ids': f'{primero},{segundo}'})
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'ids': f'{segundo},{primero}'})
+        self.assertEqual([p['id'] for p in response.json()], [segundo, primero])
+
+        # Un cambio en el catálogo deja afuera lo cacheado
+        with self.captureOnCommitCallbacks(execute=True):
+            self.productos[0].stock = 0
+            self.productos[0].save()
+        response = self.client.get(self.url, {'ids': str(primero)})
+        self.assertFalse(response.json()[0]['hay_stock'])
+
+    def test_ids_invalidos_o_demasiados(self):
+        for ids in ('', 'a,b', ','.join(str(i) for i in range(1, 60))):
+            self.assertEqual(self.client.get(self.url, {'ids': ids}).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RankingVentasTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user(username='comprador', password='clave123')
+        self.productos = [
+            Producto.objects.create(nombre=f"Sahumerio {i}", precio=100, stock=10, descripcion="-")
+            for i in range(4)
+        ]
+
+    def vender(self, cantidades, dia=None):
+        pedido = Pedido.objects.create(usuario=self.usuario, estado='PAGADO')
+        for producto, cantidad in cantidades:
+            ItemPedido.objects.create(pedido=pedido, producto=producto, cantidad=cantidad, precio_unitario=100)
+        RankingService.registrar_venta(pedido, dia=dia)
+
+    def ranking(self, producto):
+        fila = RankingVentas.objects.get(producto=producto)
+        return fila.ventas_7, fila.ventas_30, fila.ventas_90
+
+    def test_mas_vendidos_por_ventana(self):
+        hoy = timezone.localdate()
+        a, b, c, _ = self.productos
+        self.vender([(a, 1), (b, 2)])
+        self.vender([(a, 3)])
+        self.vender([(c, 9)], dia=hoy - datetime.timedelta(days=20))
+        RankingService.vencer(hoy)
+
+        url = reverse('products:mas-vendidos')
+        self.assertEqual([p['id'] for p in self.client.get(url, {'ventana': 7}).json()], [a.id, b.id])
+        self.assertEqual([p['id'] for p in self.client.get(url, {'ventana': 30}).json()], [c.id, a.id, b.id])
+        self.assertEqual(self.client.get(url, {'ventana': 15}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_vencer_descuenta_una_sola_vez(self):
+        hoy = timezone.localdate()
+        producto = self.productos[0]
+        self.vender([(producto, 2)], dia=hoy - datetime.timedelta(days=10))
+        self.vender([(producto, 1)])
+        self.assertEqual(self.ranking(producto), (3, 3, 3))
+
+        RankingService.vencer(hoy)
+        RankingService.vencer(hoy)
+        self.assertEqual(self.ranking(producto), (1, 3, 3))
+        RankingService.vencer(hoy + datetime.timedelta(days=90))
+        self.assertEqual(self.ranking(producto), (0, 0, 0))
+        self.assertFalse(VentaDiaria.objects.exists())
+
+    def test_destacados_prioriza_los_mas_vendidos(self):
+        viejo = self.productos[0]
+        self.vender([(viejo, 5)])
+        ids = [p['id'] for p in self.client.get(reverse('products:productos-destacados')).json()]
+        self.assertEqual(ids, [viejo.id, self.productos[3].id, self.productos[2].id])
+
+
+class RelacionadosTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.usuario = User.objects.create_user(username='comprador', password='clave123')
+        self.productos = [
+            Producto.objects.create(nombre=f"Vela {i}", precio=100, stock=10, descripcion="-")
+            for i in range(4)
+        ]
+
+    def vender(self, *indices, estado='PAGADO'):
+        pedido = Pedido.objects.create(usuario=self.usuario, estado=estado)
+        for indice in indices:
+            ItemPedido.objects.create(pedido=pedido, producto=self.productos[indice], cantidad=1, precio_unitario=100)
+
+    def test_coocurrencias_vectorizadas(self):
+        # Pedido 1: productos 10, 20, 30 (el 20 repetido); pedido 2: 10, 20
+        origen, destino, veces, posicion = calcular_coocurrencias([1, 1, 1, 1, 2, 2], [10, 20, 20, 30, 10, 20], k=1)
+        self.assertEqual(
+            list(zip(origen.tolist(), destino.tolist(), veces.tolist(), posicion.tolist())),
+            [(10, 20, 2, 0), (20, 10, 2, 0), (30, 10, 1, 0)],
+        )
+
+    def test_relacionados_desde_pedidos_pagados(self):
+        self.vender(0, 1, 2)
+        self.vender(0, 2)
+        self.vender(0, 3, estado='PENDIENTE')
+        reconstruir_relacionados()
+
+        url = reverse('products:productos-relacionados', args=[self.productos[0].id])
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual([p['id'] for p in response.json()], [self.productos[2].id, self.productos[1].id])
+        self.assertEqual(self.client.get(reverse('products:productos-relacionados', args=[9999])).status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ConServidorMPFalso:
+    """Mixin de tests: levanta el servidor falso y apunta el SDK a él."""
+
+    def setUp(self):
+        super().setUp()
+        self.mp = ServidorMPFalso()
+        self.addCleanup(self.mp.cerrar)
+        cliente_mp.reiniciar()
+        ajustes = override_settings(MP_ACCESS_TOKEN='TEST-TOKEN', MP_API_BASE_URL=self.mp.url, MP_TIMEOUT=2)
+        ajustes.enable()
+        self.addCleanup(ajustes.disable)
+
+
+class CotizarCarritoTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.normal = Producto.objects.create(nombre="Vela Canela", precio=200, stock=5, descripcion="-")
+        self.oferta = Producto.objects.create(
+            nombre="Vela Mirra", precio=300, precio_oferta=250, en_oferta=True, stock=5, descripcion="-",
+        )
+        self.url = reverse('products:cotizar-carrito')
+        self.carrito = [
+            {'producto_id': self.oferta.id, 'cantidad': 2},
+            {'producto_id': self.normal.id, 'cantidad': 1},
+            {'producto_id': self.oferta.id, 'cantidad': 1},
+        ]
+
+    def test_mismo_total_que_la_compra(self):
+        response = self.client.post(self.url, {'items': self.carrito}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        datos = response.json()
+        self.assertEqual(datos['total'], '950.00')
+        self.assertEqual(
+            [(i['producto_id'], i['cantidad'], i['precio_unitario'], i['en_oferta']) for i in datos['items']],
+            [(self.oferta.id, 3, '250.00', True), (self.normal.id, 1, '200.00', False)],
+        )
+        _, total = CompraService.armar_lineas(self.carrito)
+        self.assertEqual(str(total), datos['total'])
+        self.assertFalse(Pedido.objects.exists())
+
+    def test_sale_de_la_cache_sin_locks(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.client.post(self.url, {'items': self.carrito}, format='json')
+        self.assertEqual(len(consultas), 1)
+        self.assertNotIn('FOR UPDATE', consultas[0]['sql'])
+        with self.assertNumQueries(0):
+            self.client.post(self.url, {'items': self.carrito}, format='json')
+
+        # Un cambio de precio se ve en la próxima cotización
+        with self.captureOnCommitCallbacks(execute=True):
+            self.normal.precio = 180
+            self.normal.save()
+        response = self.client.post(self.url, {'items': self.carrito}, format='json')
+        self.assertEqual(response.json()['total'], '930.00')
+
+    def test_errores_del_carrito(self):
+        sin_stock = self.client.post(self.url, {'items': [{'producto_id': self.normal.id, 'cantidad': 6}]}, format='json')
+        self.assertEqual(sin_stock.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("Stock insuficiente", sin_stock.json()['error'])
+        inexistente = self.client.post(self.url, {'items': [{'producto_id': 9999}]}, format='json')
+        self.assertEqual(inexistente.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.post(self.url, {'items': []}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ClienteMPTests(ConServidorMPFalso, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.mp.respuestas[('GET', '/v1/payments/')] = (200, {"id": 1, "status": "approved"})
+        sin_espera = mock.patch.object(mercadopago_cliente, 'ESPERA_REINTENTO', 0)
+        sin_espera.start()
+        self.addCleanup(sin_espera.stop)
+
+    def consultar(self):
+        return sdk_mercadopago().payment().get(1)
+
+    def test_reutiliza_la_conexion(self):
+        for _ in range(3):
+            self.assertEqual(self.consultar()["status"], 200)
+        self.assertEqual(self.mp.conexiones, 1)
+        resumen = cliente_mp.metricas.resumen()
+        self.assertEqual(resumen['llamadas'], {'GET 200': 3})
+        self.assertEqual(resumen['latencia_ms']['muestras'], 3)
+
+    def test_get_se_reintenta_y_post_no(self):
+        respuestas = iter([(503, {}), (200, {"id": 1, "status": "approved"})])
+        self.mp.respuestas[('GET', '/v1/payments/')] = lambda ruta, cuerpo: next(respuestas)
+        self.assertEqual(self.consultar()["response"]["status"], "approved")
+        self.assertEqual(cliente_mp.metricas.resumen()['reintentos'], 1)
+
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (503, {"message": "unavailable"})
+        self.assertEqual(sdk_mercadopago().preference().create({})["status"], 503)
+        self.assertEqual(len([r for r in self.mp.recibidas if r[0] == 'POST']), 1)
+
+    @mock.patch.object(mercadopago_cliente, 'FALLOS_PARA_ABRIR', 2)
+    def test_circuito_abierto_falla_sin_llamar_a_mp(self):
+        self.mp.respuestas[('GET', '/v1/payments/')] = (500, {"message": "internal error"})
+        # El segundo intento abre el circuito y el tercero ya no sale
+        with self.assertRaises(MPNoDisponible):
+            self.consultar()
+        self.assertEqual(cliente_mp.circuito.estado, 'ABIERTO')
+        self.assertEqual(len(self.mp.recibidas), 2)
+
+        with self.assertRaises(MPNoDisponible):
+            self.consultar()
+        self.assertEqual(len(self.mp.recibidas), 2)
+
+        # Pasado el enfriamiento, una llamada de prueba que sale bien lo cierra
+        cliente_mp.circuito.abierto_hasta = 0
+        self.mp.respuestas[('GET', '/v1/payments/')] = (200, {"id": 1, "status": "approved"})
+        self.assertEqual(self.consultar()["status"], 200)
+        self.assertEqual(cliente_mp.circuito.estado, 'CERRADO')
+
+    def test_metricas_solo_para_staff(self):
+        self.consultar()
+        url = reverse('products:metricas-mp')
+        self.client.force_authenticate(User.objects.create_user(username='cliente', password='x'))
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(User.objects.create_user(username='admin', password='x', is_staff=True))
+        respuesta = self.client.get(url)
+        self.assertEqual(respuesta.data['circuito'], 'CERRADO')
+        self.assertEqual(respuesta.data['llamadas'], {'GET 200': 1})
+
+
+class CompraServiceTests(ConServidorMPFalso, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user(username='comprador', password='clave123')
+        self.productos = [
+            Producto.objects.create(nombre=f"Difusor {i}", precio=100 + i, stock=5, descripcion="-")
+            for i in range(6)
+        ]
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (
+            201, {"id": "pref-1", "init_point": "https://mp.test/checkout"},
+        )
+
+    def carrito(self, *indices, cantidad=1):
+        return [{'producto_id': self.productos[i].id, 'cantidad': cantidad} for i in indices]
+
+    def test_consultas_constantes(self):
+        with CaptureQueriesContext(connection) as chico:
+            CompraService.ejecutar_pago_mercadopago(self.usuario, self.carrito(0))
+        with self.assertNumQueries(len(chico.captured_queries)):
+            pedido, _ = CompraService.ejecutar_pago_mercadopago(self.usuario, self.carrito(5, 1, 3, 2, 4))
+        self.assertEqual(pedido.items.count(), 5)
+        self.assertEqual(pedido.total_pagado, 5 * 100 + 15)
+
+    def test_bloqueo_ordenado_y_lineas_repetidas(self):
+        carrito = self.carrito(3, 1) + self.carrito(3, cantidad=2)
+        with CaptureQueriesContext(connection) as consultas:
+            pedido, _ = CompraService.ejecutar_pago_mercadopago(self.usuario, carrito)
+        select = next(q['sql'] for q in consultas.captured_queries if 'products_producto' in q['sql'])
+        self.assertIn('ORDER BY', select)
+        self.assertEqual(
+            list(pedido.items.order_by('id').values_list('producto_id', 'cantidad')),
+            [(self.productos[3].id, 3), (self.productos[1].id, 1)],
+        )
+
+    def test_stock_insuficiente_no_crea_pedido(self):
+        with self.assertRaisesMessage(ValueError, "Stock insuficiente"):
+            CompraService.ejecutar_pago_mercadopago(self.usuario, self.carrito(0, 1, cantidad=6))
+        self.assertFalse(Pedido.objects.exists())
+        self.assertEqual(self.mp.recibidas, [])
+
+    def test_preferencia_despues_del_commit(self):
+        bloques = []
+        original = ClienteHttpMP.request
+
+        def registrar(cliente, *args, **kwargs):
+            bloques.append(len(connection.atomic_blocks))
+            return original(cliente, *args, **kwargs)
+
+        fuera = len(connection.atomic_blocks)
+        with mock.patch.object(ClienteHttpMP, 'request', autospec=True, side_effect=registrar):
+            pedido, respuesta = CompraService.ejecutar_pago_mercadopago(self.usuario, self.carrito(0, 2))
+
+        # Ninguna transacción propia abierta mientras se habla con MP
+        self.assertEqual(bloques, [fuera])
+        metodo, ruta, cuerpo = self.mp.recibidas[0]
+        self.assertEqual((metodo, cuerpo['external_reference']), ('POST', str(pedido.id)))
+        self.assertEqual([i['title'] for i in cuerpo['items']], ["Difusor 0", "Difusor 2"])
+        # El link de pago vence junto con la reserva
+        vence = pedido.reservas.first().vence
+        self.assertTrue(cuerpo['expires'])
+        self.assertEqual(datetime.datetime.fromisoformat(cuerpo['expiration_date_to']), vence.replace(microsecond=vence.microsecond // 1000 * 1000))
+        self.assertEqual(cuerpo['date_of_expiration'], cuerpo['expiration_date_to'])
+        pedido.refresh_from_db()
+        self.assertEqual((pedido.preferencia_id, pedido.url_pago), ("pref-1", respuesta['init_point']))
+        self.assertEqual(pedido.solicitud_preferencia.estado, 'ENVIADA')
+
+    def test_timeout_de_mp_cancela_el_pedido(self):
+        self.mp.demora = 0.5
+        with self.settings(MP_TIMEOUT=0.1), self.assertRaisesMessage(ValueError, "Sin respuesta de Mercado Pago"):
+            CompraService.ejecutar_pago_mercadopago(self.usuario, self.carrito(0))
+        pedido = Pedido.objects.get()
+        self.assertEqual(pedido.estado, 'CANCELADO')
+        self.assertEqual(pedido.solicitud_preferencia.estado, 'FALLIDA')
+
+    def test_rechazo_de_mp(self):
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (401, {"message": "invalid access token"})
+        with self.assertRaisesMessage(ValueError, "invalid access token"):
+            CompraService.ejecutar_pago_mercadopago(self.usuario, self.carrito(0))
+        self.assertEqual(Pedido.objects.get().estado, 'CANCELADO')
+
+    def test_reintento_de_solicitudes_pendientes(self):
+        pedido = CompraService.crear_pedido(self.usuario, self.carrito(1))
+        hace_rato = timezone.now() - datetime.timedelta(minutes=5)
+        SolicitudPreferencia.objects.update(creada=hace_rato, actualizada=hace_rato)
+        call_command('reintentar_preferencias', stdout=io.StringIO())
+        pedido.refresh_from_db()
+        self.assertEqual(pedido.url_pago, "https://mp.test/checkout")
+
+    def test_reintento_salta_pedidos_no_pendientes_y_solicitudes_tomadas(self):
+        cancelado = CompraService.crear_pedido(self.usuario, self.carrito(1))
+        tomado = CompraService.crear_pedido(self.usuario, self.carrito(1))
+        hace_rato = timezone.now() - datetime.timedelta(minutes=5)
+        SolicitudPreferencia.objects.update(creada=hace_rato, actualizada=hace_rato)
+        Pedido.objects.filter(pk=cancelado.pk).update(estado='CANCELADO')
+        # Otra corrida ya la reclamó hace un momento y la está enviando
+        SolicitudPreferencia.objects.filter(pedido=tomado).update(actualizada=timezone.now())
+        salida = io.StringIO()
+        call_command('reintentar_preferencias', stdout=salida)
+        self.assertEqual(self.mp.recibidas, [])
+        self.assertIn("0 enviadas, 0 fallidas", salida.getvalue())
+        self.assertEqual(
+            set(SolicitudPreferencia.objects.values_list('estado', flat=True)), {'PENDIENTE'},
+        )
+
+
+class IdempotenciaCompraTests(ConServidorMPFalso, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user(username='comprador', password='clave123')
+        self.client.force_authenticate(self.usuario)
+        self.producto = Producto.objects.create(nombre="Difusor Bambú", precio=100, stock=10, descripcion="-")
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (201, {"id": "pref-1", "init_point": "https://mp.test/checkout"})
+        self.url = reverse('products:realizar_compra_carrito')
+        self.items = {'items': [{'producto_id': self.producto.id, 'cantidad': 2}]}
+
+    def comprar(self, clave='clave-1', items=None):
+        return self.client.post(self.url, items or self.items, format='json', HTTP_IDEMPOTENCY_KEY=clave)
+
+    def test_reintento_devuelve_la_misma_respuesta(self):
+        primera = self.comprar()
+        self.assertEqual(primera.status_code, status.HTTP_201_CREATED)
+        with self.assertNumQueries(1):
+            repetida = self.comprar()
+        self.assertEqual((repetida.status_code, repetida.content), (primera.status_code, primera.content))
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.assertEqual(CompraLog.objects.count(), 1)
+        self.assertEqual(len(self.mp.recibidas), 1)
+
+        # Otra clave es otra compra
+        self.assertEqual(self.comprar('clave-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Pedido.objects.count(), 2)
+
+    def test_misma_clave_con_otro_carrito(self):
+        self.comprar()
+        otro = {'items': [{'producto_id': self.producto.id, 'cantidad': 1}]}
+        self.assertEqual(self.comprar(items=otro).status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_duplicado_concurrente_recibe_409(self):
+        duplicados = []
+        original = CompraService.ejecutar_pago_mercadopago
+
+        def con_reintento(*args, **kwargs):
+            # El cliente reintenta mientras la primera request sigue en curso
+            duplicados.append(self.comprar())
+            return original(*args, **kwargs)
+
+        with mock.patch.object(CompraService, 'ejecutar_pago_mercadopago', side_effect=con_reintento):
+            self.assertEqual(self.comprar().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(duplicados[0].status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(Pedido.objects.count(), 1)
+
+    def test_error_antes_de_guardar_permite_reintentar(self):
+        with self.settings(MP_ACCESS_TOKEN=''):
+            self.assertEqual(self.comprar().status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(ClaveIdempotencia.objects.exists())
+        self.assertFalse(Pedido.objects.exists())
+
+        self.assertEqual(self.comprar().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ClaveIdempotencia.objects.get().estado, 'COMPLETA')
+
+    def test_error_de_mp_con_el_pedido_creado_no_duplica(self):
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (500, {"message": "internal error"})
+        primera = self.comprar()
+        self.assertEqual(primera.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        clave = ClaveIdempotencia.objects.get()
+        self.assertEqual((clave.estado, clave.pedido_id), ('COMPLETA', Pedido.objects.get().id))
+
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (201, {"id": "pref-2", "init_point": "https://mp.test/checkout"})
+        repetida = self.comprar()
+        self.assertEqual((repetida.status_code, repetida.content), (primera.status_code, primera.content))
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.assertEqual(len(self.mp.recibidas), 1)
+
+    def test_excepcion_con_el_pedido_creado_no_duplica(self):
+        with mock.patch.object(CompraService, 'enviar_preferencia', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.comprar()
+        # El proceso murió después de guardar el pedido: no se retoma
+        ClaveIdempotencia.objects.update(tomada=timezone.now() - datetime.timedelta(minutes=10))
+        response = self.comprar()
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['pedido_id'], Pedido.objects.get().id)
+
+    def test_clave_abandonada_se_retoma(self):
+        with mock.patch.object(CompraService, 'ejecutar_pago_mercadopago', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.comprar()
+        # El proceso murió sin terminar: la clave quedó EN_CURSO
+        ClaveIdempotencia.objects.update(tomada=timezone.now() - datetime.timedelta(minutes=10))
+        self.assertEqual(self.comprar().status_code, status.HTTP_201_CREATED)
+
+
+class ReservasTests(ConServidorMPFalso, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.usuario = User.objects.create_user(username='comprador', password='clave123')
+        self.producto = Producto.objects.create(nombre="Bombas de baño", precio=100, stock=5, descripcion="-")
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (201, {"id": "pref-1", "init_point": "https://mp.test/checkout"})
+
+    def comprar(self, cantidad):
+        pedido, _ = CompraService.ejecutar_pago_mercadopago(self.usuario, [{'producto_id': self.producto.id, 'cantidad': cantidad}])
+        return pedido
+
+    def assertStock(self, stock, reservado):
+        self.producto.refresh_from_db()
+        self.assertEqual((self.producto.stock, self.producto.reservado), (stock, reservado))
+
+    def test_reserva_limita_la_disponibilidad(self):
+        self.comprar(4)
+        self.assertStock(5, 4)
+        with self.assertRaisesMessage(ValueError, "Disponible: 1"):
+            self.comprar(2)
+        datos = self.client.get(reverse('products:lote-productos'), {'ids': self.producto.id}).json()[0]
+        self.assertEqual((datos['stock'], datos['disponible']), (5, 1))
+
+    def test_cada_reserva_refresca_la_disponibilidad_cacheada(self):
+        url = reverse('products:lote-productos')
+        self.assertEqual(self.client.get(url, {'ids': self.producto.id}).json()[0]['disponible'], 5)
+        self.comprar(2)  # no lo agota
+        self.assertEqual(self.client.get(url, {'ids': self.producto.id}).json()[0]['disponible'], 3)
+        cotizacion = self.client.post(
+            reverse('products:cotizar-carrito'), {'items': [{'producto_id': self.producto.id, 'cantidad': 4}]}, format='json',
+        )
+        self.assertEqual(cotizacion.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_la_reserva_invalida_solo_sus_productos(self):
+        otro = Producto.objects.create(nombre="Sales de baño", precio=80, stock=5, descripcion="-")
+        lista, lote = reverse('products:lista-productos'), reverse('products:lote-productos')
+        etag = self.client.get(lista)['ETag']
+        self.client.get(lote, {'ids': otro.id})
+        version = obtener_version('catalogo')
+
+        self.comprar(2)  # no lo agota: el catálogo sigue en la misma versión
+        self.assertEqual(obtener_version('catalogo'), version)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(lote, {'ids': otro.id}).json()[0]['disponible'], 5)
+        response = self.client.get(lista, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        disponibles = {p['id']: p['disponible'] for p in response.json()}
+        self.assertEqual(disponibles, {self.producto.id: 3, otro.id: 5})
+
+        self.comprar(3)  # lo agota: cambian en_stock, destacados y facetas
+        self.assertNotEqual(obtener_version('catalogo'), version)
+
+    def test_pago_convierte_la_reserva(self):
+        pedido = self.comprar(3)
+        ReservaService.confirmar(pedido)
+        self.assertStock(2, 0)
+        self.assertEqual(list(pedido.reservas.values_list('estado', flat=True)), ['CONFIRMADA'])
+
+    def test_barrido_libera_las_vencidas(self):
+        vencido = self.comprar(2)
+        vigente = self.comprar(1)
+        vencido.reservas.update(vence=timezone.now() - datetime.timedelta(minutes=1))
+        call_command('liberar_reservas', stdout=io.StringIO())
+        self.assertStock(5, 1)
+        self.assertEqual(vencido.reservas.get().estado, 'LIBERADA')
+        self.assertEqual(vigente.reservas.get().estado, 'ACTIVA')
+
+        # Si igual llega el pago, se descuenta el stock y no el reservado
+        ReservaService.confirmar(vencido)
+        self.assertStock(3, 1)
+
+    def test_pago_tardio_sin_stock_no_sobrevende(self):
+        vencido = self.comprar(3)
+        vencido.reservas.update(vence=timezone.now() - datetime.timedelta(minutes=1))
+        call_command('liberar_reservas', stdout=io.StringIO())
+        self.comprar(4)  # otro comprador se lleva lo que se liberó
+        self.assertFalse(ReservaService.confirmar(vencido))
+        self.assertStock(5, 4)
+
+    def test_programador_corre_el_barrido(self):
+        vencido = self.comprar(2)
+        vencido.reservas.update(vence=timezone.now() - datetime.timedelta(minutes=1))
+        salida = io.StringIO()
+        call_command('tareas_periodicas', '--una-vez', stdout=salida, stderr=salida)
+        self.assertStock(5, 0)
+        self.assertIn("1 reservas liberadas", salida.getvalue())
+        self.assertNotIn("Error", salida.getvalue())
+
+    def test_error_de_mp_libera_la_reserva(self):
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (500, {"message": "internal error"})
+        with self.assertRaises(ValueError):
+            self.comprar(5)
+        self.assertStock(5, 0)
+
+
+class WebhookPagoTests(ConServidorMPFalso, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user(username='comprador', password='clave123', email='c@test.com')
+        self.producto = Producto.objects.create(nombre="Incienso Sándalo", precio=100, stock=10, descripcion="-")
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (201, {"id": "pref-1", "init_point": "https://mp.test/checkout"})
+        self.pedido, _ = CompraService.ejecutar_pago_mercadopago(self.usuario, [{'producto_id': self.producto.id, 'cantidad': 3}])
+        self.mp.respuestas[('GET', '/v1/payments/')] = lambda ruta, cuerpo: (200, {
+            "id": int(ruta.rsplit('/', 1)[1]), "status": "approved", "external_reference": str(self.pedido.id),
+        })
+        self.url = reverse('products:webhook_mp')
+
+    def notificar(self, payment_id, procesar=True):
+        respuesta = self.client.post(self.url, {"type": "payment", "data": {"id": str(payment_id)}}, format='json')
+        if procesar:
+            cola.procesar_cola(hilos=1, hasta_vaciar=True)
+        return respuesta
+
+    def consultas_a_mp(self):
+        return [r for r in self.mp.recibidas if r[0] == 'GET']
+
+    def test_notificacion_repetida_se_descarta(self):
+        self.assertEqual(self.notificar(555).status_code, status.HTTP_200_OK)
+        self.notificar(555)
+        self.producto.refresh_from_db()
+        self.assertEqual((self.producto.stock, self.producto.reservado), (7, 0))
+        self.assertEqual(Pedido.objects.get(id=self.pedido.id).estado, 'PAGADO')
+        # La segunda ni siquiera consulta a MP
+        self.assertEqual(len(self.consultas_a_mp()), 1)
+        self.assertEqual(RankingVentas.objects.get(producto=self.producto).ventas_7, 3)
+
+    @override_settings(EMAIL_HOST_USER='admin@aromazen.test')
+    def test_dos_pagos_del_mismo_pedido_descuentan_una_vez(self):
+        CompraLog.objects.create(
+            usuario=self.usuario, pedido=self.pedido, detalle_log="Iniciado", monto=300, referencia_pago=str(self.pedido.id),
+        )
+        self.notificar(555)
+        self.notificar(556)
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 7)
+        self.assertEqual(PagoProcesado.objects.count(), 2)
+        # El segundo cobro no se pierde: el pedido queda para reembolsar y se avisa
+        self.assertEqual(Pedido.objects.get(id=self.pedido.id).estado, 'A_REVISAR')
+        log = CompraLog.objects.get()
+        self.assertEqual(log.referencia_pago, '555')
+        self.assertIn("pago duplicado 556", log.detalle_log)
+        self.assertIn(['admin@aromazen.test'], list(EmailOutbox.objects.values_list('destinatarios', flat=True)))
+
+    def test_pago_no_aprobado_no_se_registra(self):
+        self.mp.respuestas[('GET', '/v1/payments/')] = (200, {"id": 555, "status": "pending", "external_reference": str(self.pedido.id)})
+        self.notificar(555)
+        self.assertFalse(PagoProcesado.objects.exists())
+        self.assertEqual(Pedido.objects.get(id=self.pedido.id).estado, 'PENDIENTE')
+
+    @override_settings(EMAIL_HOST_USER='admin@aromazen.test')
+    def test_pago_sin_stock_queda_a_revisar(self):
+        self.pedido.reservas.update(vence=timezone.now() - datetime.timedelta(minutes=1))
+        call_command('liberar_reservas', stdout=io.StringIO())
+        CompraService.ejecutar_pago_mercadopago(self.usuario, [{'producto_id': self.producto.id, 'cantidad': 8}])
+        self.notificar(555)
+        self.producto.refresh_from_db()
+        self.assertEqual((self.producto.stock, self.producto.reservado), (10, 8))
+        self.assertEqual(Pedido.objects.get(id=self.pedido.id).estado, 'A_REVISAR')
+        self.assertTrue(PagoProcesado.objects.filter(pago_id='555').exists())
+        self.assertFalse(RankingVentas.objects.filter(producto=self.producto, ventas_7__gt=0).exists())
+        # Aviso al administrador, no la confirmación al cliente
+        self.assertEqual(list(EmailOutbox.objects.values_list('destinatarios', flat=True)), [['admin@aromazen.test']])
+
+    def test_webhook_solo_encola(self):
+        respuesta = self.notificar(555, procesar=False)
+        self.assertEqual(respuesta.status_code, status.HTTP_200_OK)
+        notificacion = NotificacionMP.objects.get()
+        self.assertEqual((notificacion.tipo, notificacion.recurso_id, notificacion.estado), ('payment', '555', 'PENDIENTE'))
+        self.assertEqual(self.consultas_a_mp(), [])
+        self.assertEqual(Pedido.objects.get(id=self.pedido.id).estado, 'PENDIENTE')
+
+        salida = io.StringIO()
+        call_command('procesar_notificaciones', '--una-vez', '--hilos', '1', stdout=salida)
+        self.assertIn("1 procesadas", salida.getvalue())
+        self.assertEqual(NotificacionMP.objects.get().estado, 'HECHA')
+        self.assertEqual(Pedido.objects.get(id=self.pedido.id).estado, 'PAGADO')
+        # El email de confirmación queda en el outbox con el pago, no se manda en el worker
+        correo = EmailOutbox.objects.get()
+        self.assertEqual((correo.destinatarios, correo.estado), (['c@test.com'], 'PENDIENTE'))
+        self.assertEqual(mail.outbox, [])
+
+    def test_mp_caido_se_reintenta_con_backoff(self):
+        self.mp.respuestas[('GET', '/v1/payments/')] = (500, {"message": "internal error"})
+        self.notificar(555)
+        notificacion = NotificacionMP.objects.get()
+        self.assertEqual((notificacion.estado, notificacion.intentos), ('PENDIENTE', 1))
+        self.assertIn('MPNoDisponible', notificacion.error)
+        self.assertGreater(notificacion.disponible_desde, timezone.now())
+        self.assertEqual(Pedido.objects.get(id=self.pedido.id).estado, 'PENDIENTE')
+
+        # Antes del backoff no se vuelve a intentar
+        self.assertEqual(cola.procesar_cola(hilos=1, hasta_vaciar=True)['PENDIENTE'], 0)
+
+        self.mp.respuestas[('GET', '/v1/payments/')] = (200, {"id": 555, "status": "approved", "external_reference": str(self.pedido.id)})
+        NotificacionMP.objects.update(disponible_desde=timezone.now())
+        cola.procesar_cola(hilos=1, hasta_vaciar=True)
+        notificacion.refresh_from_db()
+        self.assertEqual((notificacion.estado, notificacion.intentos), ('HECHA', 2))
+        self.assertEqual(Pedido.objects.get(id=self.pedido.id).estado, 'PAGADO')
+
+    def test_agotados_los_intentos_queda_fallida(self):
+        self.mp.respuestas[('GET', '/v1/payments/')] = (503, {"message": "unavailable"})
+        self.notificar(555, procesar=False)
+        NotificacionMP.objects.update(intentos=cola.MAX_INTENTOS - 1)
+        cola.procesar_cola(hilos=1, hasta_vaciar=True)
+        self.assertEqual(NotificacionMP.objects.get().estado, 'FALLIDA')
+
+    def test_lease_vencido_se_retoma(self):
+        self.notificar(555, procesar=False)
+        [caido] = cola.tomar()
+        self.assertEqual(cola.tomar(), [])  # con el lease vigente nadie más la toma
+
+        NotificacionMP.objects.update(lease_hasta=timezone.now() - datetime.timedelta(seconds=1))
+        [retomada] = cola.tomar()
+        self.assertEqual(retomada.intentos, 2)
+        # El worker que se había colgado ya no puede cerrar el trabajo ajeno
+        cola.ejecutar(caido)
+        self.assertEqual(NotificacionMP.objects.get().estado, 'PROCESANDO')
+        cola.ejecutar(retomada)
+        self.assertEqual(NotificacionMP.objects.get().estado, 'HECHA')
+        self.assertEqual(PagoProcesado.objects.count(), 1)
+
+
+class ConciliacionTests(ConServidorMPFalso, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.usuario = User.objects.create_user(username='comprador', password='clave123')
+        self.producto = Producto.objects.create(nombre="Sahumerio Copal", precio=100, stock=20, descripcion="-")
+        self.mp.respuestas[('POST', '/checkout/preferences')] = (201, {"id": "pref-1", "init_point": "https://mp.test/checkout"})
+        self.pedidos = [
+            CompraService.ejecutar_pago_mercadopago(self.usuario, [{'producto_id': self.producto.id, 'cantidad': 2}])[0]
+            for _ in range(4)
+        ]
+        Pedido.objects.update(fecha_venta=timezone.now() - datetime.timedelta(days=2))
+        # En MP: el 0 pagó, el 1 nunca pagó, el 2 pagó en efectivo (pendiente), el 3 fue rechazado
+        self.pagos = {
+            self.pedidos[0].id: [{"id": 900, "status": "rejected"}, {"id": 901, "status": "approved"}],
+            self.pedidos[2].id: [{"id": 902, "status": "pending"}],
+            self.pedidos[3].id: [{"id": 903, "status": "rejected"}],
+        }
+        self.mp.respuestas[('GET', '/v1/payments/search')] = lambda ruta, cuerpo: (200, {
+            "results": self.pagos.get(int(ruta.split('external_reference=')[1].split('&')[0]), []),
+        })
+        self.mp.respuestas[('GET', '/v1/payments/')] = lambda ruta, cuerpo: (200, {
+            "id": 901, "status": "approved", "external_reference": str(self.pedidos[0].id),
+        })
+
+    def estados(self):
+        return [Pedido.objects.get(id=pedido.id).estado for pedido in self.pedidos]
+
+    def test_aplica_las_transiciones_por_lotes(self):
+        reciente = CompraService.ejecutar_pago_mercadopago(self.usuario, [{'producto_id': self.producto.id, 'cantidad': 1}])[0]
+        salida = io.StringIO()
+        call_command('conciliar_pedidos', '--lote', '2', '--hilos', '4', stdout=salida)
+        self.assertIn("1 pagados (encolados), 2 cancelados, 1 con pago en curso", salida.getvalue())
+
+        # El pago aprobado pasa por la cola, igual que un webhook
+        self.assertEqual(NotificacionMP.objects.get().recurso_id, '901')
+        cola.procesar_cola(hilos=1, hasta_vaciar=True)
+        self.assertEqual(self.estados(), ['PAGADO', 'CANCELADO', 'PENDIENTE', 'CANCELADO'])
+        self.assertEqual(Pedido.objects.get(id=reciente.id).estado, 'PENDIENTE')
+        # A MP solo se le preguntó por los pedidos viejos
+        buscados = [ruta for metodo, ruta, _ in self.mp.recibidas if ruta.startswith('/v1/payments/search')]
+        self.assertEqual(len(buscados), 4)
+
+        self.producto.refresh_from_db()
+        # Stock: 20 - 2 del pagado; reservado: el pendiente (2) y el reciente (1)
+        self.assertEqual((self.producto.stock, self.producto.reservado), (18, 3))
+
+    def test_repetir_no_duplica_la_cola(self):
+        call_command('conciliar_pedidos', stdout=io.StringIO())
+        call_command('conciliar_pedidos', stdout=io.StringIO())
+        self.assertEqual(NotificacionMP.objects.count(), 1)
+
+    def pago_tardio(self, pedido):
+        self.mp.respuestas[('GET', '/v1/payments/')] = (200, {"id": 950, "status": "approved", "external_reference": str(pedido.id)})
+        return PagoService.procesar_pago('950')
+
+    def test_pago_de_un_pedido_cancelado_lo_reactiva(self):
+        CompraLog.objects.create(
+            usuario=self.usuario, pedido=self.pedidos[1], detalle_log="Iniciado", monto=200,
+            referencia_pago=str(self.pedidos[1].id),
+        )
+        call_command('conciliar_pedidos', stdout=io.StringIO())
+        self.assertEqual(self.pago_tardio(self.pedidos[1]).estado, 'PAGADO')
+        log = CompraLog.objects.get()
+        self.assertEqual(log.referencia_pago, '950')
+        self.assertEqual(
+            log.detalle_log,
+            "Iniciado [PAGO SOBRE PEDIDO CANCELADO: REACTIVADO] [PAGO APROBADO] [PAGO APROBADO Y STOCK ACTUALIZADO] [EMAIL ENCOLADO]",
+        )
+        self.assertEqual(Pedido.objects.get(id=self.pedidos[1].id).estado, 'PAGADO')
+        self.producto.refresh_from_db()
+        # Reservado: el 0 (pago encolado, sin procesar) y el 2 (pago en curso)
+        self.assertEqual((self.producto.stock, self.producto.reservado), (18, 4))
+        self.assertTrue(PagoProcesado.objects.filter(pago_id='950').exists())
+
+    def test_pago_de_un_pedido_cancelado_sin_stock_queda_a_revisar(self):
+        call_command('conciliar_pedidos', stdout=io.StringIO())
+        Producto.objects.update(stock=F('reservado'))  # lo liberado ya se vendió
+        self.pago_tardio(self.pedidos[1])
+        self.assertEqual(Pedido.objects.get(id=self.pedidos[1].id).estado, 'A_REVISAR')
+        self.producto.refresh_from_db()
+        self.assertEqual((self.producto.stock, self.producto.reservado), (4, 4))
+        # Queda registrado recién con el pedido marcado: no se pierde en silencio
+        self.assertTrue(PagoProcesado.objects.filter(pago_id='950').exists())
+
+    @mock.patch.object(mercadopago_cliente, 'ESPERA_REINTENTO', 0)
+    def test_mp_caido_no_cambia_nada(self):
+        self.mp.respuestas[('GET', '/v1/payments/search')] = (503, {"message": "unavailable"})
+        salida = io.StringIO()
+        call_command('conciliar_pedidos', stdout=salida)
+        self.assertIn("4 sin respuesta de MP", salida.getvalue())
+        self.assertEqual(self.estados(), ['PENDIENTE'] * 4)
+        self.assertFalse(NotificacionMP.objects.exists())
+
+
+class ConexionContada:
+    """Envuelve el backend de prueba para contar conexiones y fallar a pedido."""
+
+    def __init__(self, fallar_a=(), cortar_en=None, reconectar=True):
+        self.aperturas = 0
+        self.fallar_a = set(fallar_a)
+        # Número de envío en el que el servidor corta la sesión (una vez)
+        self.cortar_en = cortar_en
+        self.reconectar = reconectar
+        self.envios = 0
+
+    def __call__(self, *args, **kwargs):
+        conexion = mail.get_connection(*args, **kwargs)
+        enviar = conexion.send_messages
+
+        def abrir():
+            if self.aperturas and not self.reconectar:
+                raise ConnectionRefusedError("smtp caído")
+            self.aperturas += 1
+
+        def send_messages(mensajes):
+            self.envios += 1
+            if self.envios == self.cortar_en:
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            if self.fallar_a & {d for m in mensajes for d in m.to}:
+                raise ConnectionResetError("smtp cortó")
+            return enviar(mensajes)
+
+        conexion.open, conexion.send_messages = abrir, send_messages
+        return conexion
+
+
+@override_settings(EMAIL_POR_MINUTO=0)
+class EmailOutboxTests(APITestCase):
+    def encolar(self, cantidad, **kwargs):
+        return [correo.encolar_email(f"Mail {i}", "hola", [f"c{i}@test.com"], **kwargs) for i in range(cantidad)]
+
+    def test_un_lote_usa_una_sola_conexion(self):
+        self.encolar(5)
+        conexion = ConexionContada()
+        with mock.patch('products.correo.get_connection', conexion):
+            resultados = correo.enviar_pendientes(lote=3)
+        self.assertEqual(resultados['ENVIADO'], 5)
+        self.assertEqual(conexion.aperturas, 2)  # 5 mails en lotes de 3
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertFalse(EmailOutbox.objects.exclude(estado='ENVIADO').exists())
+        self.assertTrue(all(e.enviado for e in EmailOutbox.objects.all()))
+
+    def test_falla_se_reintenta_y_despues_queda_fallido(self):
+        self.encolar(3)
+        with mock.patch('products.correo.get_connection', ConexionContada(fallar_a=['c1@test.com'])):
+            resultados = correo.enviar_pendientes()
+        self.assertEqual((resultados['ENVIADO'], resultados['REINTENTO']), (2, 1))
+        fallido = EmailOutbox.objects.get(asunto='Mail 1')
+        self.assertEqual((fallido.estado, fallido.intentos), ('PENDIENTE', 1))
+        self.assertIn('ConnectionResetError', fallido.error)
+        self.assertGreater(fallido.disponible_desde, timezone.now())
+        # Antes del backoff no se vuelve a tomar
+        self.assertEqual(correo.enviar_pendientes()['REINTENTO'], 0)
+
+        EmailOutbox.objects.filter(id=fallido.id).update(intentos=correo.MAX_INTENTOS - 1, disponible_desde=timezone.now())
+        with mock.patch('products.correo.get_connection', ConexionContada(fallar_a=['c1@test.com'])):
+            self.assertEqual(correo.enviar_pendientes()['FALLIDO'], 1)
+        self.assertEqual(EmailOutbox.objects.get(id=fallido.id).estado, 'FALLIDO')
+
+    def test_corte_a_mitad_del_lote_reconecta(self):
+        self.encolar(4)
+        conexion = ConexionContada(cortar_en=2)
+        with mock.patch('products.correo.get_connection', conexion):
+            resultados = correo.enviar_pendientes()
+        self.assertEqual(resultados['ENVIADO'], 4)
+        self.assertEqual(conexion.aperturas, 2)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(set(EmailOutbox.objects.values_list('intentos', flat=True)), {0})
+
+    def test_corte_sin_reconexion_devuelve_lo_que_falta(self):
+        self.encolar(4)
+        with mock.patch('products.correo.get_connection', ConexionContada(cortar_en=2, reconectar=False)):
+            resultados = correo.enviar_pendientes()
+        self.assertEqual((resultados['ENVIADO'], resultados['REINTENTO']), (1, 3))
+        self.assertEqual(EmailOutbox.objects.filter(estado='PENDIENTE', intentos=1).count(), 3)
+
+    def test_smtp_caido_devuelve_el_lote(self):
+        self.encolar(2)
+        with mock.patch('products.correo.get_connection', side_effect=OSError("sin red")):
+            resultados = correo.enviar_pendientes()
+        self.assertEqual(resultados['REINTENTO'], 2)
+        self.assertEqual(list(EmailOutbox.objects.values_list('intentos', flat=True)), [1, 1])
+        self.assertEqual(mail.outbox, [])
+
+    def test_respeta_el_limite_por_minuto(self):
+        self.encolar(3)
+        with mock.patch('products.correo.time.sleep') as dormir:
+            correo.enviar_pendientes(por_minuto=30)
+        self.assertEqual(len(dormir.call_args_list), 3)
+        self.assertTrue(all(1.5 < llamada.args[0] <= 2 for llamada in dormir.call_args_list))
+
+    def test_detener_devuelve_lo_que_falta_del_lote(self):
+        self.encolar(3)
+        detener = threading.Event()
+        with mock.patch('products.correo.time.sleep', side_effect=lambda _: detener.set()):
+            resultados = correo.enviar_pendientes(por_minuto=60, detener=detener)
+        self.assertEqual(resultados['ENVIADO'], 1)
+        self.assertEqual(EmailOutbox.objects.filter(estado='PENDIENTE', disponible_desde__lte=timezone.now()).count(), 2)
+
+    @override_settings(EMAIL_HOST_USER='admin@aromazen.test')
+    def test_consulta_encola_los_mails_con_la_consulta(self):
+        datos = {'nombre': 'Ana', 'email': 'ana@test.com', 'asunto': 'Envíos', 'mensaje': '¿Llegan a Rosario?'}
+        response = self.client.post(reverse('products:enviar_consulta'), datos, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(mail.outbox, [])  # la request no toca SMTP
+        self.assertEqual(
+            sorted(d for e in EmailOutbox.objects.all() for d in e.destinatarios), ['admin@aromazen.test', 'ana@test.com'],
+        )
+
+        salida = io.StringIO()
+        call_command('enviar_emails', '--una-vez', stdout=salida)
+        self.assertIn("2 enviados", salida.getvalue())
+        self.assertEqual(len(mail.outbox), 2)
+
+        with mock.patch('products.views.encolar_email', side_effect=[None, RuntimeError("falla")]):
+            with self.assertRaises(RuntimeError):
+                self.client.post(reverse('products:enviar_consulta'), datos, format='json')
+        self.assertEqual(Consulta.objects.count(), 1)  # la consulta se deshizo junto con los mails
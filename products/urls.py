@@ -7,11 +7,21 @@ urlpatterns = [
     path('categorias/', views.lista_categorias, name='lista_categorias'),
     path('destacados/', views.lista_productos_destacados, name='productos-destacados'),
     path('ofertas/', views.lista_ofertas, name='lista-ofertas'),
+    path('mas-vendidos/', views.mas_vendidos, name='mas-vendidos'),
+    path('buscar/', views.buscar_productos, name='buscar-productos'),
+    path('sugerencias/', views.sugerencias_productos, name='sugerencias-productos'),
+    path('facetas/', views.catalogo_facetado, name='catalogo-facetado'),
+    path('lote/', views.lote_productos, name='lote-productos'),
+    path('snapshot/', views.snapshot_catalogo, name='snapshot-catalogo'),
+    path('<int:producto_id>/reseñas/', views.reseñas_producto, name='reseñas-producto'),
+    path('<int:producto_id>/relacionados/', views.productos_relacionados, name='productos-relacionados'),
 
     # --- PROCESO DE COMPRA Y LOGS (Instrucción 2026-01-06) ---
+    path('cotizar/', views.cotizar_carrito, name='cotizar-carrito'),
     path('comprar/', views.realizar_compra_carrito, name='realizar_compra_carrito'),
     path('mis-compras/', views.mis_compras, name='mis-compras'),
     path('webhook/mercadopago/', views.webhook_mercadopago, name='webhook_mp'),
+    path('mp/metricas/', views.metricas_mp, name='metricas-mp'),
 
     # --- CONTACTO ---
     path('consultas/', views.enviar_consulta, name='enviar_consulta'),
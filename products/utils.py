@@ -1,8 +1,8 @@
 # products/utils.py
-from django.core.mail import send_mail
-from django.conf import settings
+from .correo import encolar_email
 
 def enviar_confirmacion_compra(pedido):
+    # Queda en el outbox dentro de la transacción del pago (ver products.correo)
     asunto = f"🧘 ¡Gracias por tu compra en Aroma Zen! (Pedido #{pedido.id})"
     mensaje = f"""
     Hola {pedido.usuario.first_name or pedido.usuario.username},
@@ -18,10 +18,4 @@ def enviar_confirmacion_compra(pedido):
     Te avisaremos cuando esté en camino.
     """
     
-    send_mail(
-        asunto,
-        mensaje,
-        settings.DEFAULT_FROM_EMAIL,
-        [pedido.usuario.email],
-        fail_silently=False,
-    )
\ No newline at end of file
+    encolar_email(asunto, mensaje, [pedido.usuario.email])
\ No newline at end of file
@@ -1,44 +1,78 @@
-import threading
 from django.db import transaction
-import mercadopago
 import datetime
 import traceback
 from django.conf import settings
+from django.utils.cache import patch_cache_control
 from django.views.decorators.csrf import csrf_exempt
-from .utils import enviar_confirmacion_compra
-from django.core.mail import send_mail
 from rest_framework.decorators import api_view, permission_classes, authentication_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny 
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.authentication import TokenAuthentication, SessionAuthentication 
 import os
 
 # MODELOS LOCALES (Solo de productos)
-from .models import CompraLog, ItemPedido, Producto, Pedido, Consulta, Categoria
+from .models import CompraLog, Producto, Pedido, Consulta, Categoria
+from blog.models import Reseña
 
 # SERIALIZERS LOCALES
 from .serializers import (
-    ConsultaSerializer, ProductoSerializer, HistorialSerializer, 
-    CategoriaSerializer
+    ConsultaSerializer, ProductoListaSerializer, HistorialSerializer, 
+    CategoriaSerializer, ReseñaSerializer
 )
 
-from .services import CompraService
+from .cache import cachear_respuesta, respuesta_condicional
+from .cola import encolar
+from .correo import encolar_email
+from .idempotencia import con_idempotencia
+from .mercadopago_cliente import cliente_mp
+from .indices import indice_busqueda, indice_facetas, indice_sugerencias
+from .pagination import CatalogoCursorPagination, ReseñasCursorPagination
+from .services import CatalogoService, CompraService, RankingService
+from .snapshots import leer_puntero
 
 # --- LISTADOS DE TIENDA ---
+# Cabeceras para el catálogo público (navegador y CDN pueden reutilizarlo)
+CACHE_CATALOGO = {'public': True, 'max_age': 60}
 
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO, productos=True)
+@cachear_respuesta('catalogo', productos=True)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def lista_productos(request):
-    serializer = ProductoSerializer(Producto.objects.all(), many=True)
+    try:
+        campos = CatalogoService.campos_producto(request.query_params)
+        productos = CatalogoService.filtrar_catalogo(Producto.objects.all(), request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    productos = CatalogoService.queryset_catalogo(productos, campos)
+
+    # Con ?cursor= o ?page_size= se pagina por cursor; sin ellos se mantiene
+    # la lista completa que ya consume el frontend.
+    if 'cursor' in request.query_params or 'page_size' in request.query_params:
+        paginator = CatalogoCursorPagination()
+        pagina = paginator.paginate_queryset(productos, request)
+        serializer = ProductoListaSerializer(pagina, many=True, campos=campos)
+        return paginator.get_paginated_response(serializer.data)
+
+    serializer = ProductoListaSerializer(productos, many=True, campos=campos)
     return Response(serializer.data)
 
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO, productos=True)
+@cachear_respuesta('catalogo', productos=True)
 @api_view(['GET'])
 @permission_classes([AllowAny]) 
 def lista_ofertas(request):
-    serializer = ProductoSerializer(Producto.objects.filter(en_oferta=True), many=True)
+    try:
+        campos = CatalogoService.campos_producto(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    productos = CatalogoService.queryset_catalogo(CatalogoService.productos_ofertas(), campos)
+    serializer = ProductoListaSerializer(productos, many=True, campos=campos)
     return Response(serializer.data)
 
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO)
+@cachear_respuesta('catalogo')
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def lista_categorias(request):
@@ -46,18 +80,174 @@ def lista_categorias(request):
     serializer = CategoriaSerializer(categorias, many=True)
     return Response(serializer.data)
 
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO, productos=True)
+@cachear_respuesta('catalogo', productos=True)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def lista_productos_destacados(request): # Corregido el nombre (agregada la 'i')
-    productos = Producto.objects.filter(stock__gt=0).order_by('-fecha_creacion')[:3]
-    serializer = ProductoSerializer(productos, many=True)
+    try:
+        campos = CatalogoService.campos_producto(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    productos = CatalogoService.queryset_catalogo(CatalogoService.productos_destacados(), campos)
+    serializer = ProductoListaSerializer(productos, many=True, campos=campos)
+    return Response(serializer.data)
+
+# Más vendidos en los últimos 7, 30 o 90 días (tabla RankingVentas)
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO, productos=True)
+@cachear_respuesta('catalogo', productos=True)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def mas_vendidos(request):
+    try:
+        campos = CatalogoService.campos_producto(request.query_params)
+        ventana = int(request.query_params.get('ventana', RankingService.VENTANA_DESTACADOS))
+        limite = min(max(int(request.query_params.get('limite', 10)), 1), 50)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    if ventana not in RankingService.VENTANAS:
+        opciones = ", ".join(str(dias) for dias in RankingService.VENTANAS)
+        return Response({"error": f"Ventana inválida. Opciones: {opciones}."}, status=status.HTTP_400_BAD_REQUEST)
+
+    productos = CatalogoService.queryset_catalogo(RankingService.mas_vendidos(ventana), campos)[:limite]
+    serializer = ProductoListaSerializer(productos, many=True, campos=campos)
+    return Response(serializer.data)
+
+# Lote de productos por ID (refresco de precios y stock del carrito)
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO, productos=True)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def lote_productos(request):
+    try:
+        ids = CatalogoService.ids_lote(request.query_params.get('ids', ''))
+        campos = CatalogoService.campos_producto(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(CatalogoService.productos_lote(ids, campos))
+
+# Puntero a los snapshots estáticos del catálogo (products.snapshots): el
+# frontend lo consulta y baja los JSON inmutables que sirve WhiteNoise.
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def snapshot_catalogo(request):
+    puntero = leer_puntero()
+    if puntero is None:
+        return Response({"error": "Todavía no se publicó ningún snapshot del catálogo."}, status=status.HTTP_404_NOT_FOUND)
+    response = Response(puntero)
+    patch_cache_control(response, public=True, max_age=10)
+    return response
+
+# Reseñas aprobadas de un producto, paginadas por cursor sobre la fecha
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO)
+@cachear_respuesta('catalogo')
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def reseñas_producto(request, producto_id):
+    if not Producto.objects.filter(id=producto_id).exists():
+        return Response({"error": "El producto no existe."}, status=status.HTTP_404_NOT_FOUND)
+
+    reseñas = Reseña.objects.filter(producto_id=producto_id, moderado=True).select_related('usuario')
+    paginator = ReseñasCursorPagination()
+    pagina = paginator.paginate_queryset(reseñas, request)
+    serializer = ReseñaSerializer(pagina, many=True)
+    return paginator.get_paginated_response(serializer.data)
+
+# "Comprados juntos": vecinos precalculados por calcular_relacionados
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO, productos=True)
+@cachear_respuesta('catalogo', productos=True)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def productos_relacionados(request, producto_id):
+    if not Producto.objects.filter(id=producto_id).exists():
+        return Response({"error": "El producto no existe."}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        campos = CatalogoService.campos_producto(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    productos = Producto.objects.filter(relacionado_en__producto_id=producto_id).order_by('relacionado_en__posicion')
+    serializer = ProductoListaSerializer(CatalogoService.queryset_catalogo(productos, campos), many=True, campos=campos)
+    return Response(serializer.data)
+
+# --- BÚSQUEDA ---
+# El ranking sale del índice en memoria; a la base solo vamos por ID.
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def buscar_productos(request):
+    consulta = request.query_params.get('q', '').strip()
+    try:
+        campos = CatalogoService.campos_producto(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        limite = min(int(request.query_params.get('limite', 20)), 50)
+    except ValueError:
+        return Response({"error": "El parámetro 'limite' debe ser un número."}, status=status.HTTP_400_BAD_REQUEST)
+
+    ids = indice_busqueda.buscar(consulta, limite=limite)
+    if not ids:
+        return Response([])
+
+    productos = CatalogoService.queryset_catalogo(Producto.objects.filter(id__in=ids), campos)
+    por_id = {producto.id: producto for producto in productos}
+    ordenados = [por_id[i] for i in ids if i in por_id]
+    serializer = ProductoListaSerializer(ordenados, many=True, campos=campos)
     return Response(serializer.data)
 
+# Autocompletado: se resuelve entero en memoria, sin consultas a MySQL
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def sugerencias_productos(request):
+    prefijo = request.query_params.get('prefijo', '')
+    try:
+        limite = min(int(request.query_params.get('limite', indice_sugerencias.K)), indice_sugerencias.K)
+    except ValueError:
+        return Response({"error": "El parámetro 'limite' debe ser un número."}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(indice_sugerencias.sugerir(prefijo, limite=limite))
+
+# Catálogo facetado: página filtrada + conteos por faceta desde los bitmaps
+@respuesta_condicional('catalogo', cache_control=CACHE_CATALOGO, productos=True)
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def catalogo_facetado(request):
+    try:
+        campos = CatalogoService.campos_producto(request.query_params)
+        filtros = CatalogoService.filtros_facetas(request.query_params)
+        offset = max(int(request.query_params.get('offset', 0)), 0)
+        page_size = min(max(int(request.query_params.get('page_size', 24)), 1), 100)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    total, ids, facetas = indice_facetas.filtrar(filtros, offset=offset, limite=page_size)
+    productos = CatalogoService.queryset_catalogo(Producto.objects.filter(id__in=ids), campos)
+    por_id = {producto.id: producto for producto in productos}
+    serializer = ProductoListaSerializer([por_id[i] for i in ids if i in por_id], many=True, campos=campos)
+    return Response({
+        "count": total,
+        "results": serializer.data,
+        "facetas": facetas,
+    })
+
+# --- COTIZACIÓN DEL CARRITO ---
+# Mismo cálculo que la compra (CompraService.precio_lineas), sin crear el
+# pedido ni bloquear filas: el frontend no tiene que recalcular precios.
+@api_view(['POST'])
+@permission_classes([AllowAny])
+def cotizar_carrito(request):
+    items = request.data.get('items', [])
+    if not items or not isinstance(items, list):
+        return Response({"error": "Carrito vacío"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(CompraService.cotizar(items))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
 # --- PROCESO DE COMPRA Y LOGS ---
 # ----En realizar_compra_carrito: Creas el pedido, descuentas el stock y generas el primer Log Persistente en MySQL y en consola. Aquí el pedido nace como PENDIENTE.-----
 @api_view(['POST'])
 @authentication_classes([TokenAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
+@con_idempotencia
 def realizar_compra_carrito(request):
     items = request.data.get('items', [])
     if not items:
@@ -68,7 +258,9 @@ def realizar_compra_carrito(request):
         print(f"\n--- [LOG DE COMPRA] {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
         print(f"USUARIO: {request.user.username} (ID: {request.user.id})")
         
-        pedido, mp_response = CompraService.ejecutar_pago_mercadopago(request.user, items)
+        pedido, mp_response = CompraService.ejecutar_pago_mercadopago(
+            request.user, items, clave=getattr(request, 'clave_idempotencia', None)
+        )
         
         # 📝 LOG PERSISTENTE EN MYSQL
         CompraLog.objects.create(
@@ -90,11 +282,8 @@ def realizar_compra_carrito(request):
         traceback.print_exc()
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-from .utils import enviar_confirmacion_compra # Importa la función que creamos
 
-
-
-#---En webhook_mercadopago: Cuando el pago se aprueba, el servidor de Mercado Pago avisa a tu API. Tu código busca el pedido por external_reference, lo marca como PAGADO y actualiza el log indicando que el email fue enviado.
+#---En webhook_mercadopago: Mercado Pago avisa a tu API cuando cambia un pago. Solo se guarda la notificación y se responde enseguida; el comando procesar_notificaciones consulta el pago, marca el pedido PAGADO, actualiza el log y manda el email (products.cola).
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
@@ -104,58 +293,28 @@ def webhook_mercadopago(request):
     
     if data.get("type") == "payment" and payment_id:
         try:
-            sdk = mercadopago.SDK(settings.MP_ACCESS_TOKEN)
-            payment_info = sdk.payment().get(payment_id)
-            
-            if payment_info["status"] == 200 and payment_info["response"]["status"] == "approved":
-                pedido_id = payment_info["response"]["external_reference"]
-                payment_id_real = payment_info["response"]["id"]
-                pedido = Pedido.objects.get(id=pedido_id)
-                
-                if pedido.estado in ['PENDIENTE', 'EN_PROCESO']:
-                    # --- NUEVA LÓGICA DE STOCK ---
-                    with transaction.atomic():
-                        # Buscamos los items que el usuario compró en este pedido
-                        items_pedido = ItemPedido.objects.filter(pedido=pedido)
-                        for item in items_pedido:
-                            producto = item.producto
-                            # Descontamos el stock aquí, al confirmar el pago
-                            producto.stock -= item.cantidad
-                            producto.save()
-                            print(f"[LOG STOCK] Descontados {item.cantidad} de {producto.nombre}")
-
-                        # Ahora sí, marcamos como pagado
-                        pedido.estado = 'PAGADO'
-                        pedido.save()
-                    
-                    # 1. ACTUALIZACIÓN DEL LOG (Instrucción 2026-01-06)
-                    # Buscamos el log que creamos al inicio (que tiene el ID del pedido como referencia temporal)
-                    log = CompraLog.objects.filter(referencia_pago=str(pedido.id)).first()
-                    if log:
-                        log.referencia_pago = str(payment_id_real)  # Actualizamos con el ID real de MP
-                        log.detalle_log += " [PAGO APROBADO]"
-                        log.save()
-
-
-                    log_msg = " [PAGO APROBADO Y STOCK ACTUALIZADO]"
-                    
-                    # 2. ENVÍO DE EMAIL
-                    try:
-                        enviar_confirmacion_compra(pedido)
-                        log_msg += " [EMAIL ENVIADO]"
-                    except Exception as e_mail:
-                        log_msg += f" [ERROR EMAIL: {str(e_mail)}]"
-
-                    if log:
-                        log.detalle_log += log_msg
-                        log.save()
-
+            encolar("payment", payment_id, data)
         except Exception as e:
+            # Sin 200 MP vuelve a mandar la notificación más tarde
             print(f"Error crítico en Webhook: {str(e)}")
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE)
     
     return Response(status=200)
+# Salud de Mercado Pago vista desde este proceso: latencias, errores y circuito
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metricas_mp(request):
+    datos = cliente_mp.metricas.resumen()
+    datos['circuito'] = cliente_mp.circuito.estado
+    return Response(datos)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@respuesta_condicional(
+    lambda request: f"pedidos:{request.user.pk}",
+    cache_control={'private': True, 'no_cache': True},
+    vary=('Cookie', 'Authorization'),
+)
 def mis_compras(request):
     pedidos = Pedido.objects.filter(usuario=request.user).order_by('-fecha_venta')
     serializer = HistorialSerializer(pedidos, many=True)
@@ -164,58 +323,50 @@ def mis_compras(request):
  
 
 
-def enviar_mails_asincronos(consulta_data):
+def encolar_mails_consulta(consulta_data):
     """
-    Función que corre en un hilo separado.
-    Incluso si Gmail falla, el servidor principal no se entera.
+    Deja en el outbox (products.correo) el aviso al administrador y la
+    respuesta de cortesía; los manda el comando enviar_emails. Va dentro de la
+    transacción de la consulta: si no se guarda, no sale ningún mail.
     """
-    try:
-        # 1. Mail para el Administrador (Herny)
-        send_mail(
-            subject=f"📩 Nueva consulta: {consulta_data['asunto']}",
-            message=f"Nombre: {consulta_data['nombre']}\n"
-                    f"Email: {consulta_data['email']}\n\n"
-                    f"Mensaje:\n{consulta_data['mensaje']}",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[settings.EMAIL_HOST_USER], # Te llega a herny3154@gmail.com
-            fail_silently=False,
-        )
+    # 1. Mail para el Administrador (Herny)
+    encolar_email(
+        f"📩 Nueva consulta: {consulta_data['asunto']}",
+        f"Nombre: {consulta_data['nombre']}\n"
+        f"Email: {consulta_data['email']}\n\n"
+        f"Mensaje:\n{consulta_data['mensaje']}",
+        [settings.EMAIL_HOST_USER],  # Te llega a herny3154@gmail.com
+    )
 
-        # 2. Mail de cortesía para el Cliente
-        send_mail(
-            subject="✨ Recibimos tu consulta - Aroma Zen",
-            message=f"Hola {consulta_data['nombre']},\n\n"
-                    f"Gracias por contactarnos. Hemos recibido tu mensaje sobre '{consulta_data['asunto']}' "
-                    f"y te responderemos a la brevedad.\n\n"
-                    f"Paz y luz,\nEl equipo de Aroma Zen.",
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[consulta_data['email']],
-            fail_silently=False,
-        )
-    except Exception as e:
-        # Esto solo se verá en los logs de Railway, no rompe la web
-        print(f"❌ Error enviando mails de fondo: {str(e)}")
+    # 2. Mail de cortesía para el Cliente
+    encolar_email(
+        "✨ Recibimos tu consulta - Aroma Zen",
+        f"Hola {consulta_data['nombre']},\n\n"
+        f"Gracias por contactarnos. Hemos recibido tu mensaje sobre '{consulta_data['asunto']}' "
+        f"y te responderemos a la brevedad.\n\n"
+        f"Paz y luz,\nEl equipo de Aroma Zen.",
+        [consulta_data['email']],
+    )
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def enviar_consulta(request):
     serializer = ConsultaSerializer(data=request.data)
     if serializer.is_valid():
-        # ✅ GUARDADO EN BASE DE DATOS (ADMIN)
-        consulta = serializer.save()
-
-        # ✅ PREPARAR DATOS PARA EL HILO
-        datos_mail = {
-            'nombre': consulta.nombre,
-            'email': consulta.email,
-            'asunto': consulta.asunto,
-            'mensaje': consulta.mensaje
-        }
-
-        # ✅ LANZAR ENVÍO DE MAILS EN SEGUNDO PLANO
-        # El usuario recibe el 201 Created de inmediato
-        thread = threading.Thread(target=enviar_mails_asincronos, args=(datos_mail,))
-        thread.start()
+        with transaction.atomic():
+            # ✅ GUARDADO EN BASE DE DATOS (ADMIN)
+            consulta = serializer.save()
+
+            # ✅ PREPARAR DATOS PARA EL ENVÍO
+            datos_mail = {
+                'nombre': consulta.nombre,
+                'email': consulta.email,
+                'asunto': consulta.asunto,
+                'mensaje': consulta.mensaje
+            }
+
+            # ✅ MAILS AL OUTBOX: el usuario recibe el 201 Created sin esperar a SMTP
+            encolar_mails_consulta(datos_mail)
 
         return Response({
             "mensaje": "¡Consulta enviada con éxito! Revisa tu casilla de correo."